@@ -13,8 +13,11 @@ from repour import asutil, clone, exception
 from repour.config import config
 from repour.lib.logs import log_util
 from repour.lib.scm import git, asgit, gitlab
+from repour.lib.telemetry import tracing
+from repour.server import task_registry
 
 from repour.adjust import (
+    alignment_cache,
     gradle_provider,
     noop_provider,
     pme_provider,
@@ -109,13 +112,27 @@ async def check_ref_exists(work_dir, ref):
     return False
 
 
-async def sync_external_repo(adjustspec, repo_provider, work_dir, configuration):
+async def sync_external_repo(
+    adjustspec,
+    repo_provider,
+    work_dir,
+    configuration,
+    internal_repo_url=None,
+    git_backend=None,
+    sync_tags=True,
+):
     """Get external repository and its ref into the internal repository
 
+    If the internal repository url and backend were already looked up, they can be passed as internal_repo_url and
+    git_backend. If sync_tags is False, the caller is responsible for fetching the tags of the internal repository
+    with 'git.fetch_tags(work_dir, remote="origin")' before tagging.
+
     return: <bool> indicate if ref is only in downstream repo (True) or is also present in upstream repo (False)
     """
-    internal_repo_url = await repo_provider(adjustspec, create=False)
-    git_backend = await asgit.detect_backend(internal_repo_url.readwrite)
+    if internal_repo_url is None:
+        internal_repo_url = await repo_provider(adjustspec, create=False)
+    if git_backend is None:
+        git_backend = await asgit.detect_backend(internal_repo_url.readwrite)
     git_user = configuration.get(git_backend).get("username")
     git_origin_repo_urls_internal = configuration.get(
         "git_origin_repo_urls_internal", []
@@ -194,7 +211,8 @@ async def sync_external_repo(adjustspec, repo_provider, work_dir, configuration)
     # At this point the target repository might have the ref we want to sync, but the local repository might not have all the tags
     # from the target repository. We need to sync tags because we use it to know if we have tags with existing changes or if we
     # need to create tags of format <version>-<sha> if existing tag with name <version> exists after pme changes
-    await git.fetch_tags(work_dir, remote="origin")
+    if sync_tags:
+        await git.fetch_tags(work_dir, remote="origin")
 
     # [NCL-6947] irrespective of the value of is_ref_revision_internal, if the originRepoUrl matches one of the urls in the config
     # 'git_origin_repo_urls_internal', the ref must be considered internal
@@ -208,10 +226,12 @@ async def sync_external_repo(adjustspec, repo_provider, work_dir, configuration)
 
 @time(REQ_TIME)
 @time(REQ_HISTOGRAM_TIME)
-async def adjust(adjustspec, repo_provider):
+async def adjust(adjustspec, repo_provider, shared_clone=None):
     """
     This method executes adjust providers as specified in configuration.
     Returns a dictionary corresponding to the HTTP response content.
+
+    If shared_clone is specified, the ref is checked out from its object store instead of being cloned (see batch.py)
     """
 
     c = await config.get_configuration()
@@ -234,95 +254,122 @@ async def adjust(adjustspec, repo_provider):
         git_backend = await asgit.detect_backend(repo_url.readwrite)
         backend_conf = c.get(git_backend)
 
-        if git_backend == "gitlab":
-            prot_tags_pattern = backend_conf.get("protected_tags_pattern")
-            if prot_tags_pattern:
-                # check protected tags setup
-                complete_path = repo_url.readwrite.split(":")[1]
-                if complete_path.endswith(".git"):
-                    complete_path = complete_path[0:-4]
-                gl = gitlab.client(backend_conf)
-                found = gitlab.check_protected_tags(
-                    backend_conf, gl=gl, project_path=complete_path
+        # Stages which don't depend on each other run concurrently: the protected tags check and the delay overlap
+        # with the clone, and the tags synchronization overlaps with the manipulator. They are joined before their
+        # result is needed.
+        background_tasks = []
+
+        try:
+            protected_tags_check = None
+            if git_backend == "gitlab" and backend_conf.get("protected_tags_pattern"):
+                protected_tags_check = start_background_task(
+                    background_tasks, check_protected_tags(backend_conf, repo_url)
                 )
-                if not found:
-                    raise Exception(
-                        f"Cannot proceed because project {complete_path} does not have "
-                        + "protected tags set up according to Repour configuration."
-                    )
 
-        process_mdc("BEGIN", "SCM_CLONE")
-        sync_enabled = await is_sync_on(adjustspec)
-        is_ref_revision_internal = True
-        if sync_enabled:
-            is_ref_revision_internal = await sync_external_repo(
-                adjustspec, repo_provider, work_dir, c
+            adjust_delay = start_background_task(
+                background_tasks, sleep_adjust_delay(c, adjustspec)
             )
-        else:
-            git_user = backend_conf.get("username")
-            await git.shallow_clone_with_tags(
-                work_dir,
-                asutil.add_username_url(repo_url.readwrite, git_user),
-                adjustspec["ref"],
+
+            process_mdc("BEGIN", "SCM_CLONE")
+            sync_enabled = await is_sync_on(adjustspec)
+            is_ref_revision_internal = True
+            if sync_enabled:
+                is_ref_revision_internal = await sync_external_repo(
+                    adjustspec,
+                    repo_provider,
+                    work_dir,
+                    c,
+                    internal_repo_url=repo_url,
+                    git_backend=git_backend,
+                    sync_tags=False,
+                )
+            else:
+                shared = shared_clone is not None and await shared_clone.checkout(
+                    work_dir, adjustspec["ref"]
+                )
+                if not shared:
+                    git_user = backend_conf.get("username")
+                    await git.shallow_clone_with_tags(
+                        work_dir,
+                        asutil.add_username_url(repo_url.readwrite, git_user),
+                        adjustspec["ref"],
+                        with_tags=False,
+                    )
+                await git.setup_git_lfs_if_present(work_dir)
+
+            upstream_commit_id = await git.rev_parse(work_dir)
+
+            await asgit.setup_commiter(expect_ok, work_dir)
+            await asgit.transform_git_submodule_into_fat_repository(work_dir)
+
+            if is_targeted_staging_enabled(c):
+                await git.enable_index_optimizations(work_dir)
+
+            # At this point the target repository might have the ref we want to sync, but the local repository might
+            # not have all the tags from the target repository. They are only needed when committing and tagging the
+            # alignment result, so fetch them while the alignment runs. The fetch does not run the automatic gc, which
+            # could conflict with the git commands of the manipulator, and is joined before Repour writes to the index
+            tags_sync = start_background_task(
+                background_tasks,
+                git.fetch_tags(
+                    work_dir, remote="origin", shallow=not sync_enabled, auto_gc=False
+                ),
             )
-            await git.setup_git_lfs_if_present(work_dir)
 
-        upstream_commit_id = await git.rev_parse(work_dir)
+            if protected_tags_check is not None:
+                await protected_tags_check
+            process_mdc("END", "SCM_CLONE")
 
-        await asgit.setup_commiter(expect_ok, work_dir)
-        await asgit.transform_git_submodule_into_fat_repository(work_dir)
-        process_mdc("END", "SCM_CLONE")
+            commit_id = await git.show_current_commit(work_dir)
+            logger.info("Current Commit ID of repo is: " + commit_id)
 
-        commit_id = await git.show_current_commit(work_dir)
-        logger.info("Current Commit ID of repo is: " + commit_id)
+            process_mdc("BEGIN", "ALIGNMENT_ADJUST")
 
-        process_mdc("BEGIN", "ALIGNMENT_ADJUST")
+            await adjust_delay
 
-        # NCLSUP-1166: add delay before adjust starts to account for a Rex bug
-        adjust_delay_seconds = c.get("adjust_delay_seconds", 0)
-        extra_adjust_parameters = adjustspec.get("adjustParameters", {})
+            ### Adjust Phase ###
+            cache_key = None
+            cache_record = None
+            if alignment_cache.is_enabled(c):
+                cache_key = await alignment_cache.fingerprint(work_dir, adjustspec, c)
+                # the recorded edits are applied to the index, not while fetching
+                await tags_sync
+                cache_record = await alignment_cache.replay(
+                    work_dir, cache_key, c, adjust_result
+                )
 
-        if "ADJUST_DELAY_SECONDS" in extra_adjust_parameters:
-            adjust_delay_seconds = int(extra_adjust_parameters["ADJUST_DELAY_SECONDS"])
+            if cache_record is not None:
+                specific_tag_name = cache_record["specificTagName"]
+            else:
+                specific_tag_name = await run_adjust_providers(
+                    build_type, work_dir, c, adjustspec, adjust_result
+                )
 
-        if adjust_delay_seconds > 0:
-            logger.info(
-                "Sleeping for "
-                + str(adjust_delay_seconds)
-                + " seconds before running alignment"
-            )
-            await asyncio.sleep(adjust_delay_seconds)
-
-        ### Adjust Phase ###
-        if build_type == "MVN":
-            specific_tag_name = await adjust_mvn(work_dir, c, adjustspec, adjust_result)
-        elif build_type == "GRADLE":
-            specific_tag_name = await adjust_gradle(
-                work_dir, c, adjustspec, adjust_result
-            )
-        elif build_type == "SBT":
-            specific_tag_name = await adjust_scala(
-                work_dir, c, adjustspec, adjust_result
-            )
-        else:
-            specific_tag_name = await adjust_project_manip(
-                work_dir, c, adjustspec, adjust_result
-            )
+            # the commands below write to the index and the repository
+            await tags_sync
 
-        is_pull_request = git.is_ref_a_pull_request(adjustspec["ref"])
+            if cache_record is None and cache_key is not None:
+                await alignment_cache.save(
+                    work_dir, cache_key, c, adjust_result, specific_tag_name
+                )
 
-        # if we are aligning from a PR, indicate it as such in the tag name
-        if is_pull_request:
-            specific_tag_name = "Pull_Request-" + specific_tag_name
-
-        result = await commit_adjustments(
-            repo_dir=work_dir,
-            repo_url=repo_url,
-            original_ref=adjustspec["ref"],
-            adjust_type=", ".join(adjust_result["adjustType"]),
-            force_continue_on_no_changes=True,
-            specific_tag_name=specific_tag_name,
-        )
+            is_pull_request = git.is_ref_a_pull_request(adjustspec["ref"])
+
+            # if we are aligning from a PR, indicate it as such in the tag name
+            if is_pull_request:
+                specific_tag_name = "Pull_Request-" + specific_tag_name
+
+            result = await commit_adjustments(
+                repo_dir=work_dir,
+                repo_url=repo_url,
+                original_ref=adjustspec["ref"],
+                adjust_type=", ".join(adjust_result["adjustType"]),
+                force_continue_on_no_changes=True,
+                specific_tag_name=specific_tag_name,
+                modified_files=adjust_result.get("modifiedFiles"),
+            )
+        finally:
+            await cancel_background_tasks(background_tasks)
 
         result = result if result is not None else {}
 
@@ -334,6 +381,108 @@ async def adjust(adjustspec, repo_provider):
     return result
 
 
+def start_background_task(background_tasks, coro):
+    """
+    Start 'coro' in a task with the log context of the current task and add it to background_tasks
+    """
+    task = log_util.create_task_with_log_context(coro)
+    background_tasks.append(task)
+    return task
+
+
+async def cancel_background_tasks(background_tasks):
+    """
+    Cancel the background tasks still running, e.g. when an earlier stage failed, and wait for them to finish
+    """
+    for task in background_tasks:
+        if not task.done():
+            task.cancel()
+
+    # also retrieves the exceptions of the tasks which were never awaited
+    await asyncio.gather(*background_tasks, return_exceptions=True)
+
+
+async def check_protected_tags(backend_conf, repo_url):
+    """
+    Verify that the GitLab project has protected tags set up according to Repour configuration
+    """
+    complete_path = repo_url.readwrite.split(":")[1]
+    if complete_path.endswith(".git"):
+        complete_path = complete_path[0:-4]
+
+    found = await gitlab.check_protected_tags(
+        backend_conf, gl=gitlab.client(backend_conf), project_path=complete_path
+    )
+    if not found:
+        raise Exception(
+            f"Cannot proceed because project {complete_path} does not have "
+            + "protected tags set up according to Repour configuration."
+        )
+
+
+async def sleep_adjust_delay(c, adjustspec):
+    # NCLSUP-1166: add delay before adjust starts to account for a Rex bug
+    adjust_delay_seconds = c.get("adjust_delay_seconds", 0)
+    extra_adjust_parameters = adjustspec.get("adjustParameters", {})
+
+    if "ADJUST_DELAY_SECONDS" in extra_adjust_parameters:
+        adjust_delay_seconds = int(extra_adjust_parameters["ADJUST_DELAY_SECONDS"])
+
+    if adjust_delay_seconds > 0:
+        logger.info(
+            "Sleeping for "
+            + str(adjust_delay_seconds)
+            + " seconds before running alignment"
+        )
+        await asyncio.sleep(adjust_delay_seconds)
+
+
+async def run_adjust_providers(build_type, work_dir, c, adjustspec, adjust_result):
+    """
+    Run the manipulator of the build type on the work directory
+
+    If targeted staging is enabled, the files modified by the manipulator are reported in adjust_result["modifiedFiles"]
+
+    Returns: the specific tag name to use, or None
+    """
+    if build_type == "MVN":
+        specific_tag_name = await adjust_mvn(work_dir, c, adjustspec, adjust_result)
+    elif build_type == "GRADLE":
+        specific_tag_name = await adjust_gradle(work_dir, c, adjustspec, adjust_result)
+    elif build_type == "SBT":
+        specific_tag_name = await adjust_scala(work_dir, c, adjustspec, adjust_result)
+    else:
+        specific_tag_name = await adjust_project_manip(
+            work_dir, c, adjustspec, adjust_result
+        )
+
+    if is_targeted_staging_enabled(c) and not uses_process_provider(build_type, c):
+        adjust_result["modifiedFiles"] = await util.get_modified_files(work_dir)
+        logger.info(
+            "Files modified by the alignment: {}".format(adjust_result["modifiedFiles"])
+        )
+
+    return specific_tag_name
+
+
+def is_targeted_staging_enabled(c):
+    return c.get("targeted_staging", {}).get("enabled", False)
+
+
+def uses_process_provider(build_type, c):
+    """
+    The 'process' provider runs arbitrary commands, which may modify any file
+    """
+    if build_type != "MVN":
+        return False
+
+    adjust_config = c.get("adjust", {})
+    return any(
+        adjust_config.get(execution_name, {}).get("provider") == "process"
+        for execution_name in adjust_config.get("executions", [])
+    )
+
+
 async def handle_build_mode(adjustspec, adjust_config):
     build_category_key = "BUILD_CATEGORY"
 
@@ -599,9 +748,12 @@ async def commit_adjustments(
     adjust_type,
     force_continue_on_no_changes=False,
     specific_tag_name=None,
+    modified_files=None,
 ):
     """
     Careful: Returns None if no changes were made, unless force_continue_on_no_changes is True
+
+    If modified_files is specified, only those files are staged. Otherwise all the changes of the working tree are
     """
     d = await asgit.push_new_dedup_branch(
         expect_ok=expect_ok,
@@ -618,11 +770,19 @@ Adjust Type: {adjust_type}
         force_continue_on_no_changes=force_continue_on_no_changes,
         real_commit_time=True,
         specific_tag_name=specific_tag_name,
+        paths=modified_files,
     )
     return d
 
 
 def process_mdc(step, name):
+    if step == "BEGIN":
+        task_registry.set_phase(name)
+        tracing.start_phase(name)
+    else:
+        task_registry.end_phase(name)
+        tracing.end_phase(name)
+
     log_util.add_update_mdc_key_value_in_task("process_stage_name", name)
     log_util.add_update_mdc_key_value_in_task("process_stage_step", step)
 
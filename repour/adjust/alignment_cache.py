@@ -0,0 +1,231 @@
+# Alignment cache
+#
+# Many adjust requests re-align a ref whose build files are byte-identical to an
+# already aligned commit, only the sources differ. The manipulators only read the
+# build descriptors, so the edits they made can be re-applied instead of running the
+# JVM again.
+#
+# A record maps a fingerprint of (build descriptor blobs, alignment parameters,
+# manipulator configuration) to the edits made by the manipulator and its result
+# data. Records expire after a TTL since the answers of the dependency analyzer
+# change over time.
+
+import asyncio
+import base64
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import time
+
+from prometheus_client import Counter
+
+from repour import exception
+from repour.adjust import util
+from repour.lib.scm import git
+
+logger = logging.getLogger(__name__)
+
+SHARED_PATH_PREFOLDER = os.environ.get("SHARED_FOLDER", "/tmp")
+ALIGNMENT_CACHE_PATH = os.path.join(SHARED_PATH_PREFOLDER, "repour-alignment-cache")
+
+DEFAULT_TTL_SECONDS = 3600
+
+# Keys of the adjust request that influence the result of the manipulators
+ALIGNMENT_SPEC_KEYS = [
+    "buildType",
+    "adjustParameters",
+    "defaultAlignmentParams",
+    "tempBuild",
+    "alignmentPreference",
+    "brewPullActive",
+]
+
+CACHE_LOOKUPS = Counter(
+    "alignment_cache_lookups", "Alignment cache lookups by outcome", ["outcome"]
+)
+
+
+def is_enabled(configuration):
+    return configuration.get("alignment_cache", {}).get("enabled", False)
+
+
+def get_ttl_seconds(configuration):
+    return configuration.get("alignment_cache", {}).get(
+        "ttl_seconds", DEFAULT_TTL_SECONDS
+    )
+
+
+def get_record_path(key, directory=None):
+    return os.path.join(directory or ALIGNMENT_CACHE_PATH, key + ".json")
+
+
+async def fingerprint(work_dir, adjustspec, configuration):
+    """
+    Compute the cache key of an alignment from the blob SHAs of the build descriptors
+    of the checked out ref and from the parameters of the alignment
+    """
+    descriptors = await git.list_index_entries(work_dir, util.BUILD_DESCRIPTOR_PATTERNS)
+
+    data = {
+        "descriptors": descriptors,
+        "spec": {key: adjustspec.get(key) for key in ALIGNMENT_SPEC_KEYS},
+        "adjust": configuration.get("adjust", {}),
+    }
+
+    encoded = json.dumps(data, sort_keys=True).encode("utf-8")
+    return hashlib.sha256(encoded).hexdigest()
+
+
+def load_record(key, ttl_seconds, directory=None):
+    """
+    Return the record stored for 'key', or None if there is none or it expired
+    """
+    path = get_record_path(key, directory)
+
+    try:
+        with open(path, "r") as f:
+            record = json.load(f)
+    except FileNotFoundError:
+        return None
+    except ValueError:
+        logger.warning("Ignoring corrupted alignment cache record " + path)
+        return None
+
+    if time.time() - record["created"] > ttl_seconds:
+        logger.info("Alignment cache record {} expired".format(key))
+        CACHE_LOOKUPS.labels("expired").inc()
+        remove_record(path)
+        return None
+
+    return record
+
+
+def store_record(key, record, directory=None):
+    directory = directory or ALIGNMENT_CACHE_PATH
+    os.makedirs(directory, exist_ok=True)
+
+    # write to a temporary file first so that readers never see a partial record
+    fd, temp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w") as f:
+            json.dump(record, f)
+        os.replace(temp_path, get_record_path(key, directory))
+    except Exception:
+        remove_record(temp_path)
+        raise
+
+
+def remove_record(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def prune_records(ttl_seconds, directory=None):
+    """
+    Remove the records older than the TTL
+    """
+    directory = directory or ALIGNMENT_CACHE_PATH
+    now = time.time()
+
+    try:
+        names = os.listdir(directory)
+    except FileNotFoundError:
+        return
+
+    for name in names:
+        path = os.path.join(directory, name)
+        try:
+            if now - os.path.getmtime(path) > ttl_seconds:
+                remove_record(path)
+        except OSError:
+            pass
+
+
+def to_files_json(files):
+    return {
+        path: None if entry is None else list(entry) for path, entry in files.items()
+    }
+
+
+async def replay(work_dir, key, configuration, adjust_result):
+    """
+    Re-apply the edits recorded for 'key' on the work directory.
+
+    The resulting changed files are compared with the ones recorded after the original
+    alignment. If anything differs, the work directory is reset and the manipulator
+    has to run.
+
+    Returns: the record if it was applied, None otherwise
+    """
+    # the cache folder is shared, possibly on a network filesystem
+    loop = asyncio.get_running_loop()
+    record = await loop.run_in_executor(
+        None, load_record, key, get_ttl_seconds(configuration)
+    )
+
+    if record is None:
+        logger.info("No alignment cache record for " + key)
+        CACHE_LOOKUPS.labels("miss").inc()
+        return None
+
+    logger.info("Re-applying the alignment edits of cache record " + key)
+
+    with tempfile.NamedTemporaryFile(suffix=".patch") as patch_file:
+        patch_file.write(base64.b64decode(record["patch"]))
+        patch_file.flush()
+
+        try:
+            if record["patch"]:
+                await git.apply_to_index(work_dir, patch_file.name)
+        except exception.CommandError:
+            logger.warning("Recorded alignment edits do not apply, running alignment")
+            CACHE_LOOKUPS.labels("invalid").inc()
+            return None
+
+    files = to_files_json(await git.diff_index_files(work_dir))
+    if files != record["files"]:
+        logger.warning(
+            "Re-applied alignment edits do not match the recorded result, running alignment"
+        )
+        CACHE_LOOKUPS.labels("invalid").inc()
+        await git.reset_hard(work_dir)
+        return None
+
+    adjust_result["adjustType"].extend(record["adjustType"])
+    adjust_result["resultData"] = record["resultData"]
+    adjust_result["modifiedFiles"] = sorted(record["files"])
+
+    CACHE_LOOKUPS.labels("hit").inc()
+    return record
+
+
+async def save(work_dir, key, configuration, adjust_result, specific_tag_name):
+    """
+    Store the edits made by the manipulator in the work directory for 'key'
+    """
+    if adjust_result.get("modifiedFiles") is None:
+        await git.add_all(work_dir)
+    else:
+        await git.add_paths(work_dir, adjust_result["modifiedFiles"])
+
+    patch = await git.diff_index_binary(work_dir)
+    files = await git.diff_index_files(work_dir)
+
+    record = {
+        "created": time.time(),
+        "patch": base64.b64encode(patch).decode("ascii"),
+        "files": to_files_json(files),
+        "adjustType": adjust_result["adjustType"],
+        "resultData": adjust_result["resultData"],
+        "specificTagName": specific_tag_name,
+    }
+
+    loop = asyncio.get_running_loop()
+    await loop.run_in_executor(None, store_record, key, record)
+    logger.info("Stored alignment edits in cache record " + key)
+
+    await loop.run_in_executor(None, prune_records, get_ttl_seconds(configuration))
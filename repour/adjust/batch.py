@@ -0,0 +1,221 @@
+# Batch adjust
+#
+# PNC often sends several adjust requests for the same repository in a burst, for
+# different refs or for the same ref with different build configs. The refs of all
+# the requests of a batch targeting the same internal repository are fetched once
+# into a shared object store. Each alignment then runs in its own lightweight
+# workspace, which borrows the objects of the store through git alternates instead
+# of cloning the repository again.
+
+import asyncio
+import logging
+import os
+import tempfile
+
+from repour import asutil, exception
+from repour.adjust import adjust
+from repour.config import config
+from repour.lib.scm import asgit, git
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CONCURRENCY = 4
+
+# namespace of the refs fetched into the shared object store
+STORE_REF_PREFIX = "refs/repour-batch/"
+
+expect_ok = asutil.expect_ok_closure(exception.AdjustCommandError)
+
+
+class SharedClone(object):
+    """
+    Object store shared by the workspaces of the adjust requests of one repository.
+
+    The refs are fetched on the first checkout. The store is removed once every
+    request released it.
+    """
+
+    def __init__(self, url, refs):
+        self.url = url
+        self.refs = sorted(set(refs))
+        self.store_dir = None
+        self.fetched_refs = set()
+        self.users = 0
+        self.lock = asyncio.Lock()
+        self.prepared = False
+
+    def acquire(self):
+        self.users += 1
+
+    async def release(self):
+        self.users -= 1
+        if self.users == 0 and self.store_dir is not None:
+            store_dir = self.store_dir
+            self.store_dir = None
+            await asutil.rmtree(store_dir, ignore_errors=True)
+
+    def get_store_ref(self, ref):
+        return STORE_REF_PREFIX + str(self.refs.index(ref))
+
+    async def prepare(self):
+        async with self.lock:
+            if self.prepared:
+                return
+            self.prepared = True
+
+            self.store_dir = tempfile.mkdtemp(suffix="git", prefix="batch")
+            await expect_ok(
+                cmd=["git", "init", "--bare", self.store_dir],
+                desc="Could not create shared object store with git",
+            )
+
+            refspecs = [ref + ":" + self.get_store_ref(ref) for ref in self.refs]
+            try:
+                await self.fetch(refspecs)
+                self.fetched_refs.update(self.refs)
+            except exception.CommandError:
+                # one bad ref fails the whole fetch, retry them one by one so that the
+                # others can still share the store
+                logger.warning("Could not fetch all the refs at once, retrying per ref")
+                for ref, refspec in zip(self.refs, refspecs):
+                    try:
+                        await self.fetch([refspec])
+                        self.fetched_refs.add(ref)
+                    except exception.CommandError:
+                        logger.warning("Could not fetch ref {} in batch".format(ref))
+
+            # the tags are synced again per request, fetching them here means their
+            # objects don't have to be transferred for each request
+            try:
+                await git.fetch_tags(self.store_dir, remote=self.url, shallow=True)
+            except exception.CommandError:
+                logger.warning("Could not fetch tags in shared object store")
+
+    async def fetch(self, refspecs):
+        await expect_ok(
+            cmd=["git", "fetch", "--depth", "1", self.url] + refspecs,
+            desc="Could not fetch refs into shared object store with git",
+            cwd=self.store_dir,
+            print_cmd=True,
+        )
+
+    async def checkout(self, work_dir, ref):
+        """
+        Set up the workspace for 'ref' from the shared object store, as
+        'git.shallow_clone_with_tags(work_dir, url, ref, with_tags=False)' would do.
+
+        Returns: False if the ref is not in the store, in which case the workspace is
+        left untouched
+        """
+        await self.prepare()
+
+        if ref not in self.fetched_refs:
+            return False
+
+        os.makedirs(work_dir, exist_ok=True)
+        await git.init(work_dir)
+
+        alternates_path = os.path.join(
+            work_dir, ".git", "objects", "info", "alternates"
+        )
+        with open(alternates_path, "w") as f:
+            f.write(os.path.join(self.store_dir, "objects") + "\n")
+
+        await git.add_remote(work_dir, "origin", self.url)
+
+        # all the objects are already available through the alternates, so this only
+        # creates FETCH_HEAD and the shallow boundary
+        await expect_ok(
+            cmd=[
+                "git",
+                "fetch",
+                "--update-shallow",
+                self.store_dir,
+                self.get_store_ref(ref),
+            ],
+            desc="Could not fetch ref from shared object store with git",
+            cwd=work_dir,
+            print_cmd=True,
+        )
+        await git.checkout(work_dir, "FETCH_HEAD")
+
+        return True
+
+
+async def get_shared_url(adjustspec, repo_provider):
+    """
+    Returns: the internal repository URL to share for the adjust spec, or None if the
+             spec clones on its own. A spec whose repository can't be found clones on
+             its own too, and fails in its own request
+    """
+    try:
+        if await adjust.is_sync_on(adjustspec):
+            return None
+
+        c = await config.get_configuration()
+        repo_url = await repo_provider(adjustspec, create=False)
+        git_backend = await asgit.detect_backend(repo_url.readwrite)
+        git_user = c.get(git_backend).get("username")
+        return asutil.add_username_url(repo_url.readwrite, git_user)
+    except Exception:
+        logger.warning(
+            "Could not find the internal repository of ref {}, not sharing its "
+            "clone".format(adjustspec.get("ref")),
+            exc_info=True,
+        )
+        return None
+
+
+async def create_shared_clones(adjustspecs, repo_provider):
+    """
+    Group the adjust specs by internal repository
+
+    Specs with sync enabled clone from their origin repository and are not grouped.
+
+    Returns: list with the SharedClone of each spec, or None
+    """
+    urls = [await get_shared_url(spec, repo_provider) for spec in adjustspecs]
+
+    shared_clones = {}
+    for url in set(urls) - {None}:
+        refs = [spec["ref"] for spec, u in zip(adjustspecs, urls) if u == url]
+        shared_clones[url] = SharedClone(url, refs)
+
+    result = []
+    for url in urls:
+        shared_clone = shared_clones.get(url)
+        if shared_clone is not None:
+            shared_clone.acquire()
+        result.append(shared_clone)
+
+    return result
+
+
+def prepare(adjustspecs, repo_provider):
+    """
+    Returns: the coroutine function to run for each adjust spec of the batch
+    """
+    c = config.get_configuration_sync()
+    concurrency = c.get("adjust_batch", {}).get("concurrency", DEFAULT_CONCURRENCY)
+    semaphore = asyncio.Semaphore(concurrency)
+
+    shared_clones_task = asyncio.get_event_loop().create_task(
+        create_shared_clones(adjustspecs, repo_provider)
+    )
+
+    def adjust_coro(index):
+        async def run(adjustspec, repo_provider):
+            shared_clone = (await asyncio.shield(shared_clones_task))[index]
+
+            try:
+                async with semaphore:
+                    return await adjust.adjust(
+                        adjustspec, repo_provider, shared_clone=shared_clone
+                    )
+            finally:
+                if shared_clone is not None:
+                    await shared_clone.release()
+
+        return run
+
+    return [adjust_coro(index) for index in range(len(adjustspecs))]
@@ -1,9 +1,8 @@
-import json
 import logging
 import os
 
 from repour import asutil
-from repour.adjust import pme_provider, process_provider, util
+from repour.adjust import pme_provider, process_provider, result_parser, util
 from repour.lib.scm import git
 
 logger = logging.getLogger(__name__)
@@ -156,10 +155,10 @@ def get_gradle_provider(
         if os.path.isfile(alignment_report_file_path):
             file_path = alignment_report_file_path
             logger.info("Reading '{}' file with alignment result".format(file_path))
-            return pme_provider.parse_pme_result_manipulation_format(
+            return pme_provider.parse_pme_result_manipulation_file(
                 work_dir,
                 default_parameters,
-                open(file_path).read(),
+                file_path,
                 group_id,
                 artifact_id,
             )
@@ -206,17 +205,10 @@ def parse_gme_manipulation_json(
         "RemovedRepositories": [],
     }
 
-    with open(file_path, "r") as f:
-        result = json.load(f)
-        template["VersioningState"]["executionRootModified"]["groupId"] = result[
-            "group"
-        ]
-        template["VersioningState"]["executionRootModified"]["artifactId"] = result[
-            "name"
-        ]
-        template["VersioningState"]["executionRootModified"]["version"] = result[
-            "version"
-        ]
+    result = result_parser.extract_json_fields(file_path, ["group", "name", "version"])
+    template["VersioningState"]["executionRootModified"]["groupId"] = result["group"]
+    template["VersioningState"]["executionRootModified"]["artifactId"] = result["name"]
+    template["VersioningState"]["executionRootModified"]["version"] = result["version"]
 
     if group_id is not None and artifact_id is not None:
         logger.warning("Overriding the groupId of the result to: " + group_id)
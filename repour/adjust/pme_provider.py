@@ -4,12 +4,10 @@ import logging
 import os
 import re
 import shlex
-import xml.etree.ElementTree as ET
-from xml.dom import minidom
 from pathlib import Path
 
 from repour import exception
-from repour.adjust import process_provider, util
+from repour.adjust import process_provider, result_parser, util
 
 logger = logging.getLogger(__name__)
 
@@ -53,16 +51,15 @@ def get_pme_provider(
             file_path = result_file_path_manipulation
 
         if file_path is not None:
-            with open(file_path, "r") as file:
-                logger.info("Getting results from file: " + file_path)
-                return parse_pme_result_manipulation_format(
-                    work_dir,
-                    pme_and_extra_params,
-                    file.read(),
-                    group_id,
-                    artifact_id,
-                    verbose=verbose,
-                )
+            logger.info("Getting results from file: " + file_path)
+            return parse_pme_result_manipulation_file(
+                work_dir,
+                pme_and_extra_params,
+                file_path,
+                group_id,
+                artifact_id,
+                verbose=verbose,
+            )
         else:
             logger.warn("Couldn't capture any result file from PME")
             return None
@@ -230,62 +227,7 @@ async def get_version_from_pme_result(pme_result):
 
 
 async def get_gav_from_pom(pom_xml_file):
-    tree = ET.parse(pom_xml_file)
-    root = tree.getroot()
-
-    if "{" in root.tag and "}" in root.tag:
-        namespace_search = "{{{}}}".format(root.tag.split("}")[0].strip("{"))
-    else:
-        namespace_search = ""
-
-    parent = root.find(namespace_search + "parent")
-    parent_group_id = None
-    parent_version = None
-
-    # https://maven.apache.org/pom.html#Maven_Coordinates
-    # Docs concerning how inheritance of groupId and version from parent
-    if parent is not None:
-        parent_group_id_elem = parent.find(namespace_search + "groupId")
-        parent_version_elem = parent.find(namespace_search + "version")
-
-        if parent_group_id_elem is not None:
-            parent_group_id = parent_group_id_elem.text
-
-        if parent_version_elem is not None:
-            parent_version = parent_version_elem.text
-
-    group_id_elem = root.find(namespace_search + "groupId")
-
-    if group_id_elem is not None:
-        group_id = group_id_elem.text
-
-    elif (group_id_elem is None) and (parent_group_id is not None):
-        logger.info("Using parent groupId information")
-        group_id = parent_group_id
-
-    else:
-        raise Exception("Could not find the groupId in the pom.xml")
-
-    artif_id_elem = root.find(namespace_search + "artifactId")
-
-    if artif_id_elem is not None:
-        artif_id = artif_id_elem.text
-    else:
-        raise Exception("Could not find the artifactId in the pom.xml")
-
-    version_elem = root.find(namespace_search + "version")
-
-    if version_elem is not None:
-        version = version_elem.text
-
-    elif (version_elem is None) and (parent_version is not None):
-        logger.info("Using parent version information")
-        version = parent_version
-
-    else:
-        raise Exception("Could not find the version in the pom.xml")
-
-    return (group_id, artif_id, version)
+    return result_parser.get_gav_from_pom(pom_xml_file)
 
 
 async def create_pme_result_file(repo_dir):
@@ -324,6 +266,25 @@ def parse_pme_result_manipulation_format(
 
     data = json.loads(raw_result_data)
 
+    return build_pme_result(work_dir, pme_parameters, data, group_id, artifact_id)
+
+
+def parse_pme_result_manipulation_file(
+    work_dir, pme_parameters, file_path, group_id, artifact_id, verbose=True
+):
+    """
+    Same as parse_pme_result_manipulation_format, but only reads the 'executionRoot'
+    part of the result file instead of loading it whole
+    """
+    data = result_parser.extract_json_fields(file_path, ["executionRoot"])
+
+    if verbose:
+        logger.info('Got PME result data: "{data}".'.format(**locals()))
+
+    return build_pme_result(work_dir, pme_parameters, data, group_id, artifact_id)
+
+
+def build_pme_result(work_dir, pme_parameters, data, group_id, artifact_id):
     pme_result = {"VersioningState": {"executionRootModified": {}}}
 
     if group_id is not None and artifact_id is not None:
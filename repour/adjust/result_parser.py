@@ -0,0 +1,271 @@
+# Result parsing utility functions
+#
+# Alignment reports and pom files of large multi-module projects can be tens of
+# MB. Repour only returns a handful of fields from them, so the functions here
+# read the files incrementally and stop as soon as those fields are known.
+
+import json
+import logging
+import re
+import xml.etree.ElementTree as ET
+
+logger = logging.getLogger(__name__)
+
+READ_CHUNK_SIZE = 65536
+
+POM_COORDINATES = ("groupId", "artifactId", "version")
+
+_json_decoder = json.JSONDecoder()
+_json_whitespace = re.compile(r"[ \t\n\r]*")
+_json_structural = re.compile(r'["{}\[\]]')
+_json_string_special = re.compile(r'["\\]')
+
+
+def local_name(tag):
+    """
+    Return the tag name without its '{namespace}' prefix
+    """
+    return tag.rsplit("}", 1)[-1]
+
+
+class _JsonStream(object):
+    """
+    Minimal pull reader over a JSON text file, keeping only the unread part of the
+    current chunk in memory
+    """
+
+    def __init__(self, f):
+        self.f = f
+        self.buf = ""
+        self.pos = 0
+        self.eof = False
+
+    def _fill(self):
+        chunk = self.f.read(READ_CHUNK_SIZE)
+        if not chunk:
+            self.eof = True
+            return False
+        self.buf = self.buf[self.pos :] + chunk
+        self.pos = 0
+        return True
+
+    def _need_more(self):
+        if not self._fill():
+            raise ValueError("Unexpected end of JSON file " + self.f.name)
+
+    def peek(self):
+        while True:
+            self.pos = _json_whitespace.match(self.buf, self.pos).end()
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            self._need_more()
+
+    def expect(self, char):
+        found = self.peek()
+        if found != char:
+            raise ValueError(
+                "Expected '{}' but found '{}' in JSON file {}".format(
+                    char, found, self.f.name
+                )
+            )
+        self.pos += 1
+
+    def decode(self):
+        """
+        Decode the next JSON value. Only use it for values known to be small
+        """
+        self.peek()
+        while True:
+            try:
+                value, end = _json_decoder.raw_decode(self.buf, self.pos)
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+                self._fill()
+                continue
+
+            # a number at the very end of the buffer might continue in the next chunk
+            if end == len(self.buf) and not self.eof and self._fill():
+                continue
+
+            self.pos = end
+            return value
+
+    def skip_value(self):
+        """
+        Move past the next JSON value without building it
+        """
+        if self.peek() not in "{[":
+            self.decode()
+            return
+
+        depth = 0
+        in_string = False
+
+        while True:
+            pattern = _json_string_special if in_string else _json_structural
+            m = pattern.search(self.buf, self.pos)
+
+            if m is None:
+                self.pos = len(self.buf)
+                self._need_more()
+                continue
+
+            char = m.group()
+            if char == "\\":
+                # keep the backslash in the buffer if the escaped char is in the next chunk
+                if m.end() >= len(self.buf):
+                    self.pos = m.start()
+                    self._need_more()
+                    continue
+                self.pos = m.end() + 1
+            elif char == '"':
+                in_string = not in_string
+                self.pos = m.end()
+            elif char in "{[":
+                depth += 1
+                self.pos = m.end()
+            else:
+                depth -= 1
+                self.pos = m.end()
+                if depth == 0:
+                    return
+
+
+def extract_json_fields(file_path, fields):
+    """
+    Read the top-level 'fields' of the JSON object stored in 'file_path'.
+
+    Values of other keys are skipped without being decoded, and reading stops once all
+    the fields are found.
+
+    Returns: dict of field name to value, for the fields present in the file
+    """
+    wanted = set(fields)
+    found = {}
+
+    with open(file_path, "r", encoding="utf-8") as f:
+        stream = _JsonStream(f)
+        stream.expect("{")
+
+        if stream.peek() == "}":
+            return found
+
+        while wanted:
+            key = stream.decode()
+            stream.expect(":")
+
+            if key in wanted:
+                found[key] = stream.decode()
+                wanted.discard(key)
+            else:
+                stream.skip_value()
+
+            if stream.peek() == "}":
+                break
+            stream.expect(",")
+
+    return found
+
+
+def get_gav_from_pom(pom_xml_file):
+    """
+    Read the groupId, artifactId and version of a pom.xml, falling back to the parent
+    groupId and version if needed.
+
+    Parsing stops as soon as all the coordinates of the project are found.
+
+    Returns: tuple (group_id, artifact_id, version)
+    """
+    coordinates = {}
+    parent_coordinates = {}
+
+    depth = 0
+    in_parent = False
+
+    with open(pom_xml_file, "rb") as f:
+        for event, elem in ET.iterparse(f, events=("start", "end")):
+            if event == "start":
+                depth += 1
+                if depth == 2 and local_name(elem.tag) == "parent":
+                    in_parent = True
+                continue
+
+            name = local_name(elem.tag)
+
+            if depth == 2:
+                if name in POM_COORDINATES:
+                    coordinates[name] = elem.text
+                elif name == "parent":
+                    in_parent = False
+
+                # children of the project are not needed anymore, free them
+                elem.clear()
+
+                if len(coordinates) == len(POM_COORDINATES):
+                    break
+
+            elif depth == 3 and in_parent and name in ("groupId", "version"):
+                parent_coordinates[name] = elem.text
+
+            depth -= 1
+
+    # https://maven.apache.org/pom.html#Maven_Coordinates
+    # Docs concerning how inheritance of groupId and version from parent
+    if "groupId" in coordinates:
+        group_id = coordinates["groupId"]
+    elif parent_coordinates.get("groupId") is not None:
+        logger.info("Using parent groupId information")
+        group_id = parent_coordinates["groupId"]
+    else:
+        raise Exception("Could not find the groupId in the pom.xml")
+
+    if "artifactId" in coordinates:
+        artif_id = coordinates["artifactId"]
+    else:
+        raise Exception("Could not find the artifactId in the pom.xml")
+
+    if "version" in coordinates:
+        version = coordinates["version"]
+    elif parent_coordinates.get("version") is not None:
+        logger.info("Using parent version information")
+        version = parent_coordinates["version"]
+    else:
+        raise Exception("Could not find the version in the pom.xml")
+
+    return (group_id, artif_id, version)
+
+
+def parse_removed_repos(file_path):
+    """
+    Read the repositories of a PME repository removal backup file
+
+    Returns: list of dict with keys 'releases', 'snapshots', 'name', 'id' and 'url'
+    """
+    result = []
+
+    with open(file_path, "rb") as f:
+        for event, elem in ET.iterparse(f, events=("end",)):
+            if local_name(elem.tag) != "repository":
+                continue
+
+            repo = {
+                "releases": True,
+                "snapshots": True,
+                "name": "",
+                "id": "",
+                "url": "",
+            }
+            for child in elem.iter():
+                name = local_name(child.tag)
+                if name in ("releases", "snapshots"):
+                    for enabled_elem in child:
+                        if local_name(enabled_elem.tag) == "enabled":
+                            repo[name] = enabled_elem.text == "true"
+                elif name in ("id", "name", "url") and child.text:
+                    repo[name] = child.text
+            result.append(repo)
+
+            elem.clear()
+
+    return result
@@ -1,10 +1,9 @@
-import json
 import logging
 import os
 import shlex
 
 from repour import exception
-from repour.adjust import pme_provider, process_provider, util
+from repour.adjust import pme_provider, process_provider, result_parser, util
 
 logger = logging.getLogger(__name__)
 
@@ -49,24 +48,21 @@ def get_scala_provider(
             file_path = manipulation_file_path
             logger.info("Reading '{}' file with alignment result".format(file_path))
 
-            with open(file_path, "r") as f:
-                # SMEG returns manipulations.json file already in correct format
-                result = json.load(f)
-                if group_id is not None and artifact_id is not None:
-                    logger.warning(
-                        "Overriding the groupId of the result to: " + group_id
-                    )
-                    result["VersioningState"]["executionRootModified"][
-                        "groupId"
-                    ] = group_id
-
-                    logger.warning(
-                        "Overriding the artifactId of the result to: " + artifact_id
-                    )
-                    result["VersioningState"]["executionRootModified"][
-                        "artifactId"
-                    ] = artifact_id
-                return result
+            # SMEG returns manipulations.json file already in correct format
+            result = result_parser.extract_json_fields(
+                file_path, ["VersioningState", "RemovedRepositories"]
+            )
+            if group_id is not None and artifact_id is not None:
+                logger.warning("Overriding the groupId of the result to: " + group_id)
+                result["VersioningState"]["executionRootModified"]["groupId"] = group_id
+
+                logger.warning(
+                    "Overriding the artifactId of the result to: " + artifact_id
+                )
+                result["VersioningState"]["executionRootModified"][
+                    "artifactId"
+                ] = artifact_id
+            return result
         else:
             return {
                 "VersioningState": {
@@ -1,24 +1,40 @@
 # flake8: noqa
 import argparse
-import asyncio
 import logging
 import os
 import re
-from xml.dom import minidom
 
 from repour import asutil, exception
+from repour.adjust import result_parser
 
 from opentelemetry import trace
 from opentelemetry.trace import format_span_id, format_trace_id
 from opentelemetry.trace.span import TraceFlags, TraceState
 
 from repour.lib.logs import log_util
+from repour.lib.scm import git
 
 logger = logging.getLogger(__name__)
 
 REPOUR_JAVA_KEY = "-DRepour_Java="
 SERVICE_BUILD_CATEGORY = "SERVICE"
 
+# Files read by the manipulators to compute the alignment, as glob patterns relative
+# to any directory of the repository
+BUILD_DESCRIPTOR_PATTERNS = [
+    "pom.xml",
+    "*.gradle",
+    "*.gradle.kts",
+    "gradle.properties",
+    "gradle/*.toml",
+    "*.sbt",
+    "project/*.scala",
+    "project/*.properties",
+    "package.json",
+    "package-lock.json",
+    "npm-shrinkwrap.json",
+]
+
 stdout_options = asutil.process_stdout_options
 stderr_options = asutil.process_stderr_options
 
@@ -40,27 +56,7 @@ def get_removed_repos(work_dir, parameters):
             )
 
             if os.path.exists(filepath):
-                tree = minidom.parse(filepath)
-                for repo_elem in tree.getElementsByTagName("repository"):
-                    repo = {
-                        "releases": True,
-                        "snapshots": True,
-                        "name": "",
-                        "id": "",
-                        "url": "",
-                    }
-                    for enabled_elem in repo_elem.getElementsByTagName("enabled"):
-                        if enabled_elem.parentNode.localName in [
-                            "releases",
-                            "snapshots",
-                        ]:
-                            bool_value = enabled_elem.childNodes[0].data == "true"
-                            repo[enabled_elem.parentNode.localName] = bool_value
-                    for tag in ["id", "name", "url"]:
-                        for elem in repo_elem.getElementsByTagName(tag):
-                            if elem.childNodes:
-                                repo[tag] = elem.childNodes[0].data
-                    result.append(repo)
+                result = result_parser.parse_removed_repos(filepath)
                 break
             else:
                 logger.info(
@@ -218,6 +214,18 @@ def get_param_value(name, params1, params2=[], params3=[]):
     return None
 
 
+async def get_modified_files(repo_dir):
+    """
+    Return the files modified by the manipulator, as git sees them: the tracked files modified or deleted, and the new
+    files which are not ignored
+
+    Returns: sorted list of paths relative to repo_dir
+    """
+    modified = await git.list_modified_files(repo_dir)
+    modified.extend(await git.list_untracked_files(repo_dir))
+    return sorted(set(modified))
+
+
 async def print_java_version(java_bin_dir=""):
     if java_bin_dir and java_bin_dir.endswith("/"):
         command = java_bin_dir + "java"
@@ -285,16 +293,16 @@ async def generate_user_context() -> UserContextFormatter:
     else:
         current_traceparent = ""
 
-    current_task = asyncio.current_task()
+    mdc = log_util.get_mdc()
 
     mdc_headers = {
-        "log-user-id": current_task.mdc["userId"],
-        "log-request-context": current_task.mdc["requestContext"],
-        "log-process-context": current_task.mdc["processContext"],
-        "log-expires": current_task.mdc["expires"],
-        "log-tmp": current_task.mdc["tmp"],
-        "trace-id": current_task.mdc["trace_id"],
-        "span-id": current_task.mdc["span_id"],
+        "log-user-id": mdc["userId"],
+        "log-request-context": mdc["requestContext"],
+        "log-process-context": mdc["processContext"],
+        "log-expires": mdc["expires"],
+        "log-tmp": mdc["tmp"],
+        "trace-id": mdc["trace_id"],
+        "span-id": mdc["span_id"],
         "traceparent": current_traceparent,
     }
 
@@ -5,11 +5,16 @@ import os
 import re
 import shutil
 import tempfile
+import time
 import urllib.parse
 
 import aiohttp
 
 from repour import exception
+from repour.config import config
+from repour.lib.scm import connection_reuse
+from repour.lib.telemetry import tracing
+from repour.server import task_registry
 
 logger = logging.getLogger(__name__)
 subprocess_logger = logging.getLogger(__name__ + ".stderr")
@@ -173,34 +178,73 @@ def expect_ok_closure(exc_type=exception.CommandError):
             # Only partially override the existing environment
             sub_env.update(env)
 
+        if cmd[0] == "git":
+            # reuse the connections to the remotes across the git commands, if enabled
+            sub_env.update(
+                connection_reuse.get_git_env(config.get_configuration_sync(), sub_env)
+            )
+
         if print_cmd:
             logger.info("Running command: {}".format(cmd))
 
-        p = await asyncio.create_subprocess_exec(
-            *cmd,
-            stdin=asyncio.subprocess.DEVNULL,
-            stdout=None
-            if stdout == process_stdout_options["ignore"]
-            else asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.STDOUT
-            if stderr == process_stderr_options["stdout"]
-            else asyncio.subprocess.PIPE,
-            env=sub_env,
-            cwd=cwd,
-            limit=100 * 1024 * 1024
-        )
-
-        if live_log:
-            stdout_text, stderr_text = await print_live_log(p)
-            await p.wait()
-        else:
-            stdout_data, stderr_data = await p.communicate()
-            stderr_text = (
-                "" if stderr_data is None else _convert_bytes(stderr_data, "text")
+        # imported here: repour.main imports this module before the workers set up the
+        # multiprocess mode of prometheus_client, chosen when it is imported
+        from repour.server import command_metrics
+
+        executable, subcommand = command_metrics.get_command_labels(cmd)
+        with tracing.span(
+            "exec {} {}".format(executable, subcommand).strip(),
+            attributes={
+                "process.executable.name": executable,
+                "process.command_args": command_metrics.summarize(cmd),
+            },
+        ) as span:
+            # continue the trace in the command, such as the manipulators
+            sub_env.update(tracing.get_trace_env())
+
+            start_time = time.monotonic()
+            p = await asyncio.create_subprocess_exec(
+                *cmd,
+                stdin=asyncio.subprocess.DEVNULL,
+                stdout=None
+                if stdout == process_stdout_options["ignore"]
+                else asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.STDOUT
+                if stderr == process_stderr_options["stdout"]
+                else asyncio.subprocess.PIPE,
+                env=sub_env,
+                cwd=cwd,
+                limit=100 * 1024 * 1024
             )
-            stdout_text = (
-                "" if stdout_data is None else _convert_bytes(stdout_data, "text")
+
+            task_registry.add_pid(p.pid)
+            try:
+                if live_log:
+                    stdout_text, stderr_text = await print_live_log(p)
+                    await p.wait()
+                    output_bytes = len(stdout_text.encode("utf-8"))
+                else:
+                    stdout_data, stderr_data = await p.communicate()
+                    stderr_text = (
+                        ""
+                        if stderr_data is None
+                        else _convert_bytes(stderr_data, "text")
+                    )
+                    stdout_text = (
+                        ""
+                        if stdout_data is None
+                        else _convert_bytes(stdout_data, "text")
+                    )
+                    output_bytes = len(stdout_data or b"") + len(stderr_data or b"")
+            finally:
+                task_registry.remove_pid(p.pid)
+
+            command_metrics.record(
+                cmd, cwd, p.returncode, time.monotonic() - start_time, output_bytes
             )
+            span.set_attribute("process.exit.code", p.returncode)
+            if p.returncode != 0:
+                tracing.set_error(span, "Exit code {}".format(p.returncode))
 
         if stderr_text != "":
             if stderr == "log_on_error" and p.returncode != 0:
@@ -20,6 +20,7 @@ async def get_oauth2_jwt_handler(app, next_handler):
         if (
             request.path == "/"
             or request.path == "/git-external-to-internal"
+            or request.path == "/git-external-to-internal/batch"
             or request.path == "/metrics"
             or request.path == "/version"
         ):
@@ -4,19 +4,41 @@
 #
 # Requires the REPOUR_OIDC_SERVICE_ACCOUNT_SECRET env var to be set
 #
+# The token is refreshed in the background before it expires, so that the callers get
+# the cached token without waiting. Callers needing a token while none is valid share
+# a single request to the token issuer.
+#
+import asyncio
 import datetime
+import logging
 import os
+import random
 from datetime import timedelta
 
 import aiohttp
+from prometheus_client import Counter, Histogram
 
 from repour.config import config
 
+logger = logging.getLogger(__name__)
+
 TOKEN_TIME_SKEW_SECONDS = 60
 
+# the token is refreshed once this part of its lifetime has passed
+REFRESH_LIFETIME_RATIO = 0.8
+MIN_RETRY_DELAY_SECONDS = 1
+MAX_RETRY_DELAY_SECONDS = 60
+
+TOKEN_REQUEST_TIMEOUT = aiohttp.ClientTimeout(total=30)
 
-# Should be a dict with keys 'token' and 'expiry_date'
-current_token = None
+TOKEN_REFRESH_TIME = Histogram(
+    "service_account_token_refresh_time",
+    "Time spent getting a new access token for the service account",
+)
+TOKEN_REFRESH_FAILURES = Counter(
+    "service_account_token_refresh_failures",
+    "Failed requests for a new access token of the service account",
+)
 
 
 async def access_token():
@@ -24,17 +46,13 @@ async def access_token():
     Try to return the cached current token if present and not yet expired.
     Otherwise, try to get a new access token and update the cache
     """
-    global current_token
-
-    if current_token is None or is_expired(current_token):
-        current_token = await get_new_access_token()
-
-    return current_token["token"]
+    return await token_manager.access_token()
 
 
-async def get_new_access_token():
+async def get_new_access_token(session=None):
     """
-    Return a new access token dict containing the 'token' and the 'expiry_date'
+    Return a new access token dict containing the 'token', the 'expiry_date' and the
+    'expires_in' seconds
     """
 
     c = await config.get_configuration()
@@ -51,14 +69,22 @@ async def get_new_access_token():
         "client_secret": client_secret,
     }
 
-    async with aiohttp.ClientSession() as session:
-        async with session.post(keycloak_url, data=data) as resp:
-            resp_obj = await resp.json()
-            return {
-                "token": resp_obj["access_token"],
-                "expiry_date": datetime.datetime.now()
-                + timedelta(seconds=resp_obj["expires_in"]),
-            }
+    if session is None:
+        async with aiohttp.ClientSession(timeout=TOKEN_REQUEST_TIMEOUT) as session:
+            return await request_access_token(session, keycloak_url, data)
+    return await request_access_token(session, keycloak_url, data)
+
+
+async def request_access_token(session, keycloak_url, data):
+    async with session.post(keycloak_url, data=data) as resp:
+        resp.raise_for_status()
+        resp_obj = await resp.json()
+        return {
+            "token": resp_obj["access_token"],
+            "expiry_date": datetime.datetime.now()
+            + timedelta(seconds=resp_obj["expires_in"]),
+            "expires_in": resp_obj["expires_in"],
+        }
 
 
 def is_expired(current_token):
@@ -75,3 +101,118 @@ def is_expired(current_token):
 
     # if token has already expired or will expire in less than TOKEN_TIME_SKEW_SECONDS seconds, just say it's expired
     return time_delta < timedelta(seconds=TOKEN_TIME_SKEW_SECONDS)
+
+
+def get_refresh_delay(expires_in):
+    """
+    Returns: seconds to wait before refreshing a token valid for 'expires_in' seconds,
+             so that it is replaced before 'is_expired' considers it expired. At least
+             the rest of the lifetime after REFRESH_LIFETIME_RATIO, so that short-lived
+             tokens are not refreshed in a loop
+    """
+    return max(
+        expires_in * (1 - REFRESH_LIFETIME_RATIO),
+        min(
+            expires_in * REFRESH_LIFETIME_RATIO,
+            expires_in - 2 * TOKEN_TIME_SKEW_SECONDS,
+        ),
+    )
+
+
+def get_retry_delay(failures):
+    delay = min(MAX_RETRY_DELAY_SECONDS, MIN_RETRY_DELAY_SECONDS * 2 ** (failures - 1))
+    return random.uniform(delay / 2, delay)
+
+
+class TokenManager(object):
+    """
+    fetch: coroutine function called with a ClientSession, returning a new token dict
+           like 'get_new_access_token'
+    """
+
+    def __init__(self, fetch=get_new_access_token):
+        self.fetch = fetch
+        # dict with keys 'token', 'expiry_date' and 'expires_in'
+        self.current_token = None
+        self.refreshing = None
+        self.timer = None
+        self.failures = 0
+        self.session = None
+
+    async def access_token(self):
+        if self.current_token is not None and not is_expired(self.current_token):
+            return self.current_token["token"]
+
+        return (await self.refresh())["token"]
+
+    async def refresh(self):
+        """
+        Get a new token. Concurrent calls share the same request
+
+        Returns: the new token dict
+        """
+        if self.refreshing is None:
+            self.refreshing = asyncio.ensure_future(self.fetch_token())
+            self.refreshing.add_done_callback(self.refresh_done)
+
+        # a caller being cancelled must not cancel the request of the others
+        return await asyncio.shield(self.refreshing)
+
+    def refresh_done(self, future):
+        self.refreshing = None
+
+    async def fetch_token(self):
+        if self.session is None or self.session.closed:
+            self.session = aiohttp.ClientSession(timeout=TOKEN_REQUEST_TIMEOUT)
+
+        try:
+            with TOKEN_REFRESH_TIME.time():
+                token = await self.fetch(session=self.session)
+        except Exception:
+            TOKEN_REFRESH_FAILURES.inc()
+            self.failures += 1
+            self.schedule_refresh(get_retry_delay(self.failures))
+            raise
+
+        self.failures = 0
+        self.current_token = token
+        self.schedule_refresh(get_refresh_delay(token["expires_in"]))
+        return token
+
+    def schedule_refresh(self, delay):
+        if self.timer is not None:
+            self.timer.cancel()
+        self.timer = asyncio.get_running_loop().call_later(
+            delay, self.background_refresh
+        )
+
+    def background_refresh(self):
+        self.timer = None
+        asyncio.ensure_future(self.refresh()).add_done_callback(
+            self.background_refresh_done
+        )
+
+    def background_refresh_done(self, future):
+        if future.cancelled():
+            return
+        e = future.exception()
+        if e is not None:
+            logger.warning(
+                "Could not refresh the service account token, retry {}: {}".format(
+                    self.failures, e
+                )
+            )
+
+    async def stop(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        if self.refreshing is not None:
+            self.refreshing.cancel()
+            await asyncio.gather(self.refreshing, return_exceptions=True)
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+
+token_manager = TokenManager()
@@ -1,15 +1,78 @@
 # flake8: noqa
+import functools
+import hashlib
 import logging
+import time
 
-from jose import JWTError, jwt
+import pylru
+from jose import JWTError, jwk, jwt
+from prometheus_client import Counter
 from repour.config import config
 
 logger = logging.getLogger(__name__)
 
+VERIFIED_TOKENS_CACHE_SIZE = 1024
+
+# a cached verification is dropped this long before the token expires, since the clocks
+# of Repour and of the token issuer may not be exactly in sync
+TOKEN_TIME_SKEW_SECONDS = 30
+
+TOKEN_CACHE_REQUESTS = Counter(
+    "oauth2_jwt_cache_requests",
+    "Tokens verified from the cache (hit) or by checking their signature (miss)",
+    ["result"],
+)
+
+# sha256 of the token -> dict with keys 'username', 'roles', 'expires', and the
+# 'public_key' and 'issuer' the token was verified with
+verified_tokens = pylru.lrucache(VERIFIED_TOKENS_CACHE_SIZE)
+
+
+@functools.lru_cache(maxsize=8)
+def get_public_key(public_key):
+    """
+    Parse the public key once, instead of for each token
+    """
+    return jwk.construct(public_key, algorithm="RS256")
+
+
+def get_token_hash(token):
+    return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+
+def get_cached_verification(token_hash, oauth2_config):
+    """
+    Returns: the cached verification of the token, or None if unknown, about to expire
+             or verified with another public key or issuer than configured now
+    """
+    if token_hash not in verified_tokens:
+        return None
+
+    verification = verified_tokens[token_hash]
+    if (
+        time.time() >= verification["expires"] - TOKEN_TIME_SKEW_SECONDS
+        or verification["public_key"] != oauth2_config["public_key"]
+        or verification["issuer"] != oauth2_config["token_issuer"]
+    ):
+        del verified_tokens[token_hash]
+        return None
+
+    return verification
+
 
 async def verify_token(token):
     c = await config.get_configuration()
-    logger.info("Got token!")
+    logger.debug("Got token!")
+
+    oauth2_config = c["auth"]["oauth2_jwt"]
+    token_hash = get_token_hash(token)
+    verification = get_cached_verification(token_hash, oauth2_config)
+    if verification is not None:
+        TOKEN_CACHE_REQUESTS.labels("hit").inc()
+        # the allowed roles may have changed since the token was verified
+        return has_allowed_role(verification["roles"], c)
+
+    TOKEN_CACHE_REQUESTS.labels("miss").inc()
 
     OPTIONS = {
         "verify_signature": True,
@@ -28,26 +91,45 @@ async def verify_token(token):
     try:
         token = jwt.decode(
             token,
-            c["auth"]["oauth2_jwt"]["public_key"],
+            get_public_key(oauth2_config["public_key"]),
             algorithms=["RS256"],
             options=OPTIONS,
-            issuer=c["auth"]["oauth2_jwt"]["token_issuer"],
+            issuer=oauth2_config["token_issuer"],
         )
-        logger.info("Got valid token from " + token["preferred_username"])
-
-        realm_roles = token["realm_access"]["roles"]
+    except JWTError as e:
+        # not cached, a token not valid yet (nbf, iat) can become valid
+        logger.info("Got invalid token: " + str(e))
+        return False
 
-        allowed_roles = c["auth"]["allowed_roles"]
+    logger.info("Got valid token from " + token["preferred_username"])
 
-        for role in allowed_roles:
-            if role in realm_roles:
-                return True
+    realm_roles = token["realm_access"]["roles"]
+    verified = has_allowed_role(realm_roles, c)
 
+    if not verified:
         logger.error(
             "User doesn't have the required role to login: "
             + token["preferred_username"]
         )
-        return False
-    except JWTError as e:
-        logger.info("Got invalid token: " + str(e))
-        return False
+
+    # the roles of the token cannot change until it expires
+    if "exp" in token:
+        verified_tokens[token_hash] = {
+            "username": token["preferred_username"],
+            "roles": realm_roles,
+            "expires": token["exp"],
+            "public_key": oauth2_config["public_key"],
+            "issuer": oauth2_config["token_issuer"],
+        }
+
+    return verified
+
+
+def has_allowed_role(realm_roles, c):
+    allowed_roles = c["auth"]["allowed_roles"]
+
+    for role in allowed_roles:
+        if role in realm_roles:
+            return True
+
+    return False
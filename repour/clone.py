@@ -8,6 +8,7 @@ from prometheus_client import Histogram, Summary
 from repour import asutil, exception
 from repour.config import config
 from repour.lib.scm import asgit, git
+from repour.lib.telemetry import tracing
 
 logger = logging.getLogger(__name__)
 
@@ -98,18 +99,22 @@ async def clone_git(clonespec):
                 "git backend type " + git_backend + " missing in the configuration."
             )
 
-        new_internal_repo = await check_new_internal_repo(
-            asutil.add_username_url(clonespec["targetRepoUrl"], git_user)
-        )
+        with tracing.span("check internal repository"):
+            new_internal_repo = await check_new_internal_repo(
+                asutil.add_username_url(clonespec["targetRepoUrl"], git_user)
+            )
         logger.info(
             "The internal repository considered new? => " + str(new_internal_repo)
         )
 
         # NCL-4255: if ref provided and internal repository is not 'new', sync the ref only
         if "ref" in clonespec and clonespec["ref"] and not new_internal_repo:
-            await git.clone(clone_dir, clonespec["originRepoUrl"])  # Clone origin
-            await git.checkout(clone_dir, clonespec["ref"], force=True)  # Checkout ref
-            await git.setup_git_lfs_if_present(clone_dir)
+            with tracing.span("clone"):
+                await git.clone(clone_dir, clonespec["originRepoUrl"])  # Clone origin
+                await git.checkout(
+                    clone_dir, clonespec["ref"], force=True
+                )  # Checkout ref
+                await git.setup_git_lfs_if_present(clone_dir)
             await git.add_remote(
                 clone_dir,
                 "target",
@@ -117,23 +122,26 @@ async def clone_git(clonespec):
             )  # Add target remote
 
             ref = clonespec["ref"]
-            await push_sync_changes(clone_dir, ref, git_backend, "target")
+            with tracing.span("push"):
+                await push_sync_changes(clone_dir, ref, git_backend, "target")
         else:
             # Sync everything if ref not specified or internal repository is new
             # From: https://stackoverflow.com/a/7216269/2907906
             logger.info("Syncing everything")
-            await git.clone_mirror(
-                clone_dir + "/.git", clonespec["originRepoUrl"]
-            )  # Clone origin
-            await git.disable_bare_repository(clone_dir)
-            await git.reset_hard(clone_dir)
-            await git.setup_git_lfs_if_present(clone_dir)
+            with tracing.span("clone"):
+                await git.clone_mirror(
+                    clone_dir + "/.git", clonespec["originRepoUrl"]
+                )  # Clone origin
+                await git.disable_bare_repository(clone_dir)
+                await git.reset_hard(clone_dir)
+                await git.setup_git_lfs_if_present(clone_dir)
             await git.add_remote(
                 clone_dir,
                 "target",
                 asutil.add_username_url(clonespec["targetRepoUrl"], git_user),
             )  # Add target remote
-            await git.push_all(clone_dir, "target", tags_also=True)
+            with tracing.span("push"):
+                await git.push_all(clone_dir, "target", tags_also=True)
 
         return clonespec
 
@@ -1,10 +1,11 @@
-import asyncio
 import hashlib
 import logging
 from dataclasses import dataclass
 
 import aiohttp
 
+from repour.lib.telemetry import tracing
+
 logger = logging.getLogger(__name__)
 
 
@@ -28,69 +29,143 @@ class LogMetadata:
     traceparent: str = ""
 
 
-async def send(url, filename, log_metadata: LogMetadata, access_token):
+UPLOAD_CHUNK_SIZE = 65536
+
+# the upload of a big log can take longer than the default timeout of the session, only
+# give up if Bifrost stops reading
+UPLOAD_TIMEOUT = aiohttp.ClientTimeout(total=None, sock_connect=30, sock_read=300)
+
+
+async def send(
+    url,
+    filename,
+    log_metadata: LogMetadata,
+    access_token,
+    session=None,
+    offset=0,
+    md5=None,
+):
     """
     Upload final log file to Bifrost. Inspired from: https://github.com/project-ncl/bifrost-upload-client
-    """
-    backoff = 1
-    max_attempts = 9
 
-    while True:
+    This makes a single attempt, retries are left to the caller. The file is read once: it is streamed compressed, and
+    its md5 is computed on the way and sent in the part following it.
+
+    If session is None, a new session is used for the upload
+
+    If the logs were streamed with 'send_chunk' up to 'offset', only the remainder of the file is sent. 'md5' is then
+    the md5 object of the streamed bytes, so that the checksum sent is the one of the whole file
+
+    Returns: the HTTP status of the response
+    Raises: Exception if the upload failed
+    """
+    if session is None:
         async with aiohttp.ClientSession() as session:
+            return await send(
+                url, filename, log_metadata, access_token, session, offset, md5
+            )
+
+    with tracing.span(
+        "Bifrost upload",
+        kind=tracing.SpanKind.CLIENT,
+        traceparent=log_metadata.traceparent,
+    ):
+        md5 = hashlib.md5() if md5 is None else md5.copy()
+
+        with open(filename, "rb") as f:
+            f.seek(offset)
+
             with aiohttp.MultipartWriter("form-data") as mp:
-                __add_file(mp, filename, "logfile")
+                __add_part(
+                    mp,
+                    "logfile",
+                    aiohttp.payload.AsyncIterablePayload(
+                        __read_chunks(f, md5), content_type="application/octet-stream"
+                    ),
+                )
 
                 # Data part in multipart/form
-                md5sum = __md5sum_of_file(filename)
-
-                __add_part(mp, "md5sum", md5sum)
+                __add_part(
+                    mp,
+                    "md5sum",
+                    aiohttp.payload.AsyncIterablePayload(
+                        __hexdigest(md5), content_type="text/plain; charset=utf-8"
+                    ),
+                )
                 __add_part(mp, "endTime", log_metadata.end_time)
                 __add_part(mp, "loggerName", log_metadata.logger_name)
                 __add_part(mp, "tag", log_metadata.tag)
+                if offset:
+                    __add_part(mp, "offset", str(offset))
+
+                async with session.post(
+                    url + "/final-log/upload",
+                    data=mp,
+                    headers=__get_headers(log_metadata, access_token),
+                    compress=True,
+                    timeout=UPLOAD_TIMEOUT,
+                ) as resp:
+                    if resp.status // 100 != 2:
+                        raise Exception(
+                            "Couldn't send logs to Bifrost:: HTTP status: {} with text: {}".format(
+                                resp.status, await resp.text()
+                            )
+                        )
+                    return resp.status
 
-                # HTTP headers
-                headers = {
-                    "Authorization": "Bearer " + access_token,
-                    "log-process-context": log_metadata.process_context,
-                    "process-context-variant": log_metadata.process_context_variant,
-                    "log-tmp": log_metadata.tmp,
-                    "log-request-context": log_metadata.request_context,
-                    "log-user-id": log_metadata.user_id,
-                    "log-expires": log_metadata.expires,
-                    "trace-id": log_metadata.trace_id,
-                    "span-id": log_metadata.span_id,
-                    "traceparent": log_metadata.traceparent,
-                }
-
-                resp = await session.post(
-                    url + "/final-log/upload", data=mp, headers=headers, compress=True
-                )
 
-                if resp is not None and resp.status // 100 == 2:
-                    return resp
-                else:
-                    logger.info(
-                        "Unable to send logs to bifrost, status {resp.status}, text {resp.text}, attempt {backoff}/{max_attempts}".format(
-                            **locals()
+async def send_chunk(
+    url, path, data, offset, log_metadata: LogMetadata, access_token, session
+):
+    """
+    Upload the part of the log file starting at 'offset' while it is still being written
+
+    Returns: the HTTP status of the response
+    Raises: Exception if the upload failed
+    """
+    with tracing.span(
+        "Bifrost upload chunk",
+        kind=tracing.SpanKind.CLIENT,
+        traceparent=log_metadata.traceparent,
+    ):
+        with aiohttp.MultipartWriter("form-data") as mp:
+            part = mp.append(data)
+            part.headers["Content-Type"] = "application/octet-stream"
+            part.set_content_disposition("form-data", name="logfile")
+
+            __add_part(mp, "offset", str(offset))
+            __add_part(mp, "loggerName", log_metadata.logger_name)
+            __add_part(mp, "tag", log_metadata.tag)
+
+            async with session.post(
+                url + path,
+                data=mp,
+                headers=__get_headers(log_metadata, access_token),
+                compress=True,
+            ) as resp:
+                if resp.status // 100 != 2:
+                    raise Exception(
+                        "Couldn't send log chunk to Bifrost:: HTTP status: {} with text: {}".format(
+                            resp.status, await resp.text()
                         )
                     )
-                    sleep_period = 2**backoff
-                    logger.debug("Sleeping for {sleep_period}".format(**locals()))
-                    await asyncio.sleep(sleep_period)
+                return resp.status
 
-                    backoff += 1
 
-                    if backoff > max_attempts:
-                        logger.error(
-                            "Giving up on callback after {max_attempts} attempts".format(
-                                **locals()
-                            )
-                        )
-                        raise Exception(
-                            "Couldn't send logs to Bifrost:: HTTP status: {} with text: {}".format(
-                                resp.status, resp.text
-                            )
-                        )
+def __get_headers(log_metadata, access_token):
+    return {
+        "Authorization": "Bearer " + access_token,
+        "log-process-context": log_metadata.process_context,
+        "process-context-variant": log_metadata.process_context_variant,
+        "log-tmp": log_metadata.tmp,
+        "log-request-context": log_metadata.request_context,
+        "log-user-id": log_metadata.user_id,
+        "log-expires": log_metadata.expires,
+        "trace-id": log_metadata.trace_id,
+        "span-id": log_metadata.span_id,
+        # the trace continues from the span of the upload
+        "traceparent": tracing.get_traceparent(log_metadata.traceparent),
+    }
 
 
 def __add_part(multipart_writer, name, value):
@@ -98,36 +173,17 @@ def __add_part(multipart_writer, name, value):
     part.set_content_disposition("form-data", name=name)
 
 
-def __add_file(multipart_writer, filename_path, filename_for_upload=None):
-    """
-    Specify filename_for_upload if you want to override the filename string to send with another name
-    """
-    part = multipart_writer.append(open(filename_path, "rb"))
-
-    part.headers["Content-Type"] = "application/octet-stream"
-
-    if filename_for_upload:
-        part.set_content_disposition("form-data", name=filename_for_upload)
-    else:
-        part.set_content_disposition("form-data", name=filename_path)
+async def __read_chunks(f, md5):
+    while True:
+        data = f.read(UPLOAD_CHUNK_SIZE)
+        if not data:
+            break
+        md5.update(data)
+        yield data
 
 
-def __md5sum_of_file(filename):
+async def __hexdigest(md5):
     """
-    Use this helper method to calculate the md5 of a file.
-
-    Rather than loading the whole filename into memory and calculating the md5,
-    instead we load it in chunks to reduce memory usage.
+    Only evaluated once the parts before it are written, so after the whole file was read
     """
-
-    buf_size = 65536  # lets read stuff in 64kb chunks!
-    md5 = hashlib.md5()
-
-    with open(filename, "rb") as f:
-        while True:
-            data = f.read(buf_size)
-            if not data:
-                break
-            md5.update(data)
-
-    return md5.hexdigest()
+    yield md5.hexdigest().encode("utf-8")
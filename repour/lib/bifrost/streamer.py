@@ -0,0 +1,190 @@
+# Live streaming of the logs of a request to Bifrost
+#
+# While a request runs, the new lines of its log file are sent to Bifrost in chunks,
+# every few seconds or as soon as enough bytes are waiting. The offset and the md5 of
+# what was streamed are kept after the request ends, so that the final upload only
+# sends the remainder of the file together with the checksum of the whole log.
+
+import asyncio
+import hashlib
+import logging
+import os
+import time
+
+import pylru
+from prometheus_client import Counter
+
+from repour.auth import auth_client
+from repour.lib.bifrost import client
+from repour.lib.logs import file_callback_log
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_INTERVAL_SECONDS = 5
+DEFAULT_CHUNK_BYTES = 65536
+DEFAULT_CHUNK_PATH = "/final-log/upload-chunk"
+
+# upper bound of one chunk, so that a burst of logs is not sent in a single request
+MAX_CHUNK_BYTES = 1048576
+PERIOD_POLL_SLEEP = 1
+
+STREAMED_BYTES = Counter("bifrost_streamed_bytes", "Log bytes streamed to Bifrost")
+STREAM_ERRORS = Counter(
+    "bifrost_stream_errors", "Log chunks that could not be streamed to Bifrost"
+)
+
+# callback_id -> (offset, md5 of the streamed bytes), for the final upload
+streamed_logs = pylru.lrucache(1000)
+
+
+def is_enabled(configuration):
+    return configuration.get("bifrost_streaming", {}).get("enabled", False)
+
+
+def get_streamed_state(callback_id, filename, offset):
+    """
+    offset: number of bytes streamed, as recorded when the streaming stopped
+
+    Returns: tuple (offset, md5) of the part of the log file already streamed, to pass
+             to 'client.send'. If this process does not know it anymore (restart, other
+             replica), the md5 is computed from the file
+    """
+    if callback_id in streamed_logs:
+        return streamed_logs[callback_id]
+    if offset > 0:
+        return offset, compute_md5(filename, offset)
+    return 0, None
+
+
+def forget_streamed_state(callback_id):
+    if callback_id in streamed_logs:
+        del streamed_logs[callback_id]
+
+
+def compute_md5(filename, offset):
+    md5 = hashlib.md5()
+    with open(filename, "rb") as f:
+        remaining = offset
+        while remaining > 0:
+            data = f.read(min(remaining, client.UPLOAD_CHUNK_SIZE))
+            if not data:
+                break
+            md5.update(data)
+            remaining -= len(data)
+    return md5
+
+
+class LogStreamer(object):
+    def __init__(
+        self,
+        url,
+        callback_id,
+        log_metadata,
+        session,
+        interval=DEFAULT_INTERVAL_SECONDS,
+        chunk_bytes=DEFAULT_CHUNK_BYTES,
+        chunk_path=DEFAULT_CHUNK_PATH,
+        filename=None,
+    ):
+        """
+        filename: log file to follow. By default, the log file of the callback, which
+                  may be moved to the shared folder at the end of the request
+        """
+        self.url = url
+        self.callback_id = callback_id
+        self.filename = filename
+        self.log_metadata = log_metadata
+        self.session = session
+        self.interval = interval
+        self.chunk_bytes = chunk_bytes
+        self.chunk_path = chunk_path
+        self.offset = 0
+        self.md5 = hashlib.md5()
+        self.stopping = asyncio.Event()
+        self.task = None
+
+    @classmethod
+    def from_configuration(cls, configuration, callback_id, log_metadata, session):
+        streaming_config = configuration.get("bifrost_streaming", {})
+        return cls(
+            configuration.get("bifrost_url"),
+            callback_id,
+            log_metadata,
+            session,
+            interval=streaming_config.get("interval_seconds", DEFAULT_INTERVAL_SECONDS),
+            chunk_bytes=streaming_config.get("chunk_bytes", DEFAULT_CHUNK_BYTES),
+            chunk_path=streaming_config.get("chunk_path", DEFAULT_CHUNK_PATH),
+        )
+
+    def get_filename(self):
+        if self.filename is not None:
+            return self.filename
+        return file_callback_log.get_callback_log_read_path(self.callback_id)
+
+    def start(self):
+        self.task = asyncio.get_event_loop().create_task(self.run())
+
+    async def stop(self):
+        """
+        Stop streaming and keep the streamed state for the final upload. A chunk being
+        sent is not interrupted, so that the offset matches what Bifrost received
+        """
+        self.stopping.set()
+        if self.task is not None:
+            await asyncio.gather(self.task, return_exceptions=True)
+        if self.offset > 0:
+            streamed_logs[self.callback_id] = (self.offset, self.md5)
+
+    async def run(self):
+        last_sent = time.monotonic()
+
+        while not self.stopping.is_set():
+            try:
+                await asyncio.wait_for(self.stopping.wait(), PERIOD_POLL_SLEEP)
+                return
+            except asyncio.TimeoutError:
+                pass
+
+            try:
+                filename = self.get_filename()
+                size = os.path.getsize(filename)
+            except OSError:
+                continue
+
+            waiting = size - self.offset
+            if waiting >= self.chunk_bytes or (
+                waiting > 0 and time.monotonic() - last_sent >= self.interval
+            ):
+                await self.send_chunk(filename, size)
+                last_sent = time.monotonic()
+
+    async def send_chunk(self, filename, size):
+        with open(filename, "rb") as f:
+            f.seek(self.offset)
+            data = f.read(min(size - self.offset, MAX_CHUNK_BYTES))
+
+        # only send whole lines, the last one may still be written
+        end = data.rfind(b"\n") + 1
+        if end == 0:
+            return
+        data = data[:end]
+
+        try:
+            await client.send_chunk(
+                self.url,
+                self.chunk_path,
+                data,
+                self.offset,
+                self.log_metadata,
+                await auth_client.access_token(),
+                self.session,
+            )
+        except Exception as e:
+            # the same bytes are sent again with the next chunk
+            STREAM_ERRORS.inc()
+            logger.warning("Could not stream logs to Bifrost: " + str(e))
+            return
+
+        self.md5.update(data)
+        self.offset += len(data)
+        STREAMED_BYTES.inc(len(data))
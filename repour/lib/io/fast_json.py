@@ -0,0 +1,35 @@
+# JSON encoding and decoding of the request and response bodies
+#
+# orjson is used when it is installed, the json module of the standard library
+# otherwise. Both produce the same documents for the objects exchanged by Repour.
+
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def loads(data):
+    """
+    data: bytes or str
+
+    Raises: ValueError if data is not valid json
+    """
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def dumps(obj):
+    """
+    Returns: the utf-8 encoded json of obj, with the non ascii characters not escaped
+    """
+    if orjson is not None:
+        try:
+            return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+        except TypeError:
+            # types orjson does not support, such as integers larger than 64 bits
+            pass
+    return json.dumps(obj, ensure_ascii=False).encode("utf-8")
@@ -0,0 +1,120 @@
+# Minimal inotify binding
+#
+# Watches a directory from the event loop, without polling it. Only the changes made
+# through the local kernel are reported: changes made by other hosts on a network
+# filesystem are not seen.
+
+import ctypes
+import ctypes.util
+import logging
+import os
+import struct
+
+logger = logging.getLogger(__name__)
+
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = os.O_CLOEXEC
+
+# struct inotify_event: int wd, uint32 mask, uint32 cookie, uint32 len, char name[len]
+EVENT_HEADER = struct.Struct("iIII")
+
+READ_SIZE = 65536
+
+_libc = None
+
+
+def get_libc():
+    global _libc
+
+    if _libc is None:
+        libc_name = ctypes.util.find_library("c")
+        if libc_name is None:
+            raise OSError("libc not found, cannot use inotify")
+        libc = ctypes.CDLL(libc_name, use_errno=True)
+        if not hasattr(libc, "inotify_init1"):
+            raise OSError("inotify is not supported by this libc")
+        libc.inotify_init1.argtypes = [ctypes.c_int]
+        libc.inotify_add_watch.argtypes = [
+            ctypes.c_int,
+            ctypes.c_char_p,
+            ctypes.c_uint32,
+        ]
+        _libc = libc
+
+    return _libc
+
+
+def parse_events(data):
+    """
+    Returns: list of tuples (mask, name) of the events in 'data'
+    """
+    events = []
+    offset = 0
+
+    while offset + EVENT_HEADER.size <= len(data):
+        _, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+        offset += EVENT_HEADER.size
+        name = data[offset : offset + length].rstrip(b"\0")
+        offset += length
+        events.append((mask, os.fsdecode(name)))
+
+    return events
+
+
+class DirectoryWatch(object):
+    """
+    Calls 'callback(mask, name)' from the event loop for each event of 'mask' on the
+    files of 'path'. IN_Q_OVERFLOW is always reported, with an empty name, when events
+    were lost
+    """
+
+    def __init__(self, path, mask, callback):
+        self.path = path
+        self.mask = mask
+        self.callback = callback
+        self.fd = None
+        self.loop = None
+
+    def start(self, loop):
+        """
+        Raises: OSError if inotify cannot be used
+        """
+        libc = get_libc()
+
+        fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if fd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, "inotify_init1: " + os.strerror(errno))
+
+        if libc.inotify_add_watch(fd, os.fsencode(self.path), self.mask) < 0:
+            errno = ctypes.get_errno()
+            os.close(fd)
+            raise OSError(errno, "inotify_add_watch: " + os.strerror(errno), self.path)
+
+        self.fd = fd
+        self.loop = loop
+        loop.add_reader(fd, self.read_events)
+
+    def read_events(self):
+        try:
+            data = os.read(self.fd, READ_SIZE)
+        except BlockingIOError:
+            return
+
+        for mask, name in parse_events(data):
+            try:
+                self.callback(mask, name)
+            except Exception:
+                logger.exception("Error while handling inotify event on " + self.path)
+
+    def close(self):
+        if self.fd is not None:
+            self.loop.remove_reader(self.fd)
+            os.close(self.fd)
+            self.fd = None
@@ -1,8 +1,15 @@
 import asyncio
 import calendar
+import concurrent.futures
 import logging
 import os
+import queue
+import shutil
+import sys
+import tempfile
+import threading
 import time
+import traceback
 
 import pylru
 
@@ -11,6 +18,20 @@ from repour import asutil
 SHARED_PATH_PREFOLDER = os.environ.get("SHARED_FOLDER", "/tmp")
 CALLBACK_LOGS_PATH = os.path.join(SHARED_PATH_PREFOLDER, "repour-logs-callback")
 
+# used instead of CALLBACK_LOGS_PATH while a request runs, if the latter is on a network
+# filesystem
+LOCAL_CALLBACK_LOGS_PATH = os.path.join(
+    tempfile.gettempdir(), "repour-logs-callback-local"
+)
+
+NETWORK_FILESYSTEMS = ("nfs", "nfs4", "cifs", "smb3", "smbfs")
+# filesystems known to be local to the host, where inotify sees all the changes
+LOCAL_FILESYSTEMS = ("ext4", "xfs", "btrfs", "tmpfs", "overlay")
+
+DEFAULT_MAX_OPEN_FILES = 20
+FLUSH_INTERVAL_SECONDS = 0.5
+MAX_BUFFERED_CHARS = 1048576
+
 logger = logging.getLogger(__name__)
 
 
@@ -18,6 +39,20 @@ def get_callback_log_path(callback_id):
     return os.path.join(CALLBACK_LOGS_PATH, callback_id + ".log")
 
 
+def get_local_callback_log_path(callback_id):
+    return os.path.join(LOCAL_CALLBACK_LOGS_PATH, callback_id + ".log")
+
+
+def get_callback_log_read_path(callback_id):
+    """
+    Path of the log file of a callback whose request may still be running
+    """
+    local_path = get_local_callback_log_path(callback_id)
+    if os.path.exists(local_path):
+        return local_path
+    return get_callback_log_path(callback_id)
+
+
 def get_current_task():
     try:
         return asyncio.current_task()
@@ -25,13 +60,235 @@ def get_current_task():
         return None
 
 
-class FileCallbackHandler(logging.StreamHandler):
+def get_filesystem_type(path, mounts_file="/proc/mounts"):
+    """
+    Returns: the type of the filesystem 'path' is on, or None if unknown
+    """
+    path = os.path.realpath(path)
+    mount_point, fs_type = "", None
+
+    try:
+        with open(mounts_file, "r") as f:
+            for line in f:
+                fields = line.split()
+                if len(fields) < 3:
+                    continue
+                # spaces and such are octal escaped in the mount point
+                mount = fields[1].encode("utf-8").decode("unicode_escape")
+                prefix = mount.rstrip("/") + "/"
+                if (path == mount or path.startswith(prefix)) and len(mount) > len(
+                    mount_point
+                ):
+                    mount_point, fs_type = mount, fields[2]
+    except OSError:
+        return None
+
+    return fs_type
+
+
+def is_network_filesystem(path):
+    return get_filesystem_type(path) in NETWORK_FILESYSTEMS
+
+
+def is_local_filesystem(path):
+    return get_filesystem_type(path) in LOCAL_FILESYSTEMS
+
+
+def get_max_open_files(configuration):
+    """
+    One handle per job the server can hold at once, so that the handles of running jobs
+    are not closed and reopened all the time
+    """
+    job_queue_config = configuration.get("job_queue", {})
+    capacity = job_queue_config.get("capacity", None)
+    if capacity is None:
+        capacity = sum(job_queue_config.get("concurrency", {}).values())
+    return max(DEFAULT_MAX_OPEN_FILES, capacity)
+
+
+class CallbackLogWriter(threading.Thread):
+    """
+    Thread writing the log lines of the callbacks to their files
+
+    The lines are buffered per callback and written every FLUSH_INTERVAL_SECONDS, or
+    when a callback is finalized. If 'local_directory' is set, the files are written
+    there and moved to 'directory' when finalized.
+    """
+
+    WRITE = 0
+    FINALIZE = 1
+    FLUSH = 2
+    STOP = 3
+
+    def __init__(
+        self,
+        directory,
+        local_directory=None,
+        mode="a",
+        encoding=None,
+        max_open_files=DEFAULT_MAX_OPEN_FILES,
+    ):
+        super().__init__(name="callback-log-writer", daemon=True)
+        self.directory = directory
+        self.local_directory = local_directory
+        self.mode = mode
+        self.encoding = encoding
+        self.queue = queue.SimpleQueue()
+        self.buffers = {}
+        self.buffered = 0
+        self.cache_file_handler = pylru.lrucache(max_open_files, close_file_handler)
+        # callbacks whose request ended, written directly to 'directory'
+        self.finalized = pylru.lrucache(1000)
+
+    def write(self, callback_id, text):
+        self.queue.put((self.WRITE, callback_id, text))
+
+    def finalize(self, callback_id):
+        """
+        Write the buffered lines of the callback and close its file
+
+        Returns: concurrent.futures.Future done once the file is complete
+        """
+        future = concurrent.futures.Future()
+        self.queue.put((self.FINALIZE, callback_id, future))
+        return future
+
+    def flush(self):
+        future = concurrent.futures.Future()
+        self.queue.put((self.FLUSH, None, future))
+        return future
+
+    def stop(self):
+        self.queue.put((self.STOP, None, None))
+        self.join()
+
+    def run(self):
+        last_flush = time.monotonic()
+
+        while True:
+            try:
+                action, callback_id, value = self.queue.get(
+                    timeout=FLUSH_INTERVAL_SECONDS
+                )
+            except queue.Empty:
+                action = None
+
+            try:
+                if action == self.WRITE:
+                    self.buffers.setdefault(callback_id, []).append(value)
+                    self.buffered += len(value)
+                elif action == self.FINALIZE:
+                    self.finalize_file(callback_id)
+                    value.set_result(None)
+                elif action == self.FLUSH:
+                    self.write_buffers()
+                    value.set_result(None)
+                elif action == self.STOP:
+                    self.write_buffers()
+                    for key in list(self.cache_file_handler.keys()):
+                        self.close_file(key)
+                    return
+
+                if (
+                    self.buffered >= MAX_BUFFERED_CHARS
+                    or time.monotonic() - last_flush >= FLUSH_INTERVAL_SECONDS
+                ):
+                    self.write_buffers()
+                    last_flush = time.monotonic()
+            except Exception as e:
+                if action in (self.FINALIZE, self.FLUSH) and not value.done():
+                    value.set_exception(e)
+                # like logging.Handler.handleError, logging it would come back here
+                sys.stderr.write("--- Could not write callback logs ---\n")
+                traceback.print_exc(file=sys.stderr)
+
+    def get_path(self, callback_id):
+        if self.local_directory is None or callback_id in self.finalized:
+            return os.path.join(self.directory, callback_id + ".log")
+        return os.path.join(self.local_directory, callback_id + ".log")
+
+    def write_buffers(self):
+        buffers = self.buffers
+        self.buffers = {}
+        self.buffered = 0
+
+        for callback_id, lines in buffers.items():
+            self.write_lines(callback_id, lines)
+
+    def write_lines(self, callback_id, lines):
+        # Cache the most recently file handlers. If not in cache, then create one.
+        # Done because creating a new file handler on every write is very costly
+        if callback_id not in self.cache_file_handler:
+            self.cache_file_handler[callback_id] = open(
+                self.get_path(callback_id), self.mode, encoding=self.encoding
+            )
+
+        f = self.cache_file_handler[callback_id]
+        f.write("".join(lines))
+        # need to flush to make sure every reader sees the change
+        f.flush()
+
+    def close_file(self, callback_id):
+        if callback_id in self.cache_file_handler:
+            close_file_handler(callback_id, self.cache_file_handler[callback_id])
+            del self.cache_file_handler[callback_id]
+
+    def finalize_file(self, callback_id):
+        lines = self.buffers.pop(callback_id, None)
+        if lines:
+            self.buffered -= sum(len(line) for line in lines)
+            self.write_lines(callback_id, lines)
+
+        self.close_file(callback_id)
+
+        if callback_id in self.finalized:
+            return
+
+        local_path = self.get_path(callback_id)
+        self.finalized[callback_id] = True
+
+        if self.local_directory is not None and os.path.exists(local_path):
+            move_file(local_path, self.get_path(callback_id))
+
+
+def move_file(source, destination):
+    """
+    Move 'source' to 'destination' on another filesystem, so that readers of
+    'destination' never see a partial file
+    """
+    directory = os.path.dirname(destination)
+    fd, temp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as temp_file:
+            # lines written after a previous finalization come first
+            if os.path.exists(destination):
+                with open(destination, "rb") as f:
+                    shutil.copyfileobj(f, temp_file)
+            with open(source, "rb") as f:
+                shutil.copyfileobj(f, temp_file)
+        os.replace(temp_path, destination)
+    except Exception:
+        asutil.safe_remove_file(temp_path)
+        raise
+    os.remove(source)
+
+
+class FileCallbackHandler(logging.Handler):
     """
     Handler that logs into {directory}/{callback_id}.log
+
+    The records are formatted on the calling thread and written by a CallbackLogWriter,
+    so that the event loop never waits for the shared log volume.
     """
 
     def __init__(
-        self, directory=CALLBACK_LOGS_PATH, mode="a", encoding=None, delay=None
+        self,
+        directory=CALLBACK_LOGS_PATH,
+        mode="a",
+        encoding=None,
+        delay=None,
+        max_open_files=DEFAULT_MAX_OPEN_FILES,
+        local_directory=None,
     ):
         if os.path.exists(directory):
             if not os.path.isdir(directory):
@@ -39,12 +296,24 @@ class FileCallbackHandler(logging.StreamHandler):
         else:
             os.makedirs(directory)
 
+        if local_directory is None and is_network_filesystem(directory):
+            local_directory = LOCAL_CALLBACK_LOGS_PATH
+        if local_directory is not None:
+            os.makedirs(local_directory, exist_ok=True)
+
         self.filename = directory
         self.mode = mode
         self.encoding = encoding
         self.delay = delay
-        self.stream = None
-        self.cache_file_handler = pylru.lrucache(20, close_file_handler)
+        self.terminator = "\n"
+        self.writer = CallbackLogWriter(
+            directory,
+            local_directory=local_directory,
+            mode=mode,
+            encoding=encoding,
+            max_open_files=max_open_files,
+        )
+        self.writer.start()
         logging.Handler.__init__(self)
 
     def emit(self, record):
@@ -54,27 +323,36 @@ class FileCallbackHandler(logging.StreamHandler):
             if task is not None:
                 callback_id = getattr(task, "callback_id", None)
                 if callback_id is not None:
-                    self.stream = self._open_callback_file(callback_id)
-                    logging.StreamHandler.emit(self, record)
-
-                    # need to flush to make sure every reader sees the change
-                    self.stream.flush()
-            else:
-                self.stream = None
-        except RuntimeError:
+                    self.writer.write(
+                        callback_id, self.format(record) + self.terminator
+                    )
+        except Exception:
             self.handleError(record)
 
-    def _open_callback_file(self, callback_id):
-        path = get_callback_log_path(callback_id)
+    def close(self):
+        if self.writer.is_alive():
+            self.writer.stop()
+        super().close()
 
-        # Cache the most recently file handlers. If not in cache, then create one.
-        # Done because creating a new file handler on every `emit` is very costly
-        if callback_id not in self.cache_file_handler:
-            self.cache_file_handler[callback_id] = open(
-                path, self.mode, encoding=self.encoding
-            )
 
-        return self.cache_file_handler[callback_id]
+def get_file_callback_handlers():
+    return [
+        handler
+        for handler in logging.getLogger().handlers
+        if isinstance(handler, FileCallbackHandler)
+    ]
+
+
+async def finalize_callback_log(callback_id):
+    """
+    Wait until all the logs of the callback so far are in its file under
+    CALLBACK_LOGS_PATH. Called when its request ends
+    """
+    futures = [
+        handler.writer.finalize(callback_id) for handler in get_file_callback_handlers()
+    ]
+    for future in futures:
+        await asyncio.wrap_future(future)
 
 
 async def setup_clean_old_logfiles():
@@ -82,16 +360,20 @@ async def setup_clean_old_logfiles():
     We cleanup old log files that haven't been written to for the past 2 days
     """
     while True:
-        for filename in os.listdir(CALLBACK_LOGS_PATH):
-            path = os.path.join(CALLBACK_LOGS_PATH, filename)
+        for directory in (CALLBACK_LOGS_PATH, LOCAL_CALLBACK_LOGS_PATH):
+            if not os.path.isdir(directory):
+                continue
+
+            for filename in os.listdir(directory):
+                path = os.path.join(directory, filename)
 
-            epoch_filename = int(os.stat(path).st_ctime)
-            current_epoch = calendar.timegm(time.gmtime())
+                epoch_filename = int(os.stat(path).st_ctime)
+                current_epoch = calendar.timegm(time.gmtime())
 
-            # 172800 seconds = 2 days
-            if current_epoch - epoch_filename > 172800:
-                logger.info("Removing old logfile: " + path)
-                asutil.safe_remove_file(path)
+                # 172800 seconds = 2 days
+                if current_epoch - epoch_filename > 172800:
+                    logger.info("Removing old logfile: " + path)
+                    asutil.safe_remove_file(path)
 
         # Run every hour
         await asyncio.sleep(3600)
@@ -1,41 +1,87 @@
 import asyncio
+import contextvars
 import logging
 
+# Task attributes used by the log handlers and formatters
+LOG_CONTEXT_TASK_ATTRIBUTES = ("callback_id", "loggerName")
 
-def add_update_mdc_key_value_in_task(key, value):
+
+class Mdc(dict):
     """
-    Add an mdc key/value to the task mdc attribute. This is used to also set the log context
+    Immutable mdc mapping. A new one is created when a key changes, so that the log records can keep a reference to
+    the mdc at the time they were created instead of a copy
     """
-    task = asyncio.current_task()
 
-    if getattr(task, "mdc", None) is None:
-        task.mdc = {}
+    def _immutable(self, *args, **kwargs):
+        raise TypeError("The mdc is immutable, use log_util to change it")
 
-    task.mdc[key] = value
+    __setitem__ = __delitem__ = __ior__ = _immutable
+    clear = pop = popitem = setdefault = update = _immutable
 
+    def __copy__(self):
+        return self
 
-def remove_mdc_key_in_task(key):
+    def __deepcopy__(self, memo):
+        return self
+
+    def __reduce__(self):
+        return (Mdc, (dict(self),))
+
+
+EMPTY_MDC = Mdc()
+
+# Tasks get a copy of the context of the task creating them, and so its mdc
+mdc_var = contextvars.ContextVar("mdc", default=EMPTY_MDC)
+
+
+def get_mdc():
     """
-    Delete a key from the task mdc attribute if present
+    Returns the mdc of the current context
     """
+    return mdc_var.get()
 
-    task = asyncio.current_task()
 
-    if getattr(task, "mdc", None) is not None:
-        if key in task.mdc:
-            del task.mdc[key]
+def add_update_mdc_key_value_in_task(key, value):
+    """
+    Add an mdc key/value to the mdc of the current context. This is used to also set the log context
+    """
+    mdc = dict(mdc_var.get())
+    mdc[key] = value
+    mdc_var.set(Mdc(mdc))
+
+
+def remove_mdc_key_in_task(key):
+    """
+    Delete a key from the mdc of the current context if present
+    """
+    mdc = mdc_var.get()
+
+    if key in mdc:
+        mdc = dict(mdc)
+        del mdc[key]
+        mdc_var.set(Mdc(mdc))
 
 
 def get_mdc_value_in_task(key):
     """
-    Given a key, returns the mdc value from the task.
+    Given a key, returns the mdc value from the current context.
     """
-    task = asyncio.current_task()
+    return mdc_var.get().get(key)
+
+
+def create_task_with_log_context(coro):
+    """
+    Create a task running 'coro' with the log attributes of the current task, so that the logs of the new task end up
+    in the same places. The mdc is part of the context copied to the new task
+    """
+    current_task = asyncio.current_task()
+    task = asyncio.get_event_loop().create_task(coro)
+
+    for attribute in LOG_CONTEXT_TASK_ATTRIBUTES:
+        if hasattr(current_task, attribute):
+            setattr(task, attribute, getattr(current_task, attribute))
 
-    if getattr(task, "mdc", None) is not None:
-        if key in task.mdc:
-            return task.mdc[key]
-    return None
+    return task
 
 
 class CustomFormatter(logging.Formatter):
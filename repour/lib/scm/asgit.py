@@ -41,9 +41,17 @@ async def normal_date_commit(expect_ok, repo_dir, commit_message):
     return commit_id
 
 
-async def prepare_new_branch(expect_ok, repo_dir, branch_name, orphan=False):
+async def prepare_new_branch(
+    expect_ok, repo_dir, branch_name, orphan=False, paths=None
+):
+    """
+    If paths is specified, only those paths are staged. Otherwise the whole working tree is
+    """
     await git.create_branch_checkout(repo_dir, branch_name, orphan)
-    await git.add_all(repo_dir)
+    if paths is None:
+        await git.add_all(repo_dir)
+    else:
+        await git.add_paths(repo_dir, paths)
 
 
 async def replace_branch(expect_ok, repo_dir, current_branch_name, new_name):
@@ -93,6 +101,7 @@ async def detect_backend(url):
 # Returns tag information
 # If no_change_ok=True you may set force_continue_on_no_changes to create the branch and tag anyway,
 # on the current ref, without making the new commit
+# If paths is set, only those paths are staged for the commit instead of the whole working tree
 #
 
 
@@ -107,6 +116,7 @@ async def push_new_dedup_branch(
     force_continue_on_no_changes=False,
     real_commit_time=False,
     specific_tag_name=None,
+    paths=None,
 ):
     # There are a few priorities for reference names:
     #   - Amount of information in the name itself
@@ -120,12 +130,14 @@ async def push_new_dedup_branch(
     # As many things as possible are controlled for the commit, so the commitid
     # can be used for deduplication.
     temp_branch = "repour_commitid_search_temp_branch_" + str(uuid.uuid1())
-    await prepare_new_branch(expect_ok, repo_dir, temp_branch, orphan=orphan)
+    await prepare_new_branch(
+        expect_ok, repo_dir, temp_branch, orphan=orphan, paths=paths
+    )
     branch_info = await git.current_branch(repo_dir)
     logger.info("Branch is " + branch_info)
 
     if real_commit_time:
-        # prepare_new_branch does a git add all, so calling git write-tree
+        # prepare_new_branch stages the changes, so calling git write-tree
         # should give the current tree SHA of the directory
         tree_sha = await git.write_tree(repo_dir)
 
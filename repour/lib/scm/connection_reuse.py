@@ -0,0 +1,124 @@
+# Reuse of the connections of the git commands
+#
+# An adjust runs several git commands against the same remote (fetches of the ref and
+# the tags, pushes of the tag and the branch, ...), each one connecting and
+# authenticating again. When enabled, the git commands run by Repour get:
+#
+# - for the SSH remotes, a GIT_SSH_COMMAND with an SSH ControlMaster per host: the
+#   first command opens a master connection, kept open for a while by ControlPersist,
+#   and the next commands open their sessions over it
+# - for the HTTPS remotes, where a connection cannot outlive the git process, the
+#   credential cache helper: the credentials are asked for once, then kept in memory
+#   by the helper for a while
+#
+# The sockets of the masters and of the credential cache are in one directory shared
+# by the workers and the job processes. The sockets left by killed processes are
+# removed periodically.
+
+import asyncio
+import logging
+import os
+import shlex
+import socket
+import stat
+
+from repour.config import config
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PERSIST_SECONDS = 60
+# short, since the path of a unix socket is limited to about 100 characters
+DEFAULT_DIRECTORY = "/tmp/repour-git-connections"
+CLEANUP_INTERVAL_SECONDS = 600
+
+
+def get_reuse_config(configuration):
+    """
+    Returns: the git_connection_reuse configuration, or None if disabled
+    """
+    reuse_config = configuration.get("git_connection_reuse", {})
+    if not reuse_config.get("enabled", False):
+        return None
+    return reuse_config
+
+
+def get_directory(reuse_config):
+    return reuse_config.get("directory", DEFAULT_DIRECTORY)
+
+
+def get_git_env(configuration, environ=os.environ):
+    """
+    Returns: the environment variables to add to the environment of a git command
+    """
+    reuse_config = get_reuse_config(configuration)
+    if reuse_config is None:
+        return {}
+
+    directory = get_directory(reuse_config)
+    os.makedirs(directory, mode=0o700, exist_ok=True)
+    persist_seconds = reuse_config.get("persist_seconds", DEFAULT_PERSIST_SECONDS)
+
+    # %C: hash of the host, port and user of the connection
+    ssh_command = (
+        "{} -o ControlMaster=auto -o ControlPath={} -o ControlPersist={}".format(
+            environ.get("GIT_SSH_COMMAND", "ssh"),
+            shlex.quote(os.path.join(directory, "%C")),
+            persist_seconds,
+        )
+    )
+    credential_helper = "cache --timeout={} --socket={}".format(
+        persist_seconds, shlex.quote(os.path.join(directory, "credential-cache"))
+    )
+
+    # added after the configuration given through the environment, if any
+    config_index = int(environ.get("GIT_CONFIG_COUNT", "0"))
+    return {
+        "GIT_SSH_COMMAND": ssh_command,
+        "GIT_CONFIG_COUNT": str(config_index + 1),
+        "GIT_CONFIG_KEY_{}".format(config_index): "credential.helper",
+        "GIT_CONFIG_VALUE_{}".format(config_index): credential_helper,
+    }
+
+
+def is_stale_socket(path):
+    """
+    Returns: True if the path is a socket nothing listens on anymore
+    """
+    try:
+        if not stat.S_ISSOCK(os.lstat(path).st_mode):
+            return False
+    except FileNotFoundError:
+        return False
+
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+        try:
+            s.connect(path)
+        except ConnectionRefusedError:
+            return True
+        except OSError:
+            return False
+    return False
+
+
+def remove_stale_sockets(directory):
+    if not os.path.isdir(directory):
+        return
+
+    for filename in os.listdir(directory):
+        path = os.path.join(directory, filename)
+        if is_stale_socket(path):
+            logger.info("Removing stale socket: " + path)
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+
+async def setup_clean_stale_sockets():
+    reuse_config = get_reuse_config(await config.get_configuration())
+    if reuse_config is None:
+        return
+
+    while True:
+        remove_stale_sockets(get_directory(reuse_config))
+        await asyncio.sleep(CLEANUP_INTERVAL_SECONDS)
@@ -0,0 +1,143 @@
+# Gerrit utility functions
+#
+# The commands are run over one SSH connection per Gerrit host, kept open between the
+# requests: each command runs in its own channel of the connection, instead of paying
+# for the TCP connection, the key exchange and the authentication every time. The
+# number of channels open at once is limited, since Gerrit limits the sessions of a
+# user. A connection which was closed is opened again on the next command.
+
+import asyncio
+import logging
+
+import asyncssh
+from prometheus_client import Counter, Histogram
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PORT = 22
+DEFAULT_MAX_CHANNELS = 8
+# keepalives detect the connections dropped without being closed, by a load balancer
+KEEPALIVE_INTERVAL_SECONDS = 30
+KEEPALIVE_COUNT_MAX = 3
+# wait before opening again a channel refused on a live connection, such as by the
+# session limit of Gerrit
+CHANNEL_RETRY_DELAY_SECONDS = 1
+
+SSH_CONNECT_TIME = Histogram(
+    "gerrit_ssh_connect_seconds", "Time spent opening an SSH connection to Gerrit"
+)
+SSH_COMMAND_TIME = Histogram(
+    "gerrit_ssh_command_seconds", "Time spent running a command over SSH on Gerrit"
+)
+SSH_RECONNECTS = Counter(
+    "gerrit_ssh_reconnects",
+    "Commands run again on a new SSH connection, after the previous one was lost",
+)
+
+# (hostname, port, username) -> SshConnectionPool
+pools = {}
+
+
+class SshConnectionPool(object):
+    def __init__(self, hostname, port=DEFAULT_PORT, username=None, max_channels=None):
+        self.hostname = hostname
+        self.port = port
+        self.username = username
+        self.channels = asyncio.Semaphore(max_channels or DEFAULT_MAX_CHANNELS)
+        self.connection = None
+        self.connect_lock = asyncio.Lock()
+
+    async def get_connection(self):
+        """
+        Returns: the open connection, connecting if there is none
+        """
+        async with self.connect_lock:
+            if self.connection is None or self.connection.is_closed():
+                with SSH_CONNECT_TIME.time():
+                    self.connection = await asyncssh.connect(
+                        self.hostname,
+                        port=self.port,
+                        username=self.username,
+                        known_hosts=None,
+                        keepalive_interval=KEEPALIVE_INTERVAL_SECONDS,
+                        keepalive_count_max=KEEPALIVE_COUNT_MAX,
+                    )
+                logger.info(
+                    "Opened SSH connection to {}:{}".format(self.hostname, self.port)
+                )
+            return self.connection
+
+    def drop(self, connection):
+        connection.close()
+        if self.connection is connection:
+            self.connection = None
+
+    async def run(self, command):
+        """
+        Run the command in a new channel of the connection. If the connection was lost,
+        the command is run again once on a new connection. If the channel was refused on
+        a live connection, shared by the other commands, it is opened again once on the
+        same connection.
+
+        Returns: asyncssh.SSHCompletedProcess
+        """
+        async with self.channels:
+            connection = await self.get_connection()
+            try:
+                with SSH_COMMAND_TIME.time():
+                    return await connection.run(command, check=False)
+            except asyncssh.ChannelOpenError as e:
+                if connection.is_closed():
+                    self.on_connection_lost(connection, e)
+                else:
+                    logger.warning(
+                        "SSH channel refused by {}:{}, retrying: {}".format(
+                            self.hostname, self.port, e
+                        )
+                    )
+                    await asyncio.sleep(CHANNEL_RETRY_DELAY_SECONDS)
+            except (asyncssh.ConnectionLost, OSError) as e:
+                self.on_connection_lost(connection, e)
+
+            connection = await self.get_connection()
+            with SSH_COMMAND_TIME.time():
+                return await connection.run(command, check=False)
+
+    def on_connection_lost(self, connection, e):
+        logger.warning(
+            "SSH connection to {}:{} lost, reconnecting: {}".format(
+                self.hostname, self.port, e
+            )
+        )
+        self.drop(connection)
+        SSH_RECONNECTS.inc()
+
+    async def close(self):
+        if self.connection is not None:
+            connection = self.connection
+            self.connection = None
+            connection.close()
+            await connection.wait_closed()
+
+
+def pool(gerrit_config):
+    """
+    Returns: the connection pool of the Gerrit host of the configuration, shared by the
+             requests
+    """
+    key = (
+        gerrit_config.get("hostname"),
+        gerrit_config.get("port", DEFAULT_PORT),
+        gerrit_config.get("username"),
+    )
+    if key not in pools:
+        pools[key] = SshConnectionPool(
+            *key, max_channels=gerrit_config.get("max_channels", None)
+        )
+    return pools[key]
+
+
+async def close_pools():
+    for ssh_pool in list(pools.values()):
+        await ssh_pool.close()
+    pools.clear()
@@ -10,6 +10,7 @@ import random
 import re
 import string
 import subprocess
+import tempfile
 
 from repour import asutil, exception
 
@@ -155,17 +156,20 @@ async def clone(dir, url):
         raise
 
 
-async def shallow_clone_with_tags(dir, url, ref):
+async def shallow_clone_with_tags(dir, url, ref, with_tags=True):
     """
     From: NCL-8810: do a shallow clone with shallow tag information for adjust endpoint where internal url
     is used only
+
+    If with_tags is False, the caller is responsible for fetching the tags with 'fetch_tags(dir, "origin", shallow=True)'
     """
     os.makedirs(dir, exist_ok=True)
     await init(dir)
     await add_remote(dir, "origin", url)
     await fetch_shallow_ref(dir, "origin", ref)
     await checkout(dir, "FETCH_HEAD")
-    await fetch_tags(dir, "origin", shallow=True)
+    if with_tags:
+        await fetch_tags(dir, "origin", shallow=True)
 
 
 async def clone_mirror(dir, url):
@@ -538,6 +542,92 @@ async def add_all(dir):
     )
 
 
+async def add_paths(dir, paths):
+    """
+    Stage exactly the given paths (relative to the dir), including their deletion. Unlike 'add_all', git does not
+    have to stat and hash the whole tree
+    """
+    if not paths:
+        return
+
+    with tempfile.NamedTemporaryFile(mode="w", suffix=".pathspec") as pathspec_file:
+        pathspec_file.write("\0".join(paths))
+        pathspec_file.flush()
+
+        await expect_ok(
+            cmd=[
+                "git",
+                "--literal-pathspecs",
+                "add",
+                "-A",
+                "--pathspec-from-file=" + pathspec_file.name,
+                "--pathspec-file-nul",
+            ],
+            desc="Could not add files with git",
+            cwd=dir,
+            print_cmd=True,
+        )
+
+
+async def list_modified_files(dir):
+    """
+    Returns list of the tracked files modified or deleted in the working tree, compared to the index
+    """
+    output = await expect_ok(
+        cmd=["git", "ls-files", "--modified", "--deleted", "-z"],
+        desc="Could not list modified files with git",
+        stdout="text",
+        cwd=dir,
+    )
+    # deleted files are listed by both options
+    return list(dict.fromkeys(path for path in output.split("\0") if path))
+
+
+async def list_untracked_files(dir):
+    """
+    Returns list of the untracked files which are not ignored
+    """
+    output = await expect_ok(
+        cmd=["git", "ls-files", "--others", "--exclude-standard", "-z"],
+        desc="Could not list untracked files with git",
+        stdout="text",
+        cwd=dir,
+    )
+    return [path for path in output.split("\0") if path]
+
+
+async def enable_index_optimizations(dir):
+    """
+    Make status and add operations cheaper on large working trees: index v4 compresses the paths, split-index
+    avoids rewriting the whole index on every change and the untracked cache avoids re-reading unchanged
+    directories
+    """
+    for key, value in (
+        ("index.version", "4"),
+        ("core.splitIndex", "true"),
+        ("core.untrackedCache", "true"),
+    ):
+        await expect_ok(
+            cmd=["git", "config", "--local", key, value],
+            desc="Could not set {} with git".format(key),
+            cwd=dir,
+        )
+
+    await expect_ok(
+        cmd=[
+            "git",
+            "update-index",
+            "--index-version",
+            "4",
+            "--split-index",
+            "--untracked-cache",
+        ],
+        desc="Could not update the index format with git",
+        cwd=dir,
+        print_cmd=True,
+    )
+
+
 async def add_file(dir, file_path, force=False):
     """
     file_path  is relative to the dir
@@ -553,8 +643,98 @@ async def add_file(dir, file_path, force=False):
     )
 
 
-async def fetch_tags(dir, remote="origin", shallow=False):
-    cmd = ["git", "fetch", remote, "--tags"]
+async def list_index_entries(dir, patterns):
+    """
+    List the index entries matching the glob patterns, at any depth of the repository
+
+    Returns: list of (mode, blob sha, path) tuples, sorted by path
+    """
+    pathspecs = [":(glob)**/" + pattern for pattern in patterns]
+
+    output = await expect_ok(
+        cmd=["git", "ls-files", "--stage", "-z", "--"] + pathspecs,
+        desc="Could not list index entries with git",
+        stdout="text",
+        cwd=dir,
+    )
+
+    entries = []
+    for item in output.split("\0"):
+        if not item:
+            continue
+        info, path = item.split("\t", 1)
+        mode, sha, _ = info.split(" ")
+        entries.append((mode, sha, path))
+
+    return entries
+
+
+async def diff_index_files(dir, rev="HEAD"):
+    """
+    Return the files changed in the index compared to 'rev'
+
+    Returns: dict of path to (mode, blob sha) after the change, or None if deleted
+    """
+    output = await expect_ok(
+        cmd=[
+            "git",
+            "diff",
+            "--cached",
+            "--raw",
+            "--no-abbrev",
+            "--no-renames",
+            "-z",
+            rev,
+        ],
+        desc="Could not list changed files with git",
+        stdout="text",
+        cwd=dir,
+    )
+
+    # format is ':<old mode> <new mode> <old sha> <new sha> <status>\0<path>\0'
+    items = output.split("\0")
+    result = {}
+    for info, path in zip(items[0::2], items[1::2]):
+        _, new_mode, _, new_sha, status = info.split(" ")
+        result[path] = None if status == "D" else (new_mode, new_sha)
+
+    return result
+
+
+async def diff_index_binary(dir, rev="HEAD"):
+    """
+    Return the changes in the index compared to 'rev' as a binary patch
+    """
+    return await expect_ok(
+        cmd=["git", "diff", "--cached", "--binary", "--no-renames", rev],
+        desc="Could not create patch with git",
+        stdout="data",
+        cwd=dir,
+    )
+
+
+async def apply_to_index(dir, patch_file):
+    """
+    Apply a patch to both the working tree and the index. Nothing is applied if the
+    patch does not apply cleanly
+    """
+    await expect_ok(
+        cmd=["git", "apply", "--index", "--binary", patch_file],
+        desc="Could not apply patch with git",
+        cwd=dir,
+        print_cmd=True,
+    )
+
+
+async def fetch_tags(dir, remote="origin", shallow=False, auto_gc=True):
+    """
+    If auto_gc is False, the fetch doesn't run the automatic gc and maintenance, so that it can run at the same time
+    as other git commands in the repository
+    """
+    cmd = ["git"]
+    if not auto_gc:
+        cmd.extend(["-c", "gc.auto=0", "-c", "maintenance.auto=false"])
+    cmd.extend(["fetch", remote, "--tags"])
 
     if shallow:
         cmd.extend(["--depth", "1"])
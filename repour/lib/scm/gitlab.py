@@ -1,12 +1,201 @@
 # GitLab utility functions
+#
+# The GitLab REST API is called with aiohttp, so that the requests do not block the
+# event loop. A client is kept per GitLab server, with a pooled session reusing the
+# connections, and a limit of concurrent connections to the server. The groups and the
+# projects are returned as the dicts of the GitLab API.
+#
+# The metadata read by every request (the groups, the subgroups by name, the projects
+# by path and the protected tags of the projects which were verified) is cached by the client
+# for a while. Only what exists is cached, and what Repour creates is added to the
+# cache, so a cached entry can only be stale if it was removed from GitLab.
 
-import gitlab
+import json
+import logging
+import os
+import re
+import time
+import urllib.parse
+
+import aiohttp
+import pylru
+from prometheus_client import Counter
+
+from repour.lib.telemetry import tracing
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_CONNECTIONS = 8
+REQUEST_TIMEOUT = aiohttp.ClientTimeout(total=60)
+PER_PAGE = 100
+DEFAULT_CACHE_TTL_SECONDS = 300
+DEFAULT_CACHE_SIZE = 4096
+
+CACHE_REQUESTS = Counter(
+    "gitlab_metadata_cache_requests",
+    "GitLab metadata found in the cache (hit) or requested from GitLab (miss)",
+    ["kind", "result"],
+)
+
+# access level of the 'Developer' role
+DEVELOPER_ACCESS = 30
+# the group or project of the API paths, left out of the span names
+RESOURCE_PATH_REGEX = re.compile(r"^/(projects|groups)/[^/]+")
+
+# (url, token path) -> GitLabClient
+clients = {}
+
+
+class GitLabError(Exception):
+    def __init__(self, response_code, response_body):
+        super().__init__(
+            "GitLab request failed with response code {}: {}".format(
+                response_code, response_body
+            )
+        )
+        self.response_code = response_code
+        self.response_body = response_body
+
+
+class MetadataCache(object):
+    """
+    Entries of several kinds ('group', 'subgroup', 'project', 'protected_tags'), which
+    expire after the TTL. A TTL of 0 disables the cache.
+    """
+
+    def __init__(self, ttl_seconds=DEFAULT_CACHE_TTL_SECONDS, size=DEFAULT_CACHE_SIZE):
+        self.ttl_seconds = ttl_seconds
+        # (kind, key) -> (value, expiry time)
+        self.entries = pylru.lrucache(size)
+
+    def get(self, kind, key):
+        """
+        Returns: the cached value, or None if unknown or expired
+        """
+        entry = self.entries.get((kind, key), None)
+        if entry is not None and time.monotonic() >= entry[1]:
+            del self.entries[(kind, key)]
+            entry = None
+
+        CACHE_REQUESTS.labels(kind, "miss" if entry is None else "hit").inc()
+        return None if entry is None else entry[0]
+
+    def set(self, kind, key, value):
+        if self.ttl_seconds > 0 and value is not None:
+            self.entries[(kind, key)] = (value, time.monotonic() + self.ttl_seconds)
+
+    def clear(self):
+        self.entries.clear()
+
+
+class GitLabClient(object):
+    def __init__(
+        self,
+        url,
+        token_path,
+        max_connections=DEFAULT_MAX_CONNECTIONS,
+        cache_ttl_seconds=DEFAULT_CACHE_TTL_SECONDS,
+        cache_size=DEFAULT_CACHE_SIZE,
+    ):
+        self.api_url = url.rstrip("/") + "/api/v4"
+        self.token_path = token_path
+        self.max_connections = max_connections
+        self.cache = MetadataCache(cache_ttl_seconds, cache_size)
+        self.token = None
+        self.token_mtime = None
+        self.session = None
+
+    def get_token(self):
+        """
+        The token file is read again only if it changed, when the token is rotated
+        """
+        mtime = os.stat(self.token_path).st_mtime
+        if mtime != self.token_mtime:
+            self.token = read_token(self.token_path)
+            self.token_mtime = mtime
+        return self.token
+
+    def get_session(self):
+        if self.session is None or self.session.closed:
+            self.session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit_per_host=self.max_connections),
+                timeout=REQUEST_TIMEOUT,
+            )
+        return self.session
+
+    async def send(self, method, path, params=None, data=None):
+        """
+        Returns: tuple (parsed json body, response headers)
+        Raises: GitLabError if the response is an error
+        """
+        with tracing.span(
+            "GitLab {} {}".format(method, get_span_path(path)),
+            kind=tracing.SpanKind.CLIENT,
+        ) as span:
+            async with self.get_session().request(
+                method,
+                self.api_url + path,
+                params=params,
+                json=data,
+                headers={"PRIVATE-TOKEN": self.get_token()},
+            ) as response:
+                span.set_attribute("http.response.status_code", response.status)
+                body = await response.text()
+                if response.status >= 400:
+                    raise GitLabError(response.status, body)
+                return (json.loads(body) if body else None), response.headers
+
+    async def get(self, path, params=None):
+        return (await self.send("GET", path, params=params))[0]
+
+    async def post(self, path, data):
+        return (await self.send("POST", path, data=data))[0]
+
+    async def list(self, path, params=None):
+        """
+        Returns: the items of all the pages
+        """
+        params = dict(params or {}, per_page=PER_PAGE)
+        items = []
+        page = "1"
+        while page:
+            params["page"] = page
+            page_items, headers = await self.send("GET", path, params=params)
+            items.extend(page_items)
+            page = headers.get("X-Next-Page", "")
+        return items
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
 
 
 def client(gitlab_config):
-    gitlab_url = gitlab_config.get("url")
-    gitlab_token = read_token(gitlab_config.get("token_path"))
-    return gitlab.Gitlab(url=gitlab_url, private_token=gitlab_token)
+    """
+    Returns: the client of the GitLab server of the configuration, shared by the
+             requests
+    """
+    key = (gitlab_config.get("url"), gitlab_config.get("token_path"))
+    if key not in clients:
+        clients[key] = GitLabClient(
+            gitlab_config.get("url"),
+            gitlab_config.get("token_path"),
+            max_connections=gitlab_config.get(
+                "max_connections", DEFAULT_MAX_CONNECTIONS
+            ),
+            cache_ttl_seconds=gitlab_config.get(
+                "cache_ttl_seconds", DEFAULT_CACHE_TTL_SECONDS
+            ),
+            cache_size=gitlab_config.get("cache_size", DEFAULT_CACHE_SIZE),
+        )
+    return clients[key]
+
+
+async def close_clients():
+    for gl in list(clients.values()):
+        await gl.close()
+    clients.clear()
 
 
 def read_token(token_filepath):
@@ -14,13 +203,29 @@ def read_token(token_filepath):
         return token_file.read().strip()
 
 
-def get_group(gl, group_id):
+def get_span_path(path):
+    return RESOURCE_PATH_REGEX.sub(r"/\1/{id}", path)
+
+
+def quote(value):
+    """
+    Encode a path or an id as one segment of the url, like GitLab expects the paths of
+    groups and projects
+    """
+    return urllib.parse.quote(str(value), safe="")
+
+
+async def get_group(gl, group_id):
     """
     Tries to find the group with given ID. If not found throws an exception.
     """
+    group = gl.cache.get("group", str(group_id))
+    if group is not None:
+        return group
+
     try:
-        return gl.groups.get(group_id)
-    except Exception as ex:
+        group = await gl.get("/groups/" + quote(group_id))
+    except GitLabError as ex:
         if ex.response_code == 404:
             return None
         else:
@@ -28,33 +233,44 @@ def get_group(gl, group_id):
                 f"Could not load group with ID {group_id}! Response code {ex.response_code}, "
                 + f"response body: {ex.response_body}"
             )
+    gl.cache.set("group", str(group_id), group)
+    return group
 
 
-def get_or_create_subgroup(gl, parent_group, subgroup_name):
+async def get_or_create_subgroup(gl, parent_group, subgroup_name):
     """
     Tries to find the subgroup under given parent group by name. If not found it creates a new one.
 
     Output is the found/created subgroup.
     """
 
-    subgroup = None
-    for s in parent_group.subgroups.list(iterator=True):
-        if s.name.casefold() == subgroup_name.casefold():
+    cache_key = (parent_group["id"], subgroup_name.casefold())
+    subgroup = gl.cache.get("subgroup", cache_key)
+    if subgroup is not None:
+        return subgroup
+
+    # the search also matches the names containing the subgroup name
+    for s in await gl.list(
+        "/groups/{}/subgroups".format(parent_group["id"]),
+        params={"search": subgroup_name},
+    ):
+        if s["name"].casefold() == subgroup_name.casefold():
             subgroup = s
     if subgroup is None:
         try:
             # [NCL-8683] default_branch_protection: 0: do not set it
-            subgroup = gl.groups.create(
+            subgroup = await gl.post(
+                "/groups",
                 {
                     "name": subgroup_name,
                     "path": subgroup_name,
-                    "parent_id": parent_group.id,
+                    "parent_id": parent_group["id"],
                     "default_branch_protection": 0,
-                }
+                },
             )
-        except Exception as ex:
+        except GitLabError as ex:
             if (ex.response_code == 400) and (
-                '{:name=>["has already been taken"' in ex.args[0]
+                "has already been taken" in ex.response_body
             ):
                 raise Exception(
                     f"Subgroup {subgroup_name} was not found, but then it was not created because it "
@@ -63,32 +279,38 @@ def get_or_create_subgroup(gl, parent_group, subgroup_name):
             else:
                 raise Exception(
                     f"Subgroup creation of {{'name': {subgroup_name}, 'path': {subgroup_name}, "
-                    + f"'parent_id': {parent_group.id}}} failed! Response code {ex.response_code}, "
+                    + f"'parent_id': {parent_group['id']}}} failed! Response code {ex.response_code}, "
                     + f"response body: {ex.response_body}"
                 )
+    gl.cache.set("subgroup", cache_key, subgroup)
     return subgroup
 
 
-def get_project(gl, project_path):
-    project = None
+async def get_project(gl, project_path):
+    # the paths are case insensitive
+    project = gl.cache.get("project", project_path.casefold())
+    if project is not None:
+        return project
+
     try:
-        project = gl.projects.get(project_path)
-    except Exception as ex:
+        project = await gl.get("/projects/" + quote(project_path))
+    except GitLabError as ex:
         if ex.response_code != 404:
             raise Exception(
                 f"Retrieval of project {project_path} failed! Response code {ex.response_code}, "
                 + f"response body: {ex.response_body}"
             )
+    gl.cache.set("project", project_path.casefold(), project)
     return project
 
 
-def create_project(gl, parent_id, project_name):
+async def create_project(gl, parent_id, project_name):
     try:
-        project = gl.projects.create({"name": project_name, "namespace_id": parent_id})
-    except Exception as ex:
-        if (ex.response_code == 400) and (
-            ex.args[0]["name"][0] == "has already been taken"
-        ):
+        project = await gl.post(
+            "/projects", {"name": project_name, "namespace_id": parent_id}
+        )
+    except GitLabError as ex:
+        if (ex.response_code == 400) and ("has already been taken" in ex.response_body):
             raise Exception(
                 "Creation of project repository failed because it already exists even though it "
                 + f"could not be retrieved before! Response code {ex.response_code}, response "
@@ -98,13 +320,29 @@ def create_project(gl, parent_id, project_name):
             raise Exception(
                 f"Creation failed! Response code {ex.response_code}, response body: {ex.response_body}"
             )
+    if project.get("path_with_namespace"):
+        gl.cache.set("project", project["path_with_namespace"].casefold(), project)
     return project
 
 
-def check_protected_tags(gitlab_config, project=None, gl=None, project_path=None):
+async def get_protected_tags(gl, project):
+    return await gl.list("/projects/{}/protected_tags".format(project["id"]))
+
+
+async def create_protected_tag(gl, project, name, create_access_level=DEVELOPER_ACCESS):
+    protected_tag = await gl.post(
+        "/projects/{}/protected_tags".format(project["id"]),
+        {"name": name, "create_access_level": create_access_level},
+    )
+    verified = gl.cache.get("protected_tags", project["id"]) or frozenset()
+    gl.cache.set("protected_tags", project["id"], verified | {name})
+    return protected_tag
+
+
+async def check_protected_tags(gitlab_config, project=None, gl=None, project_path=None):
     if not project:
         if gl and project_path:
-            project = get_project(gl, project_path)
+            project = await get_project(gl, project_path)
         else:
             raise Exception(
                 "Unable to check protected tags setup. Either project or project "
@@ -125,10 +363,19 @@ def check_protected_tags(gitlab_config, project=None, gl=None, project_path=None
         accepted_patterns.append(prot_tags_pattern)
 
     found = False
-    prot_tags = project.protectedtags.list()
+    if gl is None:
+        gl = client(gitlab_config)
+    # the protected tags which passed the check are cached
+    verified = gl.cache.get("protected_tags", project["id"])
+    if verified and verified.intersection(accepted_patterns):
+        return True
+    prot_tags = await get_protected_tags(gl, project)
     if accepted_patterns and prot_tags:
         for prot_tag in prot_tags:
-            if prot_tag.name in accepted_patterns:
+            if prot_tag["name"] in accepted_patterns:
                 found = True
+                gl.cache.set(
+                    "protected_tags", project["id"], frozenset([prot_tag["name"]])
+                )
                 break
     return found
@@ -0,0 +1,173 @@
+# Tracing
+#
+# Spans of the work done for the requests, continuing the trace of the caller given by
+# the 'traceparent' and 'tracestate' headers:
+#
+# - a server span per request
+# - a job span per job, child of the server span, also when the job runs after the
+#   response in callback mode or in a job process
+# - a span per phase of the job and per command run with asutil.expect_ok, whose
+#   trace context is given to the command through the TRACEPARENT and TRACESTATE
+#   environment variables, for the manipulators
+# - client spans for the calls to Bifrost, to the callbacks and to GitLab
+#
+# The tracer provider and its exporter are set up by the OpenTelemetry distro
+# (opentelemetry-instrument). Without them the spans are not recorded, but the trace
+# context of the caller is still propagated.
+
+import contextlib
+import contextvars
+
+from aiohttp import web
+from opentelemetry import context, trace
+from opentelemetry.trace import SpanKind, Status, StatusCode
+from opentelemetry.trace.propagation.tracecontext import TraceContextTextMapPropagator
+
+tracer = trace.get_tracer("repour")
+propagator = TraceContextTextMapPropagator()
+
+# name -> (span, context token) of the phases of the current job not ended yet
+open_phases = contextvars.ContextVar("open_phases", default=None)
+
+
+def extract(carrier):
+    """
+    Returns: the context of the trace context in the carrier dict ('traceparent' and
+             'tracestate' keys)
+    """
+    return propagator.extract(carrier=carrier)
+
+
+def get_carrier():
+    """
+    Returns: dict with the 'traceparent' and 'tracestate' of the current span, empty if
+             there is no trace
+    """
+    carrier = {}
+    propagator.inject(carrier)
+    return carrier
+
+
+def get_trace_env():
+    """
+    Returns: the TRACEPARENT and TRACESTATE environment variables of the current span
+    """
+    return {key.upper(): value for key, value in get_carrier().items()}
+
+
+def get_traceparent(default=""):
+    return get_carrier().get("traceparent", default)
+
+
+def set_error(current_span, description=None):
+    current_span.set_status(Status(StatusCode.ERROR, description))
+
+
+@web.middleware
+async def middleware(request, handler):
+    """
+    Handle the request in a server span continuing the trace of the caller
+    """
+    carrier = {
+        key: request.headers[key]
+        for key in ("traceparent", "tracestate")
+        if key in request.headers
+    }
+    with tracer.start_as_current_span(
+        "{} {}".format(request.method, request.path),
+        context=extract(carrier),
+        kind=SpanKind.SERVER,
+        attributes={"http.request.method": request.method, "url.path": request.path},
+        record_exception=False,
+        set_status_on_exception=False,
+    ) as current_span:
+        response = None
+        try:
+            response = await handler(request)
+        except web.HTTPException as e:
+            response = e
+            raise
+        except Exception as e:
+            current_span.record_exception(e)
+            set_error(current_span, e.__class__.__name__)
+            raise
+        finally:
+            if response is not None:
+                current_span.set_attribute("http.response.status_code", response.status)
+                if response.status >= 500:
+                    set_error(current_span)
+        return response
+
+
+@contextlib.contextmanager
+def span(name, kind=SpanKind.INTERNAL, attributes=None, traceparent=None):
+    """
+    Span child of the current span, or of the span of 'traceparent' if given
+    """
+    parent = extract({"traceparent": traceparent}) if traceparent else None
+    with tracer.start_as_current_span(
+        name, context=parent, kind=kind, attributes=attributes
+    ) as current_span:
+        yield current_span
+
+
+@contextlib.contextmanager
+def job_span(name, attributes=None):
+    """
+    Span of a job, child of the current span. The phases left open by the job are
+    ended with it
+    """
+    with tracer.start_as_current_span(name, attributes=attributes) as current_span:
+        with phases():
+            yield current_span
+
+
+@contextlib.contextmanager
+def remote_job(carrier):
+    """
+    Continue in a job process the job span of the server given by the carrier
+    """
+    token = context.attach(extract(carrier))
+    try:
+        with phases():
+            yield
+    finally:
+        context.detach(token)
+
+
+@contextlib.contextmanager
+def phases():
+    """
+    Phases of the current job, the ones left open are ended on exit
+    """
+    open_spans = {}
+    token = open_phases.set(open_spans)
+    try:
+        yield
+    finally:
+        for phase_span, _ in open_spans.values():
+            set_error(phase_span, "Phase not ended")
+            phase_span.end()
+        open_phases.reset(token)
+
+
+def start_phase(name):
+    """
+    Start the span of a phase of the current job, current span until 'end_phase'
+    """
+    phases = open_phases.get()
+    if phases is None or name in phases:
+        return
+    phase_span = tracer.start_span(name)
+    phases[name] = (phase_span, context.attach(trace.set_span_in_context(phase_span)))
+
+
+def end_phase(name):
+    phases = open_phases.get()
+    if phases is None or name not in phases:
+        return
+    phase_span, token = phases.pop(name)
+    # the phase ends in the task it started in
+    if trace.get_current_span() is phase_span:
+        context.detach(token)
+    phase_span.end()
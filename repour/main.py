@@ -1,13 +1,16 @@
 # flake8: noqa
 import argparse
 import asyncio
-import copy
+import atexit
+import functools
 import logging
 import os
+import shutil
 import sys
 
 from kafka_logger.handlers import KafkaLoggingHandler
 
+from repour.config import config
 from repour.lib.logs import file_callback_log
 from repour.lib.logs import json_custom_formatter
 from repour.lib.logs import log_util
@@ -22,13 +25,13 @@ class ContextLogRecord(logging.LogRecord):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
 
+        # the mdc is immutable, changing it replaces it in the context. So keeping a
+        # reference captures the mdc at the time the log was submitted, even though
+        # logging is async
+        self.mdc = log_util.get_mdc()
+
         task = self.get_current_task()
         if task is not None:
-            # shallow copy the mdc. this is needed since logging is async and
-            # could be sent after changes in the mdc object. So we want to
-            # capture the mdc object at the time the log was submitted, not
-            # afterwards
-            self.mdc = copy.copy(getattr(task, "mdc", {}))
             self.log_context = getattr(task, "log_context", self.no_context_found)
 
             # required for bifrost for streaming logs
@@ -48,7 +51,7 @@ class ContextLogRecord(logging.LogRecord):
 # Subcommands
 #
 def run_container_subcommand(args):
-    from repour.server import server
+    from repour.server import workers
 
     # Log to stdout/stderr only (no file)
     kafka_server = os.environ.get("REPOUR_KAFKA_SERVER")
@@ -62,17 +65,6 @@ def run_container_subcommand(args):
         "REPOUR_KAFKA_CONNECTIONS_MAX_IDLE_MS"
     )
 
-    configure_logging(
-        args.log,
-        kafka_server=kafka_server,
-        kafka_topic=kafka_topic,
-        kafka_cafile=kafka_cafile,
-        kafka_sasl_username=kafka_sasl_username,
-        kafka_sasl_password=kafka_sasl_password,
-        kafka_connection_max_idle_ms=kafka_connection_max_idle_ms,
-        kafka_sasl_mechanism=kafka_sasl_mechanism,
-    )
-
     # Read required config from env vars, most of it is hardcoded though
     missing_envs = []
 
@@ -96,34 +88,72 @@ def run_container_subcommand(args):
             print("{m[0]} ({m[1]})".format(m=missing_env))
         return 2
 
-    # Go
-    server.start_server(
-        bind={"address": None, "port": 7331},
-        repo_provider=repo_provider,
-        repour_url=repour_url,
-        adjust_provider={
-            "type": "subprocess",
-            "params": {
-                "description": "PME",
-                "cmd": [
-                    "java",
-                    "-jar",
-                    os.path.join(os.getcwd(), "pom-manipulation-cli.jar"),
-                    "-s",
-                    "/home/repour/settings.xml",
-                    "-DrestMaxSize=30",
-                    "-DrestURL=" + da_url,
-                    "-DversionIncrementalSuffix=redhat",
-                    "-DallowConfigFilePrecedence=true",
-                    "-DrepoReportingRemoval=true",
-                    "-DdependencySource=REST",
-                    "-DrepoRemovalBackup=repositories-backup.xml",
-                ],
-                "log_context_option": "--log-context",
-                "send_log": False,  # enable when PNC central logging is ready
+    def start_server(worker_index=None):
+        # imported once the supervisor set up the environment, the metrics are
+        # created at import
+        from repour.server import server
+
+        # also sets up the logging of the job processes, if any
+        setup_logging = functools.partial(
+            configure_logging,
+            args.log,
+            kafka_server=kafka_server,
+            kafka_topic=kafka_topic,
+            kafka_cafile=kafka_cafile,
+            kafka_sasl_username=kafka_sasl_username,
+            kafka_sasl_password=kafka_sasl_password,
+            kafka_connection_max_idle_ms=kafka_connection_max_idle_ms,
+            kafka_sasl_mechanism=kafka_sasl_mechanism,
+        )
+        setup_logging()
+
+        server.start_server(
+            bind={
+                "address": None,
+                "port": 7331,
+                "reuse_port": worker_index is not None,
             },
-        },
-    )
+            repo_provider=repo_provider,
+            repour_url=repour_url,
+            adjust_provider={
+                "type": "subprocess",
+                "params": {
+                    "description": "PME",
+                    "cmd": [
+                        "java",
+                        "-jar",
+                        os.path.join(os.getcwd(), "pom-manipulation-cli.jar"),
+                        "-s",
+                        "/home/repour/settings.xml",
+                        "-DrestMaxSize=30",
+                        "-DrestURL=" + da_url,
+                        "-DversionIncrementalSuffix=redhat",
+                        "-DallowConfigFilePrecedence=true",
+                        "-DrepoReportingRemoval=true",
+                        "-DdependencySource=REST",
+                        "-DrepoRemovalBackup=repositories-backup.xml",
+                    ],
+                    "log_context_option": "--log-context",
+                    "send_log": False,  # enable when PNC central logging is ready
+                },
+            },
+            job_process_initializer=setup_logging,
+        )
+
+    # Go
+    worker_count = workers.get_worker_count()
+    if worker_count > 1:
+        configure_supervisor_logging(args.log)
+        return workers.supervise(worker_count, start_server)
+
+    job_execution_config = config.get_configuration_sync().get("job_execution", {})
+    if job_execution_config.get("mode", "loop") == "process":
+        # the job processes write their metrics there too
+        metrics_directory = workers.prepare_prometheus_multiproc_dir()
+        if metrics_directory is not None:
+            atexit.register(shutil.rmtree, metrics_directory, True)
+
+    start_server()
 
 
 #
@@ -192,15 +222,16 @@ def configure_logging(
     console_log.setFormatter(json_formatter)
     root_logger.addHandler(console_log)
 
-    callback_id_log = file_callback_log.FileCallbackHandler()
+    callback_id_log = file_callback_log.FileCallbackHandler(
+        max_open_files=file_callback_log.get_max_open_files(
+            config.get_configuration_sync()
+        )
+    )
     callback_id_log.setFormatter(formatter_callback)
     root_logger.addHandler(callback_id_log)
 
     print("Callback handler setup")
 
-    # Cleanup of old log files
-    asyncio.get_event_loop().create_task(file_callback_log.setup_clean_old_logfiles())
-
     root_logger.setLevel(getattr(logging, default_level))
 
     if (
@@ -245,6 +276,25 @@ def configure_logging(
             logger.exception("Kafka logging could not be setup")
 
 
+def configure_supervisor_logging(default_level):
+    """
+    Log to stdout only: the callback log files and the Kafka producer thread would be
+    inherited by the forked workers, which set up their own
+    """
+    logging.setLogRecordFactory(ContextLogRecord)
+
+    console_log = logging.StreamHandler()
+    console_log.setFormatter(
+        json_custom_formatter.JsonCustomFormatter(
+            "%(timestamp)s %(level)s %(name)s %(message)s %(hostName)s %(mdc)s"
+        )
+    )
+
+    root_logger = logging.getLogger()
+    root_logger.addHandler(console_log)
+    root_logger.setLevel(getattr(logging, default_level))
+
+
 def adjust_kafka_metadata(data):
     """
     This is needed for the log-event-duration service to work properly
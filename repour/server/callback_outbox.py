@@ -0,0 +1,492 @@
+# Callback outbox
+#
+# The result of a request in callback mode is written to the outbox directory under
+# SHARED_FOLDER as soon as it is known, and the request task ends. A small pool of
+# workers then uploads the logs of the request to Bifrost and sends the result to the
+# callback url, retrying with exponential backoff and jitter. If the logs cannot be
+# uploaded, the result is sent anyway and the upload becomes an entry of its own,
+# retried in the background.
+#
+# An entry is a JSON file named '<time of next attempt in ms>-<kind>-<callback id>.json'
+# in the 'pending' folder. A worker claims it by renaming it into the 'claimed' folder,
+# so that the replicas sharing SHARED_FOLDER never send it twice. Entries left
+# claimed by a replica that died are moved back to 'pending' after CLAIM_TIMEOUT_SECONDS,
+# so the pending results are still delivered after a restart.
+
+import asyncio
+import datetime
+import logging
+import os
+import random
+import tempfile
+import time
+
+import aiohttp
+from prometheus_async.aio import time as time_it
+from prometheus_client import Counter, Gauge, Histogram, Summary
+
+from repour.auth import auth_client
+from repour.config import config
+from repour.lib.bifrost import client, streamer
+from repour.lib.io import fast_json
+from repour.lib.logs import file_callback_log
+from repour.lib.telemetry import tracing
+
+logger = logging.getLogger(__name__)
+
+SHARED_PATH_PREFOLDER = os.environ.get("SHARED_FOLDER", "/tmp")
+CALLBACK_OUTBOX_PATH = os.path.join(SHARED_PATH_PREFOLDER, "repour-callback-outbox")
+
+DEFAULT_WORKERS = 4
+DEFAULT_LIMIT_PER_HOST = 4
+DEFAULT_MAX_ATTEMPTS = 9
+DEFAULT_MAX_DELAY_SECONDS = 600
+
+PERIOD_SCAN_SLEEP = 1
+CLAIM_TIMEOUT_SECONDS = 600
+REQUEST_TIMEOUT_SECONDS = 120
+
+# kinds of entries
+CALLBACK = "callback"
+LOGS = "logs"
+
+ERROR_CALLBACK_COUNTER = Counter(
+    "error_callback_counter", "Errors calling callback url"
+)
+CALLBACK_RETRIES = Counter(
+    "callback_retries", "Callback deliveries and log uploads rescheduled", ["kind"]
+)
+CALLBACK_GIVEN_UP = Counter(
+    "callback_given_up",
+    "Callback results and log uploads dropped after the last attempt",
+    ["kind"],
+)
+CALLBACK_DELIVERY_LATENCY = Histogram(
+    "callback_delivery_latency",
+    "Time between the result being known and its delivery to the callback",
+    buckets=(0.1, 0.5, 1, 5, 10, 30, 60, 300, 900, 3600, float("inf")),
+)
+# the workers of the pod share the outbox folder
+CALLBACK_OUTBOX_PENDING = Gauge(
+    "callback_outbox_pending",
+    "Callback results waiting for their next attempt",
+    multiprocess_mode="livemax",
+)
+
+REQ_TIME = Summary("callback_time", "time spent with calling callback")
+REQ_HISTOGRAM_TIME = Histogram("callback_histogram", "Histogram for calling callback")
+
+
+def create_entry(
+    callback_id, callback, obj, mdc, logger_name, send_logs_to_bifrost, forward_auth
+):
+    """
+    callback: the callback spec to use, with keys 'url' (or 'uri') and optionally 'method'
+    obj: result to send, including its 'callback' object
+    mdc: log context of the request, sent as headers
+    """
+    return {
+        "kind": CALLBACK,
+        "id": callback_id,
+        "method": callback.get("method", "POST"),
+        "url": callback.get("url", callback.get("uri")),
+        "body": obj,
+        "mdc": mdc,
+        "loggerName": logger_name,
+        "sendLogs": send_logs_to_bifrost,
+        "forwardAuth": forward_auth,
+        "logsOffset": 0,
+        "attempts": 0,
+        "created": time.time(),
+    }
+
+
+def create_logs_entry(entry):
+    """
+    Entry uploading the logs of a callback entry on its own
+    """
+    return dict(entry, kind=LOGS, sendLogs=True, attempts=0)
+
+
+def get_retry_delay(attempts, max_delay=DEFAULT_MAX_DELAY_SECONDS):
+    """
+    Exponential backoff with jitter, so that the results of a burst of requests do not
+    all hit a recovering callback target at the same time
+    """
+    delay = min(max_delay, 2**attempts)
+    return random.uniform(delay / 2, delay)
+
+
+def create_log_metadata(mdc, logger_name, end_time=""):
+    return client.LogMetadata(
+        end_time=end_time,
+        logger_name=logger_name,
+        user_id=mdc["userId"],
+        expires=mdc["expires"],
+        process_context=mdc["processContext"],
+        process_context_variant=mdc["processContextVariant"],
+        tmp=mdc["tmp"],
+        request_context=mdc["requestContext"],
+        trace_id=mdc["trace_id"],
+        span_id=mdc["span_id"],
+        traceparent=mdc["traceparent"],
+        tag="alignment-log",
+    )
+
+
+async def upload_logs(session, entry, configuration):
+    log_file = file_callback_log.get_callback_log_path(entry["id"])
+
+    if not os.path.isfile(log_file):
+        logger.error("Logs for callback_id: {} missing!".format(entry["id"]))
+        return
+
+    log_metadata = create_log_metadata(
+        entry["mdc"],
+        entry["loggerName"],
+        end_time=datetime.datetime.fromtimestamp(entry["created"])
+        .astimezone()
+        .isoformat(),
+    )
+
+    # only the part not streamed while the request was running is left to send
+    offset, md5 = streamer.get_streamed_state(
+        entry["id"], log_file, entry["logsOffset"]
+    )
+
+    await client.send(
+        configuration.get("bifrost_url"),
+        log_file,
+        log_metadata,
+        await auth_client.access_token(),
+        session=session,
+        offset=offset,
+        md5=md5,
+    )
+    streamer.forget_streamed_state(entry["id"])
+    logger.info("Sending logs to Bifrost successful")
+
+
+@time_it(REQ_TIME)
+@time_it(REQ_HISTOGRAM_TIME)
+async def send_result(session, entry, configuration):
+    """
+    Send the result of the entry to its callback
+
+    Returns: the HTTP status of the callback response
+    """
+    headers = {}
+
+    # the token is obtained at send time since the entry may have waited longer than
+    # the token lifetime
+    auth_provider = configuration.get("auth", {}).get("provider", None)
+    if auth_provider == "oauth2_jwt" and entry["forwardAuth"]:
+        headers["Authorization"] = "Bearer " + await auth_client.access_token()
+
+    mdc = entry["mdc"]
+    with tracing.span(
+        "callback " + entry["method"],
+        kind=tracing.SpanKind.CLIENT,
+        attributes={"repour.callback_id": entry["id"]},
+        traceparent=mdc["traceparent"],
+    ) as span:
+        headers.update(
+            {
+                "log-user-id": mdc["userId"],
+                "log-request-context": mdc["requestContext"],
+                "log-process-context": mdc["processContext"],
+                "log-expires": mdc["expires"],
+                "log-tmp": mdc["tmp"],
+                "process-context-variant": mdc["processContextVariant"],
+                "trace-id": mdc["trace_id"],
+                "span-id": mdc["span_id"],
+                "traceparent": tracing.get_traceparent(mdc["traceparent"]),
+                "Content-Type": "application/json",
+            }
+        )
+
+        async with session.request(
+            entry["method"],
+            entry["url"],
+            headers=headers,
+            data=fast_json.dumps(entry["body"]),
+        ) as resp:
+            span.set_attribute("http.response.status_code", resp.status)
+            if resp.status >= 400:
+                tracing.set_error(span, "Status {}".format(resp.status))
+            return resp.status
+
+
+def get_entry_name(entry, next_attempt):
+    return "{:013d}-{}-{}.json".format(
+        int(next_attempt * 1000), entry["kind"], entry["id"]
+    )
+
+
+def get_next_attempt(name):
+    return int(name.split("-", 1)[0]) / 1000
+
+
+def write_entry(entry, path):
+    # write to a temporary file first so that the workers never see a partial entry
+    directory = os.path.dirname(path)
+    fd, temp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(fast_json.dumps(entry))
+        os.replace(temp_path, path)
+    except Exception:
+        remove_file(temp_path)
+        raise
+
+
+def read_entry(path):
+    """
+    Returns: the entry, or None if it is gone
+    """
+    try:
+        with open(path, "rb") as f:
+            return fast_json.loads(f.read())
+    except FileNotFoundError:
+        return None
+
+
+def remove_file(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+class CallbackOutbox(object):
+    def __init__(
+        self,
+        directory=None,
+        workers=DEFAULT_WORKERS,
+        limit_per_host=DEFAULT_LIMIT_PER_HOST,
+        max_attempts=DEFAULT_MAX_ATTEMPTS,
+        max_delay=DEFAULT_MAX_DELAY_SECONDS,
+    ):
+        directory = directory or CALLBACK_OUTBOX_PATH
+        self.pending_dir = os.path.join(directory, "pending")
+        self.claimed_dir = os.path.join(directory, "claimed")
+        self.workers = workers
+        self.limit_per_host = limit_per_host
+        self.max_attempts = max_attempts
+        self.max_delay = max_delay
+        self.session = None
+        self.queue = None
+        self.tasks = []
+
+    @classmethod
+    def from_configuration(cls, configuration):
+        outbox_config = configuration.get("callback_outbox", {})
+        return cls(
+            workers=outbox_config.get("workers", DEFAULT_WORKERS),
+            limit_per_host=outbox_config.get("limit_per_host", DEFAULT_LIMIT_PER_HOST),
+            max_attempts=outbox_config.get("max_attempts", DEFAULT_MAX_ATTEMPTS),
+            max_delay=outbox_config.get("max_delay_seconds", DEFAULT_MAX_DELAY_SECONDS),
+        )
+
+    def start(self):
+        os.makedirs(self.pending_dir, exist_ok=True)
+        os.makedirs(self.claimed_dir, exist_ok=True)
+
+        self.queue = asyncio.Queue()
+        self.session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit_per_host=self.limit_per_host),
+            timeout=aiohttp.ClientTimeout(total=REQUEST_TIMEOUT_SECONDS),
+        )
+
+        loop = asyncio.get_event_loop()
+        self.tasks = [loop.create_task(self.scan_loop())] + [
+            loop.create_task(self.worker()) for _ in range(self.workers)
+        ]
+
+    async def stop(self):
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+        if self.session is not None:
+            await self.session.close()
+
+    async def put(self, entry):
+        """
+        Persist the entry and queue it for delivery right away
+        """
+        name = get_entry_name(entry, time.time())
+        path = os.path.join(self.claimed_dir, name)
+        # the outbox folder is often on NFS, keep its access off the event loop
+        await asyncio.get_event_loop().run_in_executor(None, write_entry, entry, path)
+        logger.info("Callback result {} stored in outbox".format(entry["id"]))
+        self.queue.put_nowait(path)
+
+    async def reschedule(self, entry):
+        next_attempt = time.time() + get_retry_delay(entry["attempts"], self.max_delay)
+        await asyncio.get_event_loop().run_in_executor(
+            None,
+            write_entry,
+            entry,
+            os.path.join(self.pending_dir, get_entry_name(entry, next_attempt)),
+        )
+
+    def claim(self, name):
+        """
+        Move a pending entry to the claimed folder
+
+        Returns: the path of the claimed entry, or None if another worker was faster
+        """
+        pending_path = os.path.join(self.pending_dir, name)
+        claimed_path = os.path.join(self.claimed_dir, name)
+        try:
+            # the modification time tells when the claim happened
+            os.utime(pending_path)
+            os.rename(pending_path, claimed_path)
+        except FileNotFoundError:
+            return None
+        return claimed_path
+
+    def claim_due(self):
+        """
+        Claim the pending entries whose next attempt is due, and give back the expired
+        claims
+
+        Returns: tuple (number of pending entries, paths of the claimed entries)
+        """
+        now = time.time()
+
+        for name in os.listdir(self.claimed_dir):
+            path = os.path.join(self.claimed_dir, name)
+            try:
+                if now - os.path.getmtime(path) > CLAIM_TIMEOUT_SECONDS:
+                    logger.warning("Releasing expired claim of callback " + name)
+                    os.rename(path, os.path.join(self.pending_dir, name))
+            except OSError:
+                pass
+
+        names = sorted(n for n in os.listdir(self.pending_dir) if n.endswith(".json"))
+
+        claimed_paths = []
+        for name in names:
+            if get_next_attempt(name) > now:
+                # sorted by next attempt
+                break
+            path = self.claim(name)
+            if path is not None:
+                claimed_paths.append(path)
+        return len(names), claimed_paths
+
+    async def scan(self):
+        """
+        Claim and queue the pending entries whose next attempt is due
+        """
+        pending_count, claimed_paths = await asyncio.get_event_loop().run_in_executor(
+            None, self.claim_due
+        )
+        CALLBACK_OUTBOX_PENDING.set(pending_count)
+        for path in claimed_paths:
+            self.queue.put_nowait(path)
+
+    async def scan_loop(self):
+        while True:
+            try:
+                await self.scan()
+            except Exception as e:
+                logger.error("Could not scan callback outbox: " + str(e))
+            await asyncio.sleep(PERIOD_SCAN_SLEEP)
+
+    async def worker(self):
+        while True:
+            path = await self.queue.get()
+            try:
+                await self.process(path)
+            except Exception as e:
+                logger.error("Could not process callback outbox entry: " + str(e))
+
+    async def process(self, path):
+        loop = asyncio.get_event_loop()
+        entry = await loop.run_in_executor(None, read_entry, path)
+        if entry is None:
+            return
+
+        kind = entry["kind"]
+        entry["attempts"] += 1
+
+        try:
+            c = await config.get_configuration()
+            if kind == LOGS:
+                logger.info(
+                    "Sending logs of callback {}, attempt {}/{}".format(
+                        entry["id"], entry["attempts"], self.max_attempts
+                    )
+                )
+                await upload_logs(self.session, entry, c)
+                done = True
+            else:
+                done = await self.process_callback(entry, c)
+        except Exception as e:
+            if kind == CALLBACK:
+                ERROR_CALLBACK_COUNTER.inc()
+            logger.error(
+                "Unable to process {} entry of callback {}, exception {}".format(
+                    kind, entry["id"], e.__class__.__name__
+                )
+            )
+            logger.error(e, exc_info=True)
+            done = False
+
+        if done:
+            await loop.run_in_executor(None, remove_file, path)
+            return
+
+        if entry["attempts"] >= self.max_attempts:
+            CALLBACK_GIVEN_UP.labels(kind).inc()
+            logger.error(
+                "Giving up on {} entry of callback {} after {} attempts".format(
+                    kind, entry["id"], entry["attempts"]
+                )
+            )
+        else:
+            CALLBACK_RETRIES.labels(kind).inc()
+            await self.reschedule(entry)
+
+        await loop.run_in_executor(None, remove_file, path)
+
+    async def process_callback(self, entry, configuration):
+        """
+        Returns: True if the result was delivered
+        """
+        if entry["sendLogs"]:
+            # a single attempt, Bifrost being unavailable must not delay the result
+            try:
+                await upload_logs(self.session, entry, configuration)
+            except Exception as e:
+                logger.warning(
+                    "Unable to send logs of callback {} ({}), retrying in background".format(
+                        entry["id"], e
+                    )
+                )
+                logs_entry = create_logs_entry(entry)
+                logs_entry["attempts"] = 1
+                await self.reschedule(logs_entry)
+            entry["sendLogs"] = False
+
+        logger.info(
+            "Sending result of callback {}, attempt {}/{}".format(
+                entry["id"], entry["attempts"], self.max_attempts
+            )
+        )
+        status = await send_result(self.session, entry, configuration)
+
+        if status // 100 == 2:
+            CALLBACK_DELIVERY_LATENCY.observe(time.time() - entry["created"])
+            logger.info("Callback result {} sent successfully".format(entry["id"]))
+            return True
+
+        logger.info(
+            "Unable to send result of callback {}, status {}".format(
+                entry["id"], status
+            )
+        )
+        return False
@@ -0,0 +1,142 @@
+# Command metrics
+#
+# The commands run through asutil.expect_ok (git, the manipulators, ...) are measured
+# by executable and subcommand: the time they take, their exit codes and the size of
+# their output. The subcommand is only taken from the git commands, and never contains
+# the URLs or the paths given to the command, to keep the number of label values small.
+#
+# The commands slower than 'command_metrics/slow_threshold_seconds' are also kept,
+# with their arguments, in a ring buffer listed by GET /debug/slow-commands.
+
+import collections
+import datetime
+import os
+import re
+
+from prometheus_client import Counter, Histogram
+
+from repour.config import config
+from repour.server import task_registry
+
+DEFAULT_SLOW_BUFFER_SIZE = 100
+
+COMMAND_TIME = Histogram(
+    "command_duration_seconds",
+    "Time spent running a command, by executable and subcommand",
+    ["executable", "subcommand"],
+    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800),
+)
+COMMAND_EXITS = Counter(
+    "command_exits",
+    "Commands which exited, by executable, subcommand and exit code",
+    ["executable", "subcommand", "exit_code"],
+)
+COMMAND_OUTPUT_BYTES = Counter(
+    "command_output_bytes",
+    "Bytes written by the commands to their stdout and stderr",
+    ["executable", "subcommand"],
+)
+
+# options of git taking a value, given before the subcommand
+GIT_OPTIONS_WITH_VALUE = {"-c", "-C", "--git-dir", "--work-tree", "--namespace"}
+# subcommands with their own subcommands, such as 'git lfs fetch'
+GIT_SUBCOMMAND_GROUPS = {"lfs", "remote", "submodule", "worktree"}
+LABEL_REGEX = re.compile(r"[A-Za-z][A-Za-z0-9_.+-]*")
+URL_PASSWORD_REGEX = re.compile(r"(\w+://[^/@:\s]*):[^/@\s]*@")
+
+slow_commands = None
+# set in the job processes, to send the slow commands to the server
+slow_command_handler = None
+
+
+def normalize_label(value):
+    return value if LABEL_REGEX.fullmatch(value) else "other"
+
+
+def get_command_labels(cmd):
+    """
+    Returns: tuple (executable, subcommand), the subcommand is empty if not a git command
+    """
+    executable = normalize_label(os.path.basename(cmd[0]))
+    if executable != "git":
+        return executable, ""
+
+    words = []
+    skip_value = False
+    for arg in cmd[1:]:
+        if skip_value:
+            skip_value = False
+        elif arg in GIT_OPTIONS_WITH_VALUE:
+            skip_value = True
+        elif not arg.startswith("-"):
+            words.append(normalize_label(arg))
+            if len(words) == 2 or words[0] not in GIT_SUBCOMMAND_GROUPS:
+                break
+    return executable, " ".join(words)
+
+
+def redact(arg):
+    """
+    Remove the passwords of the URLs
+    """
+    return URL_PASSWORD_REGEX.sub(r"\1:***@", arg)
+
+
+def summarize(cmd, max_args=8, max_length=100):
+    """
+    Returns: the first arguments of the command without the passwords, each one
+             truncated, for the traces
+    """
+    args = [redact(arg) for arg in cmd[:max_args]]
+    args = [arg if len(arg) <= max_length else arg[:max_length] + "..." for arg in args]
+    if len(cmd) > max_args:
+        args.append("... ({} more)".format(len(cmd) - max_args))
+    return args
+
+
+def get_slow_commands():
+    global slow_commands
+
+    if slow_commands is None:
+        buffer_size = (
+            config.get_configuration_sync()
+            .get("command_metrics", {})
+            .get("slow_buffer_size", DEFAULT_SLOW_BUFFER_SIZE)
+        )
+        slow_commands = collections.deque(maxlen=buffer_size)
+    return slow_commands
+
+
+def add_slow_command(entry):
+    get_slow_commands().append(entry)
+
+
+def record(cmd, cwd, exit_code, duration, output_bytes):
+    executable, subcommand = get_command_labels(cmd)
+    COMMAND_TIME.labels(executable, subcommand).observe(duration)
+    COMMAND_EXITS.labels(executable, subcommand, str(exit_code)).inc()
+    COMMAND_OUTPUT_BYTES.labels(executable, subcommand).inc(output_bytes)
+
+    threshold = (
+        config.get_configuration_sync()
+        .get("command_metrics", {})
+        .get("slow_threshold_seconds", None)
+    )
+    if threshold is None or duration < threshold:
+        return
+
+    task_info = task_registry.current_task_info.get()
+    entry = {
+        "command": [redact(arg) for arg in cmd],
+        "cwd": cwd,
+        "exitCode": exit_code,
+        "durationSeconds": round(duration, 3),
+        "outputBytes": output_bytes,
+        "finished": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "callbackId": getattr(task_info, "callback_id", None),
+        "taskId": getattr(task_info, "task_id", None),
+    }
+    if slow_command_handler is not None:
+        slow_command_handler(entry)
+    else:
+        add_slow_command(entry)
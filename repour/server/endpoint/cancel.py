@@ -4,23 +4,48 @@ import calendar
 import json
 import logging
 import os
+import socket
 import time as python_time
 
+import aiohttp
 from aiohttp import web
 from prometheus_async.aio import time
-from prometheus_client import Histogram, Summary
+from prometheus_client import Counter, Histogram, Summary
 from repour import asutil
+from repour.config import config
+from repour.lib.io import inotify
+from repour.lib.logs import file_callback_log
+from repour.server import task_registry, workers
 
 REQ_TIME = Summary("cancel_req_time", "time spent with cancel endpoint")
 REQ_HISTOGRAM_TIME = Histogram("cancel_req_histogram", "Histogram for cancel endpoint")
 
+CANCEL_REQUESTS = Counter(
+    "cancel_requests",
+    "Cancel requests, by replica which cancelled the task: local, worker (of the same pod), peer (HTTP), indicator (file), not_found",
+    ["result"],
+)
+
 PERIOD_CANCEL_LOOP_SLEEP = 0.5
+MAX_PERIOD_CANCEL_LOOP_SLEEP = 2
+CANCEL_WAIT_SECONDS = 5
+# the indicators are also listed when watched, in case an event was missed, soon
+# enough for the cancel requests of the other replicas not to time out
+WATCH_RESCAN_SECONDS = CANCEL_WAIT_SECONDS
+CLEANUP_INTERVAL = 600
+
+INDICATOR_SUFFIX = ".cancel"
+
+DEFAULT_PEERS_PORT = 7331
+PEER_TIMEOUT = aiohttp.ClientTimeout(total=2)
 
 SHARED_PATH_PREFOLDER = os.environ.get("SHARED_FOLDER", "/tmp")
 CANCEL_PATH = os.path.join(SHARED_PATH_PREFOLDER, "cancel-notify")
 
 logger = logging.getLogger(__name__)
 
+cancel_indicators = None
+
 
 @time(REQ_TIME)
 @time(REQ_HISTOGRAM_TIME)
@@ -33,14 +58,18 @@ async def handle_cancel(request):
         return response
 
     cancelled_tasks = False
-    task_id_dict = get_task_id_dict()
 
-    if task_id_to_cancel in task_id_dict:
-        task_id_dict[task_id_to_cancel].cancel()
+    authorization = request.headers.get("Authorization", None)
+
+    if cancel_local_task(task_id_to_cancel):
+        CANCEL_REQUESTS.labels("local").inc()
+        cancelled_tasks = True
+    elif await cancel_on_siblings(task_id_to_cancel, authorization):
+        CANCEL_REQUESTS.labels("worker").inc()
         cancelled_tasks = True
     else:
         cancelled_tasks = await check_if_other_repour_replicas_cancelled(
-            task_id_to_cancel
+            task_id_to_cancel, authorization
         )
 
     if cancelled_tasks:
@@ -56,6 +85,50 @@ async def handle_cancel(request):
         return response
 
 
+async def handle_cancel_local(request):
+    """
+    Cancel request sent by a peer, only for the tasks of this replica
+    """
+    task_id_to_cancel = request.match_info["task_id"]
+
+    if cancel_local_task(task_id_to_cancel) or await cancel_on_siblings(
+        task_id_to_cancel, request.headers.get("Authorization", None)
+    ):
+        logger.info("From peer: cancelling task: " + task_id_to_cancel)
+        return await success_response(
+            "Tasks with task_id: " + str(task_id_to_cancel) + " cancelled"
+        )
+
+    return not_found_response(task_id_to_cancel)
+
+
+async def handle_cancel_worker(request):
+    """
+    Cancel request sent by another worker of this replica, only for the tasks of this
+    worker
+    """
+    task_id_to_cancel = request.match_info["task_id"]
+
+    if cancel_local_task(task_id_to_cancel):
+        logger.info("From worker: cancelling task: " + task_id_to_cancel)
+        return await success_response(
+            "Tasks with task_id: " + str(task_id_to_cancel) + " cancelled"
+        )
+
+    return not_found_response(task_id_to_cancel)
+
+
+def not_found_response(task_id):
+    return web.Response(
+        status=404,
+        content_type="application/json",
+        text=json.dumps(
+            obj=[{"error_message": "task id " + task_id + " not found"}],
+            ensure_ascii=False,
+        ),
+    )
+
+
 async def bad_response(error_message):
     logger.warn(error_message)
     response = web.Response(
@@ -77,7 +150,7 @@ async def success_response(message):
     return response
 
 
-# The start_cancel_loop and the check_if_other_repour_replicas_cancelled work hand in hand
+# The cancel indicators and the peers work hand in hand
 # Those stuff are done to be able to run repour with multiple replicas
 #
 # When a request to cancel a task comes in, we first check if the task is present in the
@@ -85,89 +158,347 @@ async def success_response(message):
 #
 # If yes -> cancel that task and report back to the client
 #
-# If no ->
-# - Create an indicator file in a shared location to indicate that we want to cancel a task
-# - Verify every PERIOD_CANCEL_LOOP_SLEEP seconds, for up to 10 times, if the indicator file got deleted
+# If no, and the replica runs several workers -> ask the other workers through their Unix
+# sockets
+#
+# If still no ->
+# - Ask the peers, the other replicas listed in the configuration or found through DNS,
+#   to cancel the task if they run it
+# - if one of them did -> the cancel was successful
+# - else, create an indicator file in a shared location to indicate that we want to cancel a task
+# - Wait up to CANCEL_WAIT_SECONDS for the indicator file to be deleted
 # - if yes -> the cancel was successful
 # - if no -> cancel was unsuccessful. Delete the indicator file and tell the caller the cancel operation was unsuccessful
-
-
+#
 # - that indicator file is seen by other repour replicas (via the shared location) in the 'start_cancel_loop'
 # - the other repour replicas check their event loop, and if they found and cancelled the task, they delete the indicator file
 #
-# The 'start_cancel_loop' runs every PERIOD_CANCEL_LOOP_SLEEP seconds to check
+# The shared location is watched with inotify if it is on a local filesystem. Otherwise it is
+# listed every PERIOD_CANCEL_LOOP_SLEEP seconds while cancel requests are pending, and less
+# often, up to MAX_PERIOD_CANCEL_LOOP_SLEEP seconds, when idle
 async def start_cancel_loop():
-    if not os.path.exists(CANCEL_PATH):
-        os.makedirs(CANCEL_PATH)
+    await get_cancel_indicators().run()
 
-    while True:
-        cancel_files = os.listdir(CANCEL_PATH)
 
-        if len(cancel_files) > 0:
-            # if we're here, there are cancel tasks to process
-            task_id_dict = get_task_id_dict()
+async def check_if_other_repour_replicas_cancelled(task_id, authorization=None):
+    c = await config.get_configuration()
 
-            for filename in cancel_files:
-                # format is <task_id>.cancel
-                if filename.endswith(".cancel"):
-                    task_id_to_cancel = filename.replace(".cancel", "")
+    peer_urls = await get_peer_urls(c)
+    if peer_urls and await cancel_on_peers(task_id, peer_urls, authorization):
+        CANCEL_REQUESTS.labels("peer").inc()
+        return True
 
-                    if task_id_to_cancel in task_id_dict:
-                        logger.info(
-                            "From cancel loop: cancelling task: " + task_id_to_cancel
-                        )
+    if await get_cancel_indicators().request_cancel(task_id):
+        CANCEL_REQUESTS.labels("indicator").inc()
+        return True
 
-                        task_id_dict[task_id_to_cancel].cancel()
-                        os.remove(os.path.join(CANCEL_PATH, filename))
+    # if we're here, no other replicas cancelled the task_id, abandoning
+    logger.warn("No other repour replicas cancelled task: " + task_id + ". Giving up!")
+    CANCEL_REQUESTS.labels("not_found").inc()
+    return False
 
-        await remove_old_cancel_indicator_files()
-        await asyncio.sleep(PERIOD_CANCEL_LOOP_SLEEP)
 
+async def get_peer_urls(configuration):
+    """
+    Returns: sorted list of the base urls of the peers. The peers found through DNS
+             include this replica, which just answers it does not have the task
+    """
+    cancel_config = configuration.get("cancel", {})
+    urls = set(url.rstrip("/") for url in cancel_config.get("peers", []))
+
+    dns_name = cancel_config.get("peers_dns", None)
+    if dns_name:
+        port = cancel_config.get("peers_port", DEFAULT_PEERS_PORT)
+        try:
+            addresses = await asyncio.get_running_loop().getaddrinfo(
+                dns_name, port, type=socket.SOCK_STREAM
+            )
+        except OSError as e:
+            logger.warning("Could not resolve peers {}: {}".format(dns_name, e))
+            addresses = []
+
+        for family, _, _, _, sockaddr in addresses:
+            host = sockaddr[0]
+            if family == socket.AF_INET6:
+                host = "[" + host + "]"
+            urls.add("http://{}:{}".format(host, port))
+
+    return sorted(urls)
+
+
+async def cancel_on_peers(task_id, peer_urls, authorization=None):
+    """
+    Returns: True as soon as a peer cancelled the task
+    """
+    headers = get_authorization_headers(authorization)
+
+    async with aiohttp.ClientSession(timeout=PEER_TIMEOUT) as session:
+        requests = [
+            asyncio.ensure_future(cancel_on_peer(session, url, task_id, headers))
+            for url in peer_urls
+        ]
+        try:
+            for request in asyncio.as_completed(requests):
+                if await request:
+                    return True
+        finally:
+            for request in requests:
+                request.cancel()
+            await asyncio.gather(*requests, return_exceptions=True)
 
-async def check_if_other_repour_replicas_cancelled(task_id):
-    cancel_indicator_filename = os.path.join(CANCEL_PATH, task_id + ".cancel")
+    return False
 
-    if not os.path.exists(cancel_indicator_filename):
-        f = open(cancel_indicator_filename, "w")
-        f.close()
 
-    for _ in range(10):
-        # task id was cancelled in another repour replica
-        if not os.path.exists(cancel_indicator_filename):
-            return True
+async def cancel_on_peer(session, peer_url, task_id, headers):
+    url = "{}/cancel/{}/local".format(peer_url, task_id)
+    try:
+        async with session.post(url, headers=headers) as response:
+            return response.status == 200
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        logger.warning("Could not reach peer {}: {}".format(peer_url, e))
+        return False
 
-        await asyncio.sleep(PERIOD_CANCEL_LOOP_SLEEP)
 
-    # if we're here, no other replicas cancelled the task_id, abandoning
-    logger.warn("No other repour replicas cancelled task: " + task_id + ". Giving up!")
-    os.remove(cancel_indicator_filename)
-    return False
+async def cancel_on_siblings(task_id, authorization=None):
+    """
+    Returns: True if another worker of this replica cancelled the task
+    """
+    responses = await workers.request_siblings(
+        "POST",
+        "/cancel/{}/worker".format(task_id),
+        headers=get_authorization_headers(authorization),
+    )
+    return any(status == 200 for status, _ in responses)
+
+
+def get_authorization_headers(authorization):
+    headers = {}
+    if authorization:
+        headers["Authorization"] = authorization
+    return headers
+
+
+def cancel_local_task(task_id):
+    """
+    Returns: True if a task of this worker with this task id was cancelled
+    """
+    task_infos = task_registry.registry.get_by_task_id(task_id)
+
+    for task_info in task_infos:
+        task_info.task.cancel()
+
+    return len(task_infos) > 0
 
 
-async def remove_old_cancel_indicator_files():
+def get_cancel_indicators():
+    global cancel_indicators
+
+    if cancel_indicators is None:
+        watch = config.get_configuration_sync().get("cancel", {}).get("watch", "auto")
+        cancel_indicators = CancelIndicators(watch=watch)
+    return cancel_indicators
+
+
+class CancelIndicators(object):
+    """
+    Indicator files of the cancel requests, shared by the replicas
+    """
+
+    def __init__(
+        self,
+        directory=CANCEL_PATH,
+        min_interval=PERIOD_CANCEL_LOOP_SLEEP,
+        max_interval=MAX_PERIOD_CANCEL_LOOP_SLEEP,
+        watch="auto",
+    ):
+        """
+        watch: True to watch the directory with inotify instead of polling it, "auto"
+               to only watch it when it is on a filesystem known to be local, where
+               inotify also sees the indicators of the other replicas
+        """
+        self.directory = directory
+        self.use_watch = watch
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.watch = None
+        self.wakeup = asyncio.Event()
+        # task id -> futures of the cancel requests waiting for its indicator deletion
+        self.waiters = {}
+        self.last_cleanup = None
+
+    def get_path(self, task_id):
+        return os.path.join(self.directory, task_id + INDICATOR_SUFFIX)
+
+    def start_watch(self):
+        if self.use_watch == "auto" and not file_callback_log.is_local_filesystem(
+            self.directory
+        ):
+            logger.info("Polling cancel indicators, not on a known local filesystem")
+            return
+
+        watch = inotify.DirectoryWatch(
+            self.directory,
+            inotify.IN_CREATE
+            | inotify.IN_MOVED_TO
+            | inotify.IN_DELETE
+            | inotify.IN_MOVED_FROM,
+            self.on_event,
+        )
+        try:
+            watch.start(asyncio.get_running_loop())
+        except OSError as e:
+            logger.warning("Polling cancel indicators, cannot watch them: " + str(e))
+            return
+        self.watch = watch
+
+    def stop_watch(self):
+        if self.watch is not None:
+            self.watch.close()
+            self.watch = None
+
+    def on_event(self, mask, name):
+        if mask & inotify.IN_Q_OVERFLOW:
+            self.wakeup.set()
+            return
+
+        if not name.endswith(INDICATOR_SUFFIX):
+            return
+        task_id = name[: -len(INDICATOR_SUFFIX)]
+
+        if mask & (inotify.IN_CREATE | inotify.IN_MOVED_TO):
+            if cancel_local_task(task_id):
+                logger.info("From cancel loop: cancelling task: " + task_id)
+                asutil.safe_remove_file(self.get_path(task_id))
+        elif task_id in self.waiters:
+            self.resolve_waiters(task_id)
+
+    def resolve_waiters(self, task_id):
+        for future in self.waiters.pop(task_id, []):
+            if not future.done():
+                future.set_result(True)
+
+    async def run(self):
+        os.makedirs(self.directory, exist_ok=True)
+        if self.use_watch:
+            self.start_watch()
+
+        interval = self.min_interval
+        try:
+            while True:
+                self.wakeup.clear()
+                try:
+                    task_ids = await self.scan()
+                except Exception:
+                    logger.exception("Could not check the cancel indicators")
+                    task_ids = []
+
+                if self.watch is not None and not self.waiters:
+                    timeout = WATCH_RESCAN_SECONDS
+                elif task_ids or self.waiters:
+                    interval = self.min_interval
+                    timeout = interval
+                else:
+                    interval = min(interval * 2, self.max_interval)
+                    timeout = interval
+
+                # not wait_for, which can swallow a cancellation when the event is
+                # set at the same time
+                try:
+                    async with asyncio.timeout(timeout):
+                        await self.wakeup.wait()
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            self.stop_watch()
+
+    async def scan(self):
+        """
+        Cancel the tasks of this replica with an indicator, and complete the cancel
+        requests whose indicator was deleted
+
+        Returns: task ids with an indicator
+        """
+        loop = asyncio.get_running_loop()
+        # only the indicators created before listing the directory can be missing
+        waiting = list(self.waiters)
+        task_ids = await loop.run_in_executor(None, list_indicators, self.directory)
+
+        for task_id in task_ids:
+            if cancel_local_task(task_id):
+                logger.info("From cancel loop: cancelling task: " + task_id)
+                await loop.run_in_executor(
+                    None, asutil.safe_remove_file, self.get_path(task_id)
+                )
+
+        for task_id in waiting:
+            if task_id not in task_ids:
+                self.resolve_waiters(task_id)
+
+        now = python_time.monotonic()
+        if self.last_cleanup is None or now - self.last_cleanup > CLEANUP_INTERVAL:
+            self.last_cleanup = now
+            await loop.run_in_executor(
+                None, remove_old_cancel_indicator_files, self.directory
+            )
+
+        return task_ids
+
+    async def request_cancel(self, task_id, timeout=CANCEL_WAIT_SECONDS):
+        """
+        Returns: True if another replica cancelled the task, by deleting its indicator
+        """
+        loop = asyncio.get_running_loop()
+        path = self.get_path(task_id)
+
+        await loop.run_in_executor(None, create_indicator, path)
+
+        future = loop.create_future()
+        self.waiters.setdefault(task_id, []).append(future)
+        self.wakeup.set()
+
+        try:
+            return await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            futures = self.waiters.get(task_id, [])
+            if future in futures:
+                futures.remove(future)
+            if not futures:
+                self.waiters.pop(task_id, None)
+                await loop.run_in_executor(None, asutil.safe_remove_file, path)
+            return False
+
+
+def create_indicator(path):
+    with open(path, "w"):
+        pass
+
+
+def list_indicators(directory):
+    """
+    Returns: set of the task ids with an indicator in 'directory'
+    """
+    # format is <task_id>.cancel
+    return set(
+        filename[: -len(INDICATOR_SUFFIX)]
+        for filename in os.listdir(directory)
+        if filename.endswith(INDICATOR_SUFFIX)
+    )
+
+
+def remove_old_cancel_indicator_files(directory=CANCEL_PATH):
     """In case there are old cancel indicator files that are present and wasn't cleaned up properly, delete them
 
     Old files defined as having an age greater than 1 hour
     """
-    for filename in os.listdir(CANCEL_PATH):
-        path = os.path.join(CANCEL_PATH, filename)
+    for filename in os.listdir(directory):
+        path = os.path.join(directory, filename)
 
-        epoch_filename = int(os.stat(path).st_ctime)
+        try:
+            epoch_filename = int(os.stat(path).st_ctime)
+        except FileNotFoundError:
+            continue
         current_epoch = calendar.timegm(python_time.gmtime())
 
         if current_epoch - epoch_filename > 3600:
             logger.warn("Removing old cancel taskid file indicator: " + path)
             asutil.safe_remove_file(path)
-
-
-def get_task_id_dict():
-    all_tasks = asyncio.all_tasks(asyncio.get_running_loop())
-    task_id_dict = {}
-
-    for task in all_tasks:
-        task_id_of_task = getattr(task, "task_id", None)
-
-        if task_id_of_task is not None:
-            task_id_dict[task_id_of_task] = task
-
-    return task_id_dict
@@ -0,0 +1,52 @@
+# flake8: noqa
+import json
+import logging
+
+from aiohttp import web
+
+from repour.server import command_metrics, workers
+
+logger = logging.getLogger(__name__)
+
+
+async def handle_slow_commands(request):
+    """
+    List the slow commands kept in the ring buffer, the latest first. With several
+    workers, the slow commands of all the workers are listed
+    """
+    entries = get_worker_slow_commands()
+
+    headers = {}
+    if "Authorization" in request.headers:
+        headers["Authorization"] = request.headers["Authorization"]
+    for status, body in await workers.request_siblings(
+        "GET", "/debug/slow-commands/worker", headers=headers
+    ):
+        if status == 200 and isinstance(body, list):
+            entries.extend(body)
+
+    entries.sort(key=lambda entry: entry["finished"], reverse=True)
+    return slow_commands_response(entries)
+
+
+async def handle_slow_commands_worker(request):
+    """
+    List the slow commands of this worker, asked by another worker of the replica
+    """
+    return slow_commands_response(get_worker_slow_commands())
+
+
+def get_worker_slow_commands():
+    entries = [dict(entry) for entry in command_metrics.get_slow_commands()]
+    if workers.is_worker():
+        for entry in entries:
+            entry["worker"] = workers.worker_index
+    return entries
+
+
+def slow_commands_response(entries):
+    return web.Response(
+        status=200,
+        content_type="application/json",
+        text=json.dumps(obj=entries, ensure_ascii=False),
+    )
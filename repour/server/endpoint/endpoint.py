@@ -2,6 +2,7 @@
 import asyncio
 import base64
 import concurrent.futures as cfutures
+import functools
 import hashlib
 import json
 import logging
@@ -11,22 +12,17 @@ import traceback
 
 import aiohttp
 import asyncio
-import datetime
 import voluptuous
 from aiohttp import web
-from prometheus_async.aio import time
-from prometheus_client import Counter, Histogram, Summary
+from prometheus_client import Counter
 
 from repour import exception
-from repour.auth import auth_client
 from repour.config import config
-from repour.lib.io import file_utils
-from repour.lib.logs import file_callback_log
-from repour.lib.logs import log_util
-from repour.lib.bifrost import client
-from repour.server.endpoint import validation
-from opentelemetry import trace
-from opentelemetry.trace.propagation.tracecontext import TraceContextTextMapPropagator
+from repour.lib.io import fast_json, file_utils
+from repour.lib.bifrost import streamer
+from repour.lib.logs import file_callback_log, log_util
+from repour.lib.telemetry import tracing
+from repour.server import callback_outbox, job_queue, process_pool, task_registry
 
 logger = logging.getLogger(__name__)
 
@@ -41,12 +37,6 @@ ERROR_RESPONSE_400_COUNTER = Counter(
 ERROR_RESPONSE_500_COUNTER = Counter(
     "error_response_500_counter", "App returned 500 status"
 )
-ERROR_CALLBACK_COUNTER = Counter(
-    "error_callback_counter", "Errors calling callback url"
-)
-
-REQ_TIME = Summary("callback_time", "time spent with calling callback")
-REQ_HISTOGRAM_TIME = Histogram("callback_histogram", "Histogram for calling callback")
 
 
 def create_log_context_id():
@@ -96,354 +86,665 @@ def log_traceback_multi_line():
     logger.error(text)
 
 
-def validated_json_endpoint(
-    shutdown_callbacks, validator, coro, repour_url, send_logs_to_bifrost=True
-):
-    client_session = aiohttp.ClientSession()  # pylint: disable=no-member
-    shutdown_callbacks.append(client_session.close)
+def setup_request_log_context(request):
+    """
+    Set the log context and mdc of the current task from the headers of the request
 
-    async def handler(request):
-        c = await config.get_configuration()
-
-        log_context = request.headers.get("LOG-CONTEXT", "").strip()
-        if log_context == "":
-            log_context = create_log_context_id()
-
-        log_user_id = request.headers.get("log-user-id", "").strip()
-        log_request_context = request.headers.get("log-request-context", "").strip()
-        log_process_context = request.headers.get("log-process-context", "").strip()
-        log_expires = request.headers.get("log-expires", "").strip()
-        log_tmp = request.headers.get("log-tmp", "").strip()
-        log_process_context_variant = request.headers.get(
-            "process-context-variant", ""
-        ).strip()
-        trace_id = request.headers.get("trace-id", "").strip()
-        span_id = request.headers.get("span-id", "").strip()
-        traceparent = request.headers.get("traceparent", "").strip()
-        tracestate = request.headers.get("tracestate", "").strip()
-        logger.info(">> traceparent: " + traceparent)
-        logger.info(">> tracestate: " + tracestate)
-        # Some implementations use parent-id instead of span-id
-        if span_id == "":
-            span_id = request.headers.get("parent-id", "").strip()
+    Returns: the log context of the request
+    """
+    log_context = request.headers.get("LOG-CONTEXT", "").strip()
+    if log_context == "":
+        log_context = create_log_context_id()
+
+    log_user_id = request.headers.get("log-user-id", "").strip()
+    log_request_context = request.headers.get("log-request-context", "").strip()
+    log_process_context = request.headers.get("log-process-context", "").strip()
+    log_expires = request.headers.get("log-expires", "").strip()
+    log_tmp = request.headers.get("log-tmp", "").strip()
+    log_process_context_variant = request.headers.get(
+        "process-context-variant", ""
+    ).strip()
+    trace_id = request.headers.get("trace-id", "").strip()
+    span_id = request.headers.get("span-id", "").strip()
+    traceparent = request.headers.get("traceparent", "").strip()
+    tracestate = request.headers.get("tracestate", "").strip()
+    logger.info(">> traceparent: " + traceparent)
+    logger.info(">> tracestate: " + tracestate)
+    # Some implementations use parent-id instead of span-id
+    if span_id == "":
+        span_id = request.headers.get("parent-id", "").strip()
+
+    asyncio.current_task().log_context = log_context
+
+    # required for bifrost for streaming logs
+    asyncio.current_task().loggerName = "org.jboss.pnc._userlog_.alignment-log"
+
+    log_util.add_update_mdc_key_value_in_task("userId", log_user_id)
+    log_util.add_update_mdc_key_value_in_task("requestContext", log_request_context)
+    log_util.add_update_mdc_key_value_in_task("processContext", log_process_context)
+    log_util.add_update_mdc_key_value_in_task("expires", log_expires)
+    log_util.add_update_mdc_key_value_in_task("tmp", log_tmp)
+    log_util.add_update_mdc_key_value_in_task(
+        "processContextVariant", log_process_context_variant
+    )
+    log_util.add_update_mdc_key_value_in_task("trace_id", trace_id)
+    log_util.add_update_mdc_key_value_in_task("span_id", span_id)
+    # the requests are handled in a span continuing the trace of the caller
+    traceparent = tracing.get_traceparent(traceparent)
+    log_util.add_update_mdc_key_value_in_task("traceparent", traceparent)
+
+    return log_context
+
+
+async def read_json_body(request):
+    """
+    Returns: tuple (spec, None) if the body is valid json, or (None, error response) otherwise
+    """
+    try:
+        spec = fast_json.loads(await request.read())
+    except ValueError:
+        logger.error(
+            "Rejected {method} {path}: body is not parsable as json".format(
+                method=request.method, path=request.path
+            )
+        )
 
-        callback_id = create_callback_id()
+        rejected_data = await request.text()
+
+        ERROR_VALIDATION_JSON_COUNTER.inc()
+        logger.error("Request data: {data}".format(data=rejected_data))
+
+        return None, web.Response(
+            status=400,
+            content_type="application/json",
+            text=json.dumps(
+                obj=[
+                    {
+                        "error_message": "expected json",
+                        "error_type": "json parsability",
+                        "path": [],
+                    }
+                ],
+                ensure_ascii=False,
+            ),
+        )
+
+    return spec, None
+
+
+def validate_json_body(request, validator, spec):
+    """
+    Returns: None if the spec is valid, the error response otherwise
+    """
+    try:
+        validator(spec)
+    except voluptuous.MultipleInvalid as x:
+        logger.error(
+            "Rejected {method} {path}: body failed input validation".format(
+                method=request.method, path=request.path
+            )
+        )
 
-        asyncio.current_task().log_context = log_context
+        ERROR_VALIDATION_JSON_COUNTER.inc()
 
-        # required for bifrost for streaming logs
-        asyncio.current_task().loggerName = "org.jboss.pnc._userlog_.alignment-log"
+        logger.error("Request data: {data}".format(data=spec))
 
-        log_util.add_update_mdc_key_value_in_task("userId", log_user_id)
-        log_util.add_update_mdc_key_value_in_task("requestContext", log_request_context)
-        log_util.add_update_mdc_key_value_in_task("processContext", log_process_context)
-        log_util.add_update_mdc_key_value_in_task("expires", log_expires)
-        log_util.add_update_mdc_key_value_in_task("tmp", log_tmp)
-        log_util.add_update_mdc_key_value_in_task(
-            "processContextVariant", log_process_context_variant
+        return web.Response(
+            status=400,
+            content_type="application/json",
+            text=json.dumps(obj=[e.__dict__ for e in x.errors], ensure_ascii=False),
         )
-        log_util.add_update_mdc_key_value_in_task("trace_id", trace_id)
-        log_util.add_update_mdc_key_value_in_task("span_id", span_id)
-        log_util.add_update_mdc_key_value_in_task("traceparent", traceparent)
 
-        asyncio.current_task().callback_id = callback_id
+    return None
 
-        try:
-            spec = await request.json()
-        except ValueError:
-            logger.error(
-                "Rejected {method} {path}: body is not parsable as json".format(
-                    method=request.method, path=request.path
-                )
+
+def admit_jobs(jobs, count):
+    """
+    Admit 'count' jobs in the endpoint queue 'jobs', if any
+
+    Returns: list of the jobs, None for each job if there is no queue
+    Raises: job_queue.QueueFull if the queue is full
+    """
+    if jobs is None:
+        return [None] * count
+    return jobs.admit(count)
+
+
+async def run_job(job, coro_function):
+    if job is None:
+        return await coro_function()
+    return await job.run(coro_function)
+
+
+def get_task_repo(spec):
+    """
+    Returns: the repository the spec works on, shown in the task registry
+    """
+    internal_url = spec.get("internal_url", None)
+    if isinstance(internal_url, dict):
+        return internal_url.get("readwrite", None)
+
+    for key in ("targetRepoUrl", "originRepoUrl", "external_url", "project"):
+        if spec.get(key, None):
+            return spec[key]
+    return None
+
+
+def create_task_info(request, spec, callback_id):
+    return task_registry.TaskInfo(
+        callback_id,
+        request.path,
+        task_id=spec.get("taskId", None),
+        repo=get_task_repo(spec),
+    )
+
+
+async def call_registered(task_info, job, coro, spec, app, pool=None):
+    """
+    Run the job of the request registered as 'task_info', which is removed from the task registry when done. If 'pool'
+    is given, the job runs in one of its processes
+    """
+    token = task_registry.current_task_info.set(task_info)
+
+    async def run():
+        task_info.start()
+        with tracing.job_span(
+            "job " + task_info.endpoint,
+            attributes={
+                "repour.callback_id": task_info.callback_id,
+                "repour.task_id": task_info.task_id or "",
+            },
+        ) as span:
+            if pool is not None:
+                status, obj = await call_in_pool(pool, coro, spec)
+            else:
+                status, obj = await call_coro(coro, spec, app)
+            if status >= 400:
+                tracing.set_error(span, "Status {}".format(status))
+            return status, obj
+
+    try:
+        return await run_job(job, run)
+    finally:
+        task_registry.registry.remove(task_info)
+        task_registry.current_task_info.reset(token)
+
+
+def queue_full_response(request, e):
+    logger.warning(
+        "Rejected {method} {path}: {e}".format(
+            method=request.method, path=request.path, e=e
+        )
+    )
+    return web.Response(
+        status=429,
+        headers={"Retry-After": str(e.retry_after)},
+        content_type="application/json",
+        text=json.dumps(
+            obj=[
+                {
+                    "error_message": str(e),
+                    "error_type": "queue full",
+                    "path": [],
+                }
+            ],
+            ensure_ascii=False,
+        ),
+    )
+
+
+def is_callback_mode(spec):
+    """
+    The spec must have been validated by the schema of the endpoint, which validates the callbacks
+    """
+    return ("callback" in spec) or (
+        ("positiveCallback" in spec) and ("negativeCallback" in spec)
+    )
+
+
+async def call_coro(coro, spec, app):
+    """
+    Run the coroutine of the endpoint for the spec
+
+    Returns: tuple (status, response object)
+    """
+    try:
+        ret = await coro(spec, **app)
+    except cfutures.CancelledError as e:
+        # do nothing else
+        logger.info("Cancellation request received")
+        raise e
+
+    except exception.DescribedError as e:
+        status = 400
+        traceback_id, obj = described_error_to_obj(e)
+        ERROR_RESPONSE_400_COUNTER.inc()
+        logger.error(
+            "Failed ({e.__class__.__name__}), traceback hash: {traceback_id}".format(
+                **locals()
+            )
+        )
+        log_traceback_multi_line()
+    except Exception as e:
+        status = 500
+        traceback_id, obj = exception_to_obj(e)
+        ERROR_RESPONSE_500_COUNTER.inc()
+        logger.error(
+            "Internal failure ({e.__class__.__name__}), traceback hash: {traceback_id}".format(
+                **locals()
             )
+        )
+        log_traceback_multi_line()
+    else:
+        status = 200
+        obj = ret
+        logger.info("Completed ok")
 
-            rejected_data = await request.text()
+    return status, obj
 
-            ERROR_VALIDATION_JSON_COUNTER.inc()
-            logger.error("Request data: {data}".format(data=rejected_data))
 
-            return web.Response(
-                status=400,
-                content_type="application/json",
-                text=json.dumps(
-                    obj=[
-                        {
-                            "error_message": "expected json",
-                            "error_type": "json parsability",
-                            "path": [],
-                        }
-                    ],
-                    ensure_ascii=False,
-                ),
+async def call_in_pool(pool, coro, spec):
+    """
+    Run the coroutine of the endpoint for the spec in a process of the pool
+
+    Returns: tuple (status, response object)
+    """
+    try:
+        return await pool.call(coro, spec)
+    except process_pool.ProcessExited as e:
+        status = 500
+        traceback_id, obj = exception_to_obj(e)
+        ERROR_RESPONSE_500_COUNTER.inc()
+        logger.error(
+            "Internal failure ({e.__class__.__name__}), traceback hash: {traceback_id}".format(
+                **locals()
             )
+        )
+        log_traceback_multi_line()
+        return status, obj
+
+
+async def do_callback(
+    spec,
+    callback_id,
+    call,
+    client_session,
+    send_logs_to_bifrost,
+    forward_auth,
+    outbox=None,
+):
+    """
+    Run 'call' and send its result to the callback of the spec
+
+    If forward_auth is True, the callback request is authenticated with the service account of Repour. If outbox is
+    given, the result is handed to it for delivery, otherwise it is sent from this task
+    """
+    # Repour supports you either pass the positiveCallback and negativeCallback information, and if absent, will
+    # fallback to the 'callback' information.
+    # positiveCallback is used when the result is successful, and if not, negativeCallback is used.
+    #
+    # 'callback' will be used for both successful and unsuccessful results
+    if "callback" in spec:
+        callback_spec = spec["callback"]
+        positive_callback_spec = None
+        negative_callback_spec = None
+    else:
+        # When callback_mode is activated and "callback" not present,
+        # both "positiveCallback" and "negativeCallback" should be present
+        assert ("positiveCallback" in spec) and ("negativeCallback" in spec)
+
+    if ("positiveCallback" in spec) and ("negativeCallback" in spec):
+        positive_callback_spec = spec["positiveCallback"]
+        negative_callback_spec = spec["negativeCallback"]
+
+    c = await config.get_configuration()
+    current_task = asyncio.current_task()
+
+    log_streamer = None
+    if send_logs_to_bifrost and streamer.is_enabled(c):
+        log_streamer = streamer.LogStreamer.from_configuration(
+            c,
+            callback_id,
+            callback_outbox.create_log_metadata(
+                log_util.get_mdc(), current_task.loggerName
+            ),
+            client_session if outbox is None else outbox.session,
+        )
+        log_streamer.start()
+
+    try:
+        status, obj = await call()
+    finally:
+        if log_streamer is not None:
+            await log_streamer.stop()
+
+    obj["callback"] = {"status": status, "id": callback_id}
+
+    logger.info("Callback data: {}".format(obj))
+
+    # the logs are uploaded from the file
+    await file_callback_log.finalize_callback_log(callback_id)
+
+    # Choose which callback request to used based on the information provided by the request and the
+    # result of the work done
+    if status == 200 and positive_callback_spec:
+        callback_to_use = positive_callback_spec
+    elif negative_callback_spec:
+        callback_to_use = negative_callback_spec
+    else:
+        callback_to_use = callback_spec
+
+    entry = callback_outbox.create_entry(
+        callback_id,
+        callback_to_use,
+        obj,
+        dict(log_util.get_mdc()),
+        current_task.loggerName,
+        send_logs_to_bifrost,
+        forward_auth,
+    )
+    if log_streamer is not None:
+        entry["logsOffset"] = log_streamer.offset
+
+    if outbox is not None:
+        await outbox.put(entry)
+        return
+
+    if send_logs_to_bifrost:
+        try:
+            await callback_outbox.upload_logs(client_session, entry, c)
+        except Exception as e:
+            logger.error("Unable to send logs to Bifrost: " + str(e))
+
+    async def send_result():
         try:
-            validator(spec)
-        except voluptuous.MultipleInvalid as x:
+            status = await callback_outbox.send_result(client_session, entry, c)
+        except Exception as e:
+            callback_outbox.ERROR_CALLBACK_COUNTER.inc()
             logger.error(
-                "Rejected {method} {path}: body failed input validation".format(
-                    method=request.method, path=request.path
+                "Unable to send result of callback, exception {ename}, attempt {backoff}/{max_attempts}".format(
+                    ename=e.__class__.__name__,
+                    backoff=backoff,
+                    max_attempts=max_attempts,
                 )
             )
+            logger.error(e, exc_info=True)
+            status = None
+        return status
 
-            ERROR_VALIDATION_JSON_COUNTER.inc()
+    backoff = 1
+    max_attempts = 9
+    status = await send_result()
 
-            logger.error("Request data: {data}".format(data=spec))
+    while status is None or status // 100 != 2:
+        if status is not None:
+            logger.info(
+                "Unable to send result of callback, status {status}, attempt {backoff}/{max_attempts}".format(
+                    **locals()
+                )
+            )
 
-            return web.Response(
-                status=400,
-                content_type="application/json",
-                text=json.dumps(obj=[e.__dict__ for e in x.errors], ensure_ascii=False),
+        sleep_period = 2**backoff
+        logger.debug("Sleeping for {sleep_period}".format(**locals()))
+        await asyncio.sleep(sleep_period)
+
+        backoff += 1
+
+        if backoff > max_attempts:
+            logger.error(
+                "Giving up on callback after {max_attempts} attempts".format(**locals())
             )
+            break
+
+        status = await send_result()
+
+    if backoff <= max_attempts:
+        logger.info("Callback result sent successfully")
+
+
+def start_callback_task(
+    request,
+    spec,
+    callback_id,
+    call,
+    client_session,
+    send_logs_to_bifrost,
+    log_context,
+    outbox=None,
+    task_info=None,
+    job=None,
+):
+    """
+    Create the task running 'call' for the spec and sending its result to the callback. The task gets a copy of the
+    log context of the current task. If 'task_info' is given, the task is registered with it in the task registry. If
+    'job' is given, it is released when the task is done
+    """
+    logger.info(
+        "Creating callback task {callback_id}, returning ID now".format(**locals())
+    )
+
+    # the task continues the trace of the request in its copy of the context
+    callback_task = request.app.loop.create_task(
+        do_callback(
+            spec,
+            callback_id,
+            call,
+            client_session,
+            send_logs_to_bifrost,
+            forward_auth=bool(request.headers.get("Authorization", None)),
+            outbox=outbox,
+        )
+    )
+    callback_task.log_context = log_context
+    callback_task.loggerName = asyncio.current_task().loggerName
+    callback_task.callback_id = callback_id
+
+    if task_info is not None:
+        task_info.task = callback_task
+        task_registry.registry.add(task_info)
+        # also removed if cancelled before running 'call'
+        callback_task.add_done_callback(
+            lambda task: task_registry.registry.remove(task_info)
+        )
+
+    if job is not None:
+        # also released if cancelled before running 'call'
+        callback_task.add_done_callback(lambda task: job.release())
+
+    return callback_task
+
+
+def validated_json_endpoint(
+    shutdown_callbacks,
+    validator,
+    coro,
+    repour_url,
+    send_logs_to_bifrost=True,
+    jobs=None,
+    outbox=None,
+    pool=None,
+):
+    """
+    If 'jobs' is given, each accepted request is a job of that endpoint queue, and the request is rejected with a 429
+    status if the queue is full. If 'outbox' is given, the results in callback mode are delivered through it. If 'pool'
+    is given, the jobs run in its processes instead of on the event loop
+    """
+    if pool is not None:
+        # fail at startup if the processes cannot import the coroutine
+        process_pool.get_function_path(coro)
+
+    client_session = aiohttp.ClientSession()  # pylint: disable=no-member
+    shutdown_callbacks.append(client_session.close)
+
+    async def handler(request):
+        log_context = setup_request_log_context(request)
+
+        callback_id = create_callback_id()
+        asyncio.current_task().callback_id = callback_id
+
+        spec, error_response = await read_json_body(request)
+        if error_response is not None:
+            return error_response
+
+        error_response = validate_json_body(request, validator, spec)
+        if error_response is not None:
+            return error_response
+
         logger.info(
             "Accepted {method} {path}: {params}".format(
                 method=request.method, path=request.path, params=spec
             )
         )
 
+        callback_mode = is_callback_mode(spec)
+
         try:
-            callback_mode = False
-
-            if ("positiveCallback" in spec) and ("negativeCallback" in spec):
-                validation.positive_callback(spec)
-                validation.negative_callback(spec)
-                callback_mode = True
-
-            if "callback" in spec:
-                validation.callback(spec)
-                callback_mode = True
-
-        except voluptuous.MultipleInvalid as x:
-            callback_mode = False
-
-        # Set the task_id if provided in the request
-        task_id = spec.get("taskId", None)
-        if task_id:
-            asyncio.current_task().task_id = task_id
-
-        async def do_call():
-            try:
-                ret = await coro(spec, **request.app)
-            except cfutures.CancelledError as e:
-                # do nothing else
-                logger.info("Cancellation request received")
-                raise e
-
-            except exception.DescribedError as e:
-                status = 400
-                traceback_id, obj = described_error_to_obj(e)
-                ERROR_RESPONSE_400_COUNTER.inc()
-                logger.error(
-                    "Failed ({e.__class__.__name__}), traceback hash: {traceback_id}".format(
-                        **locals()
-                    )
-                )
-                log_traceback_multi_line()
-            except Exception as e:
-                status = 500
-                traceback_id, obj = exception_to_obj(e)
-                ERROR_RESPONSE_500_COUNTER.inc()
-                logger.error(
-                    "Internal failure ({e.__class__.__name__}), traceback hash: {traceback_id}".format(
-                        **locals()
-                    )
-                )
-                log_traceback_multi_line()
-            else:
-                status = 200
-                obj = ret
-                logger.info("Completed ok")
+            (job,) = admit_jobs(jobs, 1)
+        except job_queue.QueueFull as e:
+            return queue_full_response(request, e)
 
-            return status, obj
+        task_info = create_task_info(request, spec, callback_id)
+        call = functools.partial(
+            call_registered, task_info, job, coro, spec, request.app, pool=pool
+        )
 
         if callback_mode:
-
-            async def do_callback(spec):
-                # Repour supports you either pass the positiveCallback and negativeCallback information, and if absent, will
-                # fallback to the 'callback' information.
-                # positiveCallback is used when the result is successful, and if not, negativeCallback is used.
-                #
-                # 'callback' will be used for both successful and unsuccessful results
-                if "callback" in spec:
-                    callback_spec = spec["callback"]
-                    positive_callback_spec = None
-                    negative_callback_spec = None
-                else:
-                    # When callback_mode is activated and "callback" not present,
-                    # both "positiveCallback" and "negativeCallback" should be present
-                    assert ("positiveCallback" in spec) and ("negativeCallback" in spec)
-
-                if ("positiveCallback" in spec) and ("negativeCallback" in spec):
-                    positive_callback_spec = spec["positiveCallback"]
-                    negative_callback_spec = spec["negativeCallback"]
-
-                status, obj = await do_call()
-
-                obj["callback"] = {"status": status, "id": callback_id}
-
-                logger.info("Callback data: {}".format(obj))
-
-                @time(REQ_TIME)
-                @time(REQ_HISTOGRAM_TIME)
-                async def send_result():
-                    try:
-                        # TODO refactor this into auth.py, we cannot use middleware for callbacks
-                        headers = {}
-
-                        current_task = asyncio.current_task()
-                        log_file = file_callback_log.get_callback_log_path(callback_id)
-
-                        if not os.path.isfile(log_file):
-                            logger.error("Logs for callback_id: {} missing!")
-                        elif send_logs_to_bifrost:
-                            log_metadata = client.LogMetadata(
-                                end_time=datetime.datetime.now()
-                                .astimezone()
-                                .isoformat(),
-                                logger_name=asyncio.current_task().loggerName,
-                                user_id=current_task.mdc["userId"],
-                                expires=current_task.mdc["expires"],
-                                process_context=current_task.mdc["processContext"],
-                                process_context_variant=current_task.mdc[
-                                    "processContextVariant"
-                                ],
-                                tmp=current_task.mdc["tmp"],
-                                request_context=current_task.mdc["requestContext"],
-                                trace_id=current_task.mdc["trace_id"],
-                                span_id=current_task.mdc["span_id"],
-                                traceparent=current_task.mdc["traceparent"],
-                                tag="alignment-log",
-                            )
-
-                            resp = await client.send(
-                                c.get("bifrost_url"),
-                                log_file,
-                                log_metadata,
-                                await auth_client.access_token(),
-                            )
-                            logger.info("Sending logs to Bifrost successful")
-
-                        auth_provider = c.get("auth", {}).get("provider", None)
-                        if auth_provider == "oauth2_jwt" and request.headers.get(
-                            "Authorization", None
-                        ):
-                            auth_header = {
-                                "Authorization": "Bearer "
-                                + await auth_client.access_token()
-                            }
-                            headers.update(auth_header)
-
-                        context_headers = {
-                            "log-user-id": current_task.mdc["userId"],
-                            "log-request-context": current_task.mdc["requestContext"],
-                            "log-process-context": current_task.mdc["processContext"],
-                            "log-expires": current_task.mdc["expires"],
-                            "log-tmp": current_task.mdc["tmp"],
-                            "process-context-variant": current_task.mdc[
-                                "processContextVariant"
-                            ],
-                            "trace-id": current_task.mdc["trace_id"],
-                            "span-id": current_task.mdc["span_id"],
-                            "traceparent": current_task.mdc["traceparent"],
-                        }
-
-                        headers.update(context_headers)
-                        headers.update({"Content-Type": "application/json"})
-
-                        # Choose which callback request to used based on the information provided by the request and the
-                        # result of the work done
-                        if status == 200 and positive_callback_spec:
-                            callback_to_use = positive_callback_spec
-                        elif negative_callback_spec:
-                            callback_to_use = negative_callback_spec
-                        else:
-                            callback_to_use = callback_spec
-
-                        # callback url is either from key 'url' or 'uri'. The latter is used in the pnc-api Request object
-                        resp = await client_session.request(
-                            callback_to_use.get("method", "POST"),
-                            callback_to_use.get("url", callback_spec.get("uri")),
-                            headers=headers,
-                            data=json.dumps(obj=obj, ensure_ascii=False).encode(
-                                "utf-8"
-                            ),
-                        )
-                    except Exception as e:
-                        ERROR_CALLBACK_COUNTER.inc()
-                        logger.error(
-                            "Unable to send result of callback, exception {ename}, attempt {backoff}/{max_attempts}".format(
-                                ename=e.__class__.__name__,
-                                backoff=backoff,
-                                max_attempts=max_attempts,
-                            )
-                        )
-                        logger.error(e, exc_info=True)
-                        resp = None
-                    return resp
-
-                backoff = 1
-                max_attempts = 9
-                resp = await send_result()
-
-                while resp is None or resp.status // 100 != 2:
-                    if resp is not None:
-                        logger.info(
-                            "Unable to send result of callback, status {resp.status}, attempt {backoff}/{max_attempts}".format(
-                                **locals()
-                            )
-                        )
-
-                    sleep_period = 2**backoff
-                    logger.debug("Sleeping for {sleep_period}".format(**locals()))
-                    await asyncio.sleep(sleep_period)
-
-                    backoff += 1
-
-                    if backoff > max_attempts:
-                        logger.error(
-                            "Giving up on callback after {max_attempts} attempts".format(
-                                **locals()
-                            )
-                        )
-                        break
-
-                    resp = await send_result()
-
-                if backoff <= max_attempts:
-                    logger.info("Callback result sent successfully")
-
-            logger.info(
-                "Creating callback task {callback_id}, returning ID now".format(
-                    **locals()
-                )
+            start_callback_task(
+                request,
+                spec,
+                callback_id,
+                call,
+                client_session,
+                send_logs_to_bifrost,
+                log_context,
+                outbox=outbox,
+                task_info=task_info,
+                job=job,
             )
 
-            # trying
-            ctx = TraceContextTextMapPropagator().extract(
-                carrier={"traceparent": traceparent}
-            )
-            tracer = trace.get_tracer(__name__)
-            with tracer.start_as_current_span(request.path, ctx) as span:
-                callback_task = request.app.loop.create_task(do_callback(spec))
-                callback_task.log_context = log_context
-                callback_task.loggerName = asyncio.current_task().loggerName
-                callback_task.mdc = asyncio.current_task().mdc
-                callback_task.callback_id = callback_id
-                # Set the task_id if provided in the request
-                task_id = spec.get("taskId", None)
-                if task_id:
-                    callback_task.task_id = task_id
-
-                status = 202
-                obj = {"callback": {"id": callback_id}}
+            status = 202
+            obj = {"callback": {"id": callback_id}}
 
         else:
-            status, obj = await do_call()
+            task_info.task = asyncio.current_task()
+            task_registry.registry.add(task_info)
+            status, obj = await call()
+            await file_callback_log.finalize_callback_log(callback_id)
 
         response = web.Response(
             status=status,
             content_type="application/json",
-            text=json.dumps(obj=obj, ensure_ascii=False),
+            charset="utf-8",
+            body=fast_json.dumps(obj),
         )
         return response
 
     return handler
+
+
+def validated_json_batch_endpoint(
+    shutdown_callbacks,
+    validator,
+    key,
+    prepare,
+    repour_url,
+    send_logs_to_bifrost=True,
+    jobs=None,
+    outbox=None,
+):
+    """
+    Endpoint accepting a list of specs under 'key' of the body, each processed as if sent to its own callback-mode
+    endpoint.
+
+    'prepare(specs, **app)' is called once for the whole batch and returns one coroutine function per spec, used like
+    the 'coro' of 'validated_json_endpoint'. Every spec must define its callback. If 'jobs' is given, the batch is
+    admitted in that endpoint queue as one job per spec, or rejected as a whole
+    """
+    client_session = aiohttp.ClientSession()  # pylint: disable=no-member
+    shutdown_callbacks.append(client_session.close)
+
+    async def handler(request):
+        log_context = setup_request_log_context(request)
+
+        body, error_response = await read_json_body(request)
+        if error_response is not None:
+            return error_response
+
+        error_response = validate_json_body(request, validator, body)
+        if error_response is not None:
+            return error_response
+
+        specs = body[key]
+
+        errors = [
+            {
+                "error_message": "callback information is required in a batch",
+                "error_type": "callback",
+                "path": [key, str(index)],
+            }
+            for index, spec in enumerate(specs)
+            if not is_callback_mode(spec)
+        ]
+        if errors:
+            ERROR_VALIDATION_JSON_COUNTER.inc()
+            logger.error(
+                "Rejected {method} {path}: batch contains specs without callback".format(
+                    method=request.method, path=request.path
+                )
+            )
+            return web.Response(
+                status=400,
+                content_type="application/json",
+                text=json.dumps(obj=errors, ensure_ascii=False),
+            )
+
+        logger.info(
+            "Accepted {method} {path}: {params}".format(
+                method=request.method, path=request.path, params=body
+            )
+        )
+
+        try:
+            batch_jobs = admit_jobs(jobs, len(specs))
+        except job_queue.QueueFull as e:
+            return queue_full_response(request, e)
+
+        try:
+            coros = prepare(specs, **request.app)
+        except Exception:
+            for job in batch_jobs:
+                if job is not None:
+                    job.release()
+            raise
+
+        callbacks = []
+        for spec, coro, job in zip(specs, coros, batch_jobs):
+            callback_id = create_callback_id()
+
+            task_info = create_task_info(request, spec, callback_id)
+            call = functools.partial(
+                call_registered, task_info, job, coro, spec, request.app
+            )
+
+            start_callback_task(
+                request,
+                spec,
+                callback_id,
+                call,
+                client_session,
+                send_logs_to_bifrost,
+                log_context,
+                outbox=outbox,
+                task_info=task_info,
+                job=job,
+            )
+            callbacks.append({"callback": {"id": callback_id}})
+
+        return web.Response(
+            status=202,
+            content_type="application/json",
+            charset="utf-8",
+            body=fast_json.dumps({key: callbacks}),
+        )
+
+    return handler
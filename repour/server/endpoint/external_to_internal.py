@@ -1,4 +1,5 @@
 # flake8: noqa
+import functools
 import re
 from urllib.parse import urlparse
 
@@ -13,10 +14,20 @@ REQ_TIME = Summary(
 REQ_HISTOGRAM_TIME = Histogram(
     "external_to_internal_req_histogram", "Histogram for external_to_internal endpoint"
 )
+BATCH_REQ_TIME = Summary(
+    "external_to_internal_batch_req_time",
+    "time spent with external_to_internal batch endpoint",
+)
 
 SCP_LIKE_URL_REGEX = (
     r"^(\w+://)?(.+):[A-Za-z_](.*)\.git$"  # There is ":" in the middle of url
 )
+SCP_LIKE_URL_PATTERN = re.compile(SCP_LIKE_URL_REGEX)
+GIT_SUFFIX_PATTERN = re.compile(r"\.git$")
+
+ACCEPTABLE_SCHEMES = ("https", "http", "git", "git+ssh", "ssh")
+
+TRANSLATION_CACHE_SIZE = 4096
 
 
 @time(REQ_TIME)
@@ -31,9 +42,35 @@ async def translate(external_to_internal_spec, repo_provider):
     return result
 
 
+@time(BATCH_REQ_TIME)
+async def translate_batch(external_to_internal_batch_spec, repo_provider):
+    """
+    Output is {"internal_urls": {<external url>: <internal url>}, "errors": {<external url>: <error message>}}
+    """
+    git_backend, git_server = await get_internal_git_server()
+
+    internal_urls = {}
+    errors = {}
+    for external_url in external_to_internal_batch_spec["external_urls"]:
+        try:
+            internal_urls[external_url] = translate_url(
+                external_url, git_backend, git_server
+            )
+        except Exception as e:
+            errors[external_url] = str(e)
+
+    return {"internal_urls": internal_urls, "errors": errors}
+
+
 async def translate_external_to_internal(external_git_url):
-    """Logic from original maitai code to do this: found in GitUrlParser.java#generateInternalGitRepoName"""
+    git_backend, git_server = await get_internal_git_server()
+    return translate_url(external_git_url, git_backend, git_server)
+
 
+async def get_internal_git_server():
+    """
+    Returns: tuple (git backend, url of the internal git server ending with '/')
+    """
     c = await config.get_configuration()
     git_backend = c.get("git_backend")
     if git_backend in c:
@@ -48,18 +85,25 @@ async def translate_external_to_internal(external_git_url):
     elif not git_server.endswith("/"):
         git_server = git_server + "/"
 
-    is_scp_like = re.match(SCP_LIKE_URL_REGEX, external_git_url)
+    return git_backend, git_server
+
+
+@functools.lru_cache(maxsize=TRANSLATION_CACHE_SIZE)
+def translate_url(external_git_url, git_backend, git_server):
+    """Logic from original maitai code to do this: found in GitUrlParser.java#generateInternalGitRepoName
+
+    The translations are cached, keyed on the url and the configuration they depend on
+    """
+    is_scp_like = SCP_LIKE_URL_PATTERN.match(external_git_url)
 
     result = urlparse(external_git_url)
     scheme = result.scheme if not external_git_url.startswith("git@") else "git"
     path = result.path
 
-    acceptable_schemes = ["https", "http", "git", "git+ssh", "ssh"]
-
     if scheme == "":
         raise Exception("Scheme in url is empty! Error!")
 
-    if scheme not in acceptable_schemes:
+    if scheme not in ACCEPTABLE_SCHEMES:
         raise Exception("Scheme '{0}' not accepted!'".format(scheme))
 
     # list comprehension is to remove empty strings
@@ -69,7 +113,7 @@ async def translate_external_to_internal(external_git_url):
 
     # extract repository part
     if path_parts[-1]:
-        repository = re.sub(r"\.git$", "", path_parts[-1])
+        repository = GIT_SUFFIX_PATTERN.sub("", path_parts[-1])
 
     organization = None
 
@@ -1,8 +1,7 @@
 import logging
 
-import asyncssh
-
 from repour.config import config
+from repour.lib.scm import gerrit
 
 logger = logging.getLogger(__name__)
 
@@ -32,28 +31,23 @@ async def internal_scm_gerrit(spec, repo_provider):
 
     logger.info("Command to run: " + command)
 
-    async with asyncssh.connect(
-        configuration.get("hostname"),
-        username=configuration.get("username"),
-        known_hosts=None,
-    ) as conn:
-        result = await conn.run(command, check=False)
-        exit_status = result.exit_status
-
-        if exit_status == 0:
-            return {
-                "status": "SUCCESS_CREATED",
-                "readonly_url": readonly_url.format(REPO_NAME=spec.get("project")),
-                "readwrite_url": readwrite_url.format(REPO_NAME=spec.get("project")),
-            }
-        elif exit_status == 1 and "Project already exists" in result.stderr:
-            return {
-                "status": "SUCCESS_ALREADY_EXISTS",
-                "readonly_url": readonly_url.format(REPO_NAME=spec.get("project")),
-                "readwrite_url": readwrite_url.format(REPO_NAME=spec.get("project")),
-            }
-        else:
-            raise Exception("Creation failed! Command log: " + result.stderr)
+    result = await gerrit.pool(configuration).run(command)
+    exit_status = result.exit_status
+
+    if exit_status == 0:
+        return {
+            "status": "SUCCESS_CREATED",
+            "readonly_url": readonly_url.format(REPO_NAME=spec.get("project")),
+            "readwrite_url": readwrite_url.format(REPO_NAME=spec.get("project")),
+        }
+    elif exit_status == 1 and "Project already exists" in result.stderr:
+        return {
+            "status": "SUCCESS_ALREADY_EXISTS",
+            "readonly_url": readonly_url.format(REPO_NAME=spec.get("project")),
+            "readwrite_url": readwrite_url.format(REPO_NAME=spec.get("project")),
+        }
+    else:
+        raise Exception("Creation failed! Command log: " + result.stderr)
 
 
 def build_gerrit_command(project, parent_project, owner_groups, description):
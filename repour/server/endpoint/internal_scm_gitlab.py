@@ -1,7 +1,5 @@
 import logging
 
-import gitlab
-
 from repour.config import config
 from repour.lib.scm import gitlab as scm_gitlab
 
@@ -64,21 +62,23 @@ async def internal_scm_gitlab(spec, repo_provider):
     gl = scm_gitlab.client(gitlab_config)
 
     # get the workspace group
-    workspace_group = scm_gitlab.get_group(gl, namespace_id)
+    workspace_group = await scm_gitlab.get_group(gl, namespace_id)
     if workspace_group is None:
         raise Exception(f"Missing PNC Workspace group with id {namespace_id}.")
 
     # create subgroup
-    if (subgroup_name is None) or (subgroup_name == workspace_group.path):
+    if (subgroup_name is None) or (subgroup_name == workspace_group["path"]):
         parent_id = namespace_id
-        complete_path = workspace_group.path + "/" + project_name
+        complete_path = workspace_group["path"] + "/" + project_name
     else:
-        subgroup = scm_gitlab.get_or_create_subgroup(gl, workspace_group, subgroup_name)
-        parent_id = subgroup.id
-        complete_path = workspace_group.path + "/" + project_path
+        subgroup = await scm_gitlab.get_or_create_subgroup(
+            gl, workspace_group, subgroup_name
+        )
+        parent_id = subgroup["id"]
+        complete_path = workspace_group["path"] + "/" + project_path
 
     # get or create project repository
-    (result, project) = get_or_create_project(
+    (result, project) = await get_or_create_project(
         gl, parent_id, complete_path, project_path, readonly_url, readwrite_url
     )
 
@@ -89,22 +89,19 @@ async def internal_scm_gitlab(spec, repo_provider):
         found = False
         if result.get("status") == "SUCCESS_ALREADY_EXISTS":
             # check if the protected tags are configured already (only if the repo already existed)
-            found = scm_gitlab.check_protected_tags(gitlab_config, project=project)
-        if not found:
-            project.protectedtags.create(
-                {
-                    "name": prot_tags_pattern,
-                    "create_access_level": gitlab.const.AccessLevel.DEVELOPER,
-                }
+            found = await scm_gitlab.check_protected_tags(
+                gitlab_config, project=project, gl=gl
             )
+        if not found:
+            await scm_gitlab.create_protected_tag(gl, project, prot_tags_pattern)
 
     return result
 
 
-def get_or_create_project(
+async def get_or_create_project(
     gl, parent_id, complete_path, project_path, readonly_url, readwrite_url
 ):
-    project = scm_gitlab.get_project(gl, complete_path)
+    project = await scm_gitlab.get_project(gl, complete_path)
     if project:
         result = {
             "status": "SUCCESS_ALREADY_EXISTS",
@@ -113,7 +110,7 @@ def get_or_create_project(
         }
     else:
         project_name = complete_path.split("/")[complete_path.count("/")]
-        project = scm_gitlab.create_project(gl, parent_id, project_name)
+        project = await scm_gitlab.create_project(gl, parent_id, project_name)
         result = {
             "status": "SUCCESS_CREATED",
             "readonly_url": readonly_url.format(REPO_NAME=project_path),
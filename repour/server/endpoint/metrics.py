@@ -0,0 +1,40 @@
+# flake8: noqa
+import logging
+import os
+
+from aiohttp import web
+from prometheus_client import REGISTRY, CollectorRegistry, multiprocess
+from prometheus_client.exposition import choose_encoder
+
+from repour.server import workers
+
+logger = logging.getLogger(__name__)
+
+registry = None
+
+
+def get_registry():
+    """
+    Returns: the registry of the metrics of this pod. With several workers or job
+             processes, it collects the metrics of all of them from
+             PROMETHEUS_MULTIPROC_DIR
+    """
+    global registry
+
+    if registry is None:
+        if os.environ.get(workers.PROMETHEUS_MULTIPROC_DIR_ENV, None):
+            registry = CollectorRegistry()
+            multiprocess.MultiProcessCollector(registry)
+        else:
+            registry = REGISTRY
+    return registry
+
+
+async def handle_metrics(request):
+    encoder, content_type = choose_encoder(request.headers.get("Accept"))
+
+    response = web.Response(body=encoder(get_registry()))
+    # set separately, aiohttp does not accept the ';' of the content type in the
+    # constructor
+    response.content_type = content_type
+    return response
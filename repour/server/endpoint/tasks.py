@@ -0,0 +1,63 @@
+# flake8: noqa
+import json
+import logging
+
+from aiohttp import web
+from prometheus_async.aio import time
+from prometheus_client import Histogram, Summary
+
+from repour.server import task_registry, workers
+
+REQ_TIME = Summary("tasks_req_time", "time spent with tasks endpoint")
+REQ_HISTOGRAM_TIME = Histogram("tasks_req_histogram", "Histogram for tasks endpoint")
+
+logger = logging.getLogger(__name__)
+
+
+@time(REQ_TIME)
+@time(REQ_HISTOGRAM_TIME)
+async def handle_tasks(request):
+    """
+    List the requests the server is working on, the longest running first. With several
+    workers, the tasks of all the workers are listed
+    """
+    task_jsons = get_worker_tasks()
+
+    headers = {}
+    if "Authorization" in request.headers:
+        headers["Authorization"] = request.headers["Authorization"]
+    for status, body in await workers.request_siblings(
+        "GET", "/tasks/worker", headers=headers
+    ):
+        if status == 200 and isinstance(body, list):
+            task_jsons.extend(body)
+
+    task_jsons.sort(key=lambda task_json: task_json["elapsedSeconds"], reverse=True)
+    return tasks_response(task_jsons)
+
+
+async def handle_tasks_worker(request):
+    """
+    List the requests of this worker, asked by another worker of the replica
+    """
+    return tasks_response(get_worker_tasks())
+
+
+def get_worker_tasks():
+    task_infos = sorted(
+        task_registry.registry.list(), key=lambda task_info: task_info.admitted_time
+    )
+
+    task_jsons = [task_info.to_json() for task_info in task_infos]
+    if workers.is_worker():
+        for task_json in task_jsons:
+            task_json["worker"] = workers.worker_index
+    return task_jsons
+
+
+def tasks_response(task_jsons):
+    return web.Response(
+        status=200,
+        content_type="application/json",
+        text=json.dumps(obj=task_jsons, ensure_ascii=False),
+    )
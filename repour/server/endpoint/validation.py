@@ -1,5 +1,7 @@
 # flake8: noqa
+import functools
 import logging
+import urllib.parse
 
 from voluptuous import *
 
@@ -8,13 +10,33 @@ from repour import repo
 from giturlparse import validate as validate_git_url
 
 
+# The same repository and callback urls come again and again, with the retries of PNC.
+# The result of the parsing is cached per url
+@functools.lru_cache(maxsize=4096)
+def is_url(value):
+    parsed = urllib.parse.urlparse(value)
+    return bool(parsed.scheme and parsed.netloc)
+
+
+@functools.lru_cache(maxsize=4096)
+def is_git_url(value):
+    return bool(validate_git_url(value))
+
+
+# replaces the Url validator of voluptuous, same checks
+@message("expected a URL", cls=UrlInvalid)
+def Url(value):
+    if not isinstance(value, str) or not is_url(value):
+        raise ValueError
+    return value
+
+
 @message("expected a GitUrl", cls=UrlInvalid)
 def GitUrl(value):
     """Validates whether passed value is valid url for git
     If the value is invalid, the method raises an Exception
     """
-    t = validate_git_url(value)
-    if not t:
+    if not isinstance(value, str) or not is_git_url(value):
         raise ValueError
     return value
 
@@ -86,10 +108,29 @@ adjust = Schema(adjust_raw, required=True, extra=False)
 
 adjust_modeb = Schema(mode_b_ify(adjust_raw), required=True, extra=False)
 
+adjust_modeb_batch = Schema(
+    {"adjusts": All([mode_b_ify(adjust_raw)], Length(min=1))},
+    required=True,
+    extra=False,
+)
+
 external_to_internal = Schema(
     {"external_url": nonempty_str}, required=True, extra=False
 )
 
+# the batch endpoint is not authenticated and translates the urls on the event loop
+MAX_EXTERNAL_URLS_PER_BATCH = 1000
+
+external_to_internal_batch = Schema(
+    {
+        "external_urls": All(
+            [nonempty_str], Length(min=1, max=MAX_EXTERNAL_URLS_PER_BATCH)
+        )
+    },
+    required=True,
+    extra=False,
+)
+
 internal_scm = Schema(
     {
         "project": nonempty_noblank_str,
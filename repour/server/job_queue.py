@@ -0,0 +1,161 @@
+# Job queue
+#
+# Every clone, alignment or repository creation accepted by the endpoints becomes a
+# job. The queue bounds the number of jobs a pod holds at once (waiting or running)
+# and the number of jobs of each endpoint running at the same time. A request that
+# would exceed the capacity is rejected, so that the load balancer can send it to
+# another pod instead of this one running out of memory.
+
+import asyncio
+import logging
+import time
+
+from prometheus_client import Counter, Gauge, Histogram
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_RETRY_AFTER_SECONDS = 30
+
+# summed over the workers of the pod
+JOB_QUEUE_DEPTH = Gauge(
+    "job_queue_depth",
+    "Jobs waiting for a free slot of their endpoint",
+    ["endpoint"],
+    multiprocess_mode="livesum",
+)
+JOB_QUEUE_RUNNING = Gauge(
+    "job_queue_running", "Jobs running", ["endpoint"], multiprocess_mode="livesum"
+)
+JOB_QUEUE_WAIT_TIME = Histogram(
+    "job_queue_wait_time",
+    "Time spent by jobs waiting for a free slot of their endpoint",
+    ["endpoint"],
+)
+JOB_QUEUE_REJECTED = Counter(
+    "job_queue_rejected",
+    "Requests rejected because the job queue is full",
+    ["endpoint"],
+)
+
+
+class QueueFull(Exception):
+    def __init__(self, endpoint, retry_after):
+        super().__init__("Job queue is full, cannot accept {} job".format(endpoint))
+        self.endpoint = endpoint
+        self.retry_after = retry_after
+
+
+class JobQueue(object):
+    """
+    capacity: maximum number of jobs admitted at once, or None for no limit
+    concurrency: dict of the maximum number of running jobs per endpoint name. Endpoints
+                 not in the dict have no limit
+    """
+
+    def __init__(
+        self, capacity=None, concurrency=None, retry_after=DEFAULT_RETRY_AFTER_SECONDS
+    ):
+        self.capacity = capacity
+        self.concurrency = concurrency or {}
+        self.retry_after = retry_after
+        self.admitted = 0
+        self.semaphores = {}
+
+    @classmethod
+    def from_configuration(cls, configuration):
+        job_queue_config = configuration.get("job_queue", {})
+        return cls(
+            capacity=job_queue_config.get("capacity", None),
+            concurrency=job_queue_config.get("concurrency", {}),
+            retry_after=job_queue_config.get(
+                "retry_after_seconds", DEFAULT_RETRY_AFTER_SECONDS
+            ),
+        )
+
+    def endpoint(self, name):
+        return EndpointQueue(self, name)
+
+    def get_semaphore(self, name):
+        limit = self.concurrency.get(name, None)
+        if limit is None:
+            return None
+
+        if name not in self.semaphores:
+            self.semaphores[name] = asyncio.Semaphore(limit)
+        return self.semaphores[name]
+
+    def admit(self, name, count=1):
+        """
+        Admit 'count' jobs of the endpoint, all or none of them
+
+        Returns: list of the admitted jobs
+        Raises: QueueFull if the capacity would be exceeded
+        """
+        if self.capacity is not None and self.admitted + count > self.capacity:
+            JOB_QUEUE_REJECTED.labels(name).inc()
+            logger.warning(
+                "Rejecting {} {} job(s), {} of {} jobs admitted".format(
+                    count, name, self.admitted, self.capacity
+                )
+            )
+            raise QueueFull(name, self.retry_after)
+
+        self.admitted += count
+        return [Job(self, name) for _ in range(count)]
+
+
+class EndpointQueue(object):
+    """
+    View of the job queue for the jobs of one endpoint
+    """
+
+    def __init__(self, queue, name):
+        self.queue = queue
+        self.name = name
+
+    def admit(self, count=1):
+        return self.queue.admit(self.name, count)
+
+
+class Job(object):
+    def __init__(self, queue, name):
+        self.queue = queue
+        self.name = name
+        self.admitted_time = time.monotonic()
+        self.released = False
+
+    def release(self):
+        """
+        Give the slot of the job back to the queue. Does nothing if already released
+        """
+        if not self.released:
+            self.released = True
+            self.queue.admitted -= 1
+
+    async def run(self, coro_function):
+        """
+        Wait for a free slot of the endpoint, then run 'coro_function()'. The job is
+        released when done, even if cancelled while waiting
+        """
+        try:
+            semaphore = self.queue.get_semaphore(self.name)
+
+            if semaphore is not None:
+                JOB_QUEUE_DEPTH.labels(self.name).inc()
+                try:
+                    await semaphore.acquire()
+                finally:
+                    JOB_QUEUE_DEPTH.labels(self.name).dec()
+
+            JOB_QUEUE_WAIT_TIME.labels(self.name).observe(
+                time.monotonic() - self.admitted_time
+            )
+            JOB_QUEUE_RUNNING.labels(self.name).inc()
+            try:
+                return await coro_function()
+            finally:
+                JOB_QUEUE_RUNNING.labels(self.name).dec()
+                if semaphore is not None:
+                    semaphore.release()
+        finally:
+            self.release()
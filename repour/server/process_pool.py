@@ -0,0 +1,453 @@
+# Process pool
+#
+# With the 'process' job execution mode, the endpoints only validate and admit the
+# requests on the event loop of the server. The jobs themselves (the clone, the
+# alignment and its manipulator, the parsing of their results, the formatting and the
+# writing of their logs) run in a pool of processes, each with its own event loop, so
+# that a heavy alignment does not delay the other requests.
+#
+# The server sends the spec of a job to a process of the pool over a pipe, and gets
+# back the (status, response object) tuple of the endpoint. The log context of the
+# request is sent along with the spec, and the process writes the logs of the job to
+# the callback log file itself. The process sends the phase and the pids of the job
+# back, to keep the task registry of the server up to date, and the slow commands of
+# the jobs, listed by the server. A cancelled job is cancelled in the process too.
+
+import asyncio
+import importlib
+import itertools
+import logging
+import multiprocessing
+import os
+import signal
+
+from prometheus_client import Counter, Gauge
+
+from repour.lib.logs import file_callback_log, log_util
+from repour.lib.telemetry import tracing
+from repour.server import command_metrics, task_registry, workers
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MODE = "loop"
+# time given to a process to clean up a cancelled job
+CANCEL_TIMEOUT_SECONDS = 10
+STOP_TIMEOUT_SECONDS = 10
+
+PROCESS_POOL_JOBS = Gauge(
+    "process_pool_jobs",
+    "Jobs running in the processes of the pool",
+    multiprocess_mode="livesum",
+)
+PROCESS_POOL_EXITS = Counter(
+    "process_pool_exits", "Processes of the pool which exited unexpectedly"
+)
+
+# sent by the server
+RUN = "run"
+CANCEL = "cancel"
+# sent by the processes
+RESULT = "result"
+CANCELLED = "cancelled"
+PHASE = "phase"
+PID = "pid"
+SLOW_COMMAND = "slow_command"
+
+
+class ProcessExited(Exception):
+    def __init__(self, pid, exitcode):
+        super().__init__(
+            "Job process {} exited with code {} while running the job".format(
+                pid, exitcode
+            )
+        )
+        self.pid = pid
+        self.exitcode = exitcode
+
+
+def get_function_path(function):
+    """
+    Returns: the 'module:name' path the processes import the function from
+    Raises: ValueError if the function cannot be imported by name
+    """
+    path = "{}:{}".format(function.__module__, function.__qualname__)
+    if import_function(path) is not function:
+        raise ValueError("Cannot run {} in a job process".format(path))
+    return path
+
+
+def import_function(path):
+    module_name, _, name = path.partition(":")
+    value = importlib.import_module(module_name)
+    for attribute in name.split("."):
+        value = getattr(value, attribute, None)
+    return value
+
+
+def get_log_context():
+    """
+    Returns: the log context and the trace context of the current task, sent to the
+             process running its job
+    """
+    task = asyncio.current_task()
+    return {
+        "log_context": getattr(task, "log_context", None),
+        "loggerName": getattr(task, "loggerName", None),
+        "callback_id": getattr(task, "callback_id", None),
+        "mdc": dict(log_util.get_mdc()),
+        "trace": tracing.get_carrier(),
+    }
+
+
+class ProcessPool(object):
+    """
+    size: number of processes
+    repo_provider: dict with the 'type' and the 'params' of the repo provider, created
+                   in each process
+    initializer: picklable function called when a process starts, before any job,
+                 typically to set up the logging
+    """
+
+    def __init__(self, size, repo_provider, initializer=None):
+        self.size = size
+        self.repo_provider = repo_provider
+        self.initializer = initializer
+        self.context = multiprocessing.get_context("spawn")
+        self.processes = []
+        self.job_ids = itertools.count()
+        self.stopped = False
+
+    @classmethod
+    def from_configuration(cls, configuration, repo_provider, initializer=None):
+        """
+        Returns: the pool, or None if the jobs run on the event loop of the server
+        """
+        job_execution_config = configuration.get("job_execution", {})
+        mode = job_execution_config.get("mode", DEFAULT_MODE)
+        if mode == "loop":
+            return None
+        if mode != "process":
+            raise ValueError("Unknown job execution mode: " + str(mode))
+
+        return cls(
+            size=job_execution_config.get("processes", os.cpu_count() or 1),
+            repo_provider=repo_provider,
+            initializer=initializer,
+        )
+
+    def start(self):
+        while len(self.processes) < self.size:
+            self.processes.append(PoolProcess(self))
+
+    async def stop(self):
+        self.stopped = True
+        processes = self.processes
+        self.processes = []
+        await asyncio.gather(*[process.stop() for process in processes])
+
+    def get_process(self):
+        """
+        Returns: the process running the fewest jobs, processes which exited are
+                 replaced
+        """
+        if self.stopped:
+            raise RuntimeError("The process pool is stopped")
+        self.start()
+        return min(self.processes, key=lambda process: len(process.jobs))
+
+    def remove(self, process):
+        if process in self.processes:
+            self.processes.remove(process)
+
+    async def call(self, coro, spec):
+        """
+        Run the coroutine of the endpoint for the spec in a process of the pool
+
+        Returns: tuple (status, response object)
+        Raises: ProcessExited if the process exited before the end of the job
+        """
+        function_path = get_function_path(coro)
+
+        # the logs of the job are appended to the callback log file by the process
+        callback_id = getattr(asyncio.current_task(), "callback_id", None)
+        if callback_id is not None:
+            await file_callback_log.finalize_callback_log(callback_id)
+
+        process = self.get_process()
+        job_id = next(self.job_ids)
+        future = asyncio.get_running_loop().create_future()
+        process.jobs[job_id] = (future, task_registry.current_task_info.get())
+
+        PROCESS_POOL_JOBS.inc()
+        try:
+            process.send((RUN, job_id, function_path, spec, get_log_context()))
+            try:
+                return await asyncio.shield(future)
+            except asyncio.CancelledError:
+                if not future.done():
+                    try:
+                        process.send((CANCEL, job_id))
+                    except ProcessExited:
+                        raise asyncio.CancelledError()
+                    # wait for the process to stop the subprocesses of the job
+                    await asyncio.wait([future], timeout=CANCEL_TIMEOUT_SECONDS)
+                raise
+        finally:
+            PROCESS_POOL_JOBS.dec()
+            process.jobs.pop(job_id, None)
+
+
+class PoolProcess(object):
+    """
+    Server side of a process of the pool
+    """
+
+    def __init__(self, pool):
+        self.pool = pool
+        # job id -> (future, task info)
+        self.jobs = {}
+        self.connection, child_connection = pool.context.Pipe()
+        self.process = pool.context.Process(
+            target=run_process,
+            args=(child_connection, pool.repo_provider, pool.initializer),
+            name="repour-job-process",
+            daemon=True,
+        )
+        self.process.start()
+        child_connection.close()
+        logger.info("Started job process {}".format(self.process.pid))
+
+        self.loop = asyncio.get_running_loop()
+        self.loop.add_reader(self.connection.fileno(), self.on_message)
+
+    def send(self, message):
+        try:
+            self.connection.send(message)
+        except OSError:
+            self.on_exit()
+            raise ProcessExited(self.process.pid, self.process.exitcode)
+
+    def on_message(self):
+        try:
+            message = self.connection.recv()
+        except (EOFError, OSError):
+            self.on_exit()
+            return
+
+        kind, job_id = message[0], message[1]
+        if kind == SLOW_COMMAND:
+            command_metrics.add_slow_command(message[2])
+            return
+        if job_id not in self.jobs:
+            return
+        future, task_info = self.jobs[job_id]
+
+        if kind == RESULT:
+            if not future.done():
+                future.set_result((message[2], message[3]))
+        elif kind == CANCELLED:
+            future.cancel()
+        elif kind == PHASE and task_info is not None:
+            task_info.phase = message[2]
+        elif kind == PID and task_info is not None:
+            if message[3]:
+                task_info.pids.add(message[2])
+            else:
+                task_info.pids.discard(message[2])
+
+    def on_exit(self):
+        """
+        The process exited, or closed its end of the pipe
+        """
+        if self.connection.closed:
+            return
+        self.loop.remove_reader(self.connection.fileno())
+        self.connection.close()
+        self.pool.remove(self)
+
+        self.process.join(timeout=1)
+        if not self.pool.stopped:
+            PROCESS_POOL_EXITS.inc()
+            logger.error(
+                "Job process {} exited with code {}".format(
+                    self.process.pid, self.process.exitcode
+                )
+            )
+        mark_process_dead(self.process.pid)
+
+        for future, _ in self.jobs.values():
+            if not future.done():
+                future.set_exception(
+                    ProcessExited(self.process.pid, self.process.exitcode)
+                )
+
+    async def stop(self):
+        if not self.connection.closed:
+            for future, _ in self.jobs.values():
+                if not future.done():
+                    future.cancel()
+            # closing its end of the pipe stops the process
+            self.loop.remove_reader(self.connection.fileno())
+            self.connection.close()
+
+        await self.loop.run_in_executor(None, self.process.join, STOP_TIMEOUT_SECONDS)
+        if self.process.is_alive():
+            self.process.terminate()
+            await self.loop.run_in_executor(None, self.process.join)
+        mark_process_dead(self.process.pid)
+
+
+def mark_process_dead(pid):
+    if os.environ.get(workers.PROMETHEUS_MULTIPROC_DIR_ENV, None):
+        from prometheus_client import multiprocess
+
+        multiprocess.mark_process_dead(pid)
+
+
+#
+# Process side
+#
+
+
+def run_process(connection, repo_provider, initializer):
+    # the server stops the process by closing the pipe
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    if initializer is not None:
+        initializer()
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        loop.run_until_complete(ProcessRunner(connection, repo_provider).run())
+    finally:
+        loop.close()
+
+
+class RemoteTaskInfo(object):
+    """
+    Task info of a job run by a process of the pool, forwarding the phase and the pids
+    to the task registry of the server
+    """
+
+    def __init__(self, runner, job_id, callback_id):
+        self.runner = runner
+        self.job_id = job_id
+        self.callback_id = callback_id
+        self.pids = RemotePids(runner, job_id)
+        self._phase = None
+
+    @property
+    def phase(self):
+        return self._phase
+
+    @phase.setter
+    def phase(self, phase):
+        self._phase = phase
+        self.runner.send((PHASE, self.job_id, phase))
+
+
+class RemotePids(set):
+    def __init__(self, runner, job_id):
+        super().__init__()
+        self.runner = runner
+        self.job_id = job_id
+
+    def add(self, pid):
+        super().add(pid)
+        self.runner.send((PID, self.job_id, pid, True))
+
+    def discard(self, pid):
+        super().discard(pid)
+        self.runner.send((PID, self.job_id, pid, False))
+
+
+class ProcessRunner(object):
+    def __init__(self, connection, repo_provider):
+        from repour import repo
+
+        self.connection = connection
+        self.app = {
+            "repo_provider": repo.provider_types[repo_provider["type"]](
+                **repo_provider["params"]
+            )
+        }
+        # job id -> task
+        self.tasks = {}
+        self.closed = None
+        command_metrics.slow_command_handler = self.send_slow_command
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        self.closed = loop.create_future()
+        loop.add_reader(self.connection.fileno(), self.on_message)
+        try:
+            await self.closed
+        finally:
+            loop.remove_reader(self.connection.fileno())
+            for task in self.tasks.values():
+                task.cancel()
+            await asyncio.gather(*self.tasks.values(), return_exceptions=True)
+
+    def send(self, message):
+        try:
+            self.connection.send(message)
+        except OSError:
+            # the server is gone
+            if not self.closed.done():
+                self.closed.set_result(None)
+
+    def send_slow_command(self, entry):
+        self.send((SLOW_COMMAND, None, entry))
+
+    def on_message(self):
+        try:
+            message = self.connection.recv()
+        except (EOFError, OSError):
+            if not self.closed.done():
+                self.closed.set_result(None)
+            return
+
+        if message[0] == RUN:
+            _, job_id, function_path, spec, log_context = message
+            self.tasks[job_id] = asyncio.get_running_loop().create_task(
+                self.run_job(job_id, function_path, spec, log_context)
+            )
+        elif message[0] == CANCEL:
+            task = self.tasks.get(message[1], None)
+            if task is not None:
+                task.cancel()
+
+    async def run_job(self, job_id, function_path, spec, log_context):
+        from repour.server.endpoint import endpoint
+
+        task = asyncio.current_task()
+        task.log_context = log_context["log_context"]
+        task.loggerName = log_context["loggerName"]
+        task.callback_id = log_context["callback_id"]
+        log_util.mdc_var.set(log_util.Mdc(log_context["mdc"]))
+        task_registry.current_task_info.set(
+            RemoteTaskInfo(self, job_id, task.callback_id)
+        )
+
+        try:
+            with tracing.remote_job(log_context["trace"]):
+                status, obj = await endpoint.call_coro(
+                    import_function(function_path), spec, self.app
+                )
+        except asyncio.CancelledError:
+            await self.finalize_callback_log(task.callback_id)
+            self.send((CANCELLED, job_id))
+            return
+        finally:
+            self.tasks.pop(job_id, None)
+
+        await self.finalize_callback_log(task.callback_id)
+        self.send((RESULT, job_id, status, obj))
+
+    async def finalize_callback_log(self, callback_id):
+        """
+        The server appends the end of the logs after the job
+        """
+        if callback_id is not None:
+            await file_callback_log.finalize_callback_log(callback_id)
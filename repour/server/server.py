@@ -3,21 +3,27 @@ import asyncio
 import logging
 import os
 
-import prometheus_async.aio as aio
 from aiohttp import web
 from prometheus_client.bridge.graphite import GraphiteBridge
 
 from repour import clone, repo
-from repour.adjust import adjust
-from repour.auth import auth
+from repour.adjust import adjust, batch
+from repour.auth import auth, auth_client
 from repour.config import config
+from repour.lib.logs import file_callback_log
+from repour.lib.scm import connection_reuse, gerrit, gitlab
+from repour.lib.telemetry import tracing
+from repour.server import callback_outbox, job_queue, process_pool, workers
 from repour.server.endpoint import (
     cancel,
+    debug,
     endpoint,
     external_to_internal,
     info,
+    metrics,
     validation,
     internal_scm,
+    tasks,
 )
 
 logger = logging.getLogger(__name__)
@@ -29,27 +35,65 @@ logger = logging.getLogger(__name__)
 shutdown_callbacks = []
 
 
-async def init(loop, bind, repo_provider, repour_url, adjust_provider):
+async def init(
+    loop,
+    bind,
+    repo_provider,
+    repour_url,
+    adjust_provider,
+    job_process_initializer=None,
+):
     logger.debug("Running init")
     c = await config.get_configuration()
 
     auth_provider = c.get("auth", {}).get("provider", None)
     logger.info("Using auth provider '" + str(auth_provider) + "'.")
 
-    app = web.Application(
-        loop=loop, middlewares=[auth.providers[auth_provider]] if auth_provider else {}
-    )
+    # the server span includes the authentication
+    middlewares = [tracing.middleware]
+    if auth_provider:
+        middlewares.append(auth.providers[auth_provider])
+    app = web.Application(loop=loop, middlewares=middlewares)
 
     logger.debug("Adding application resources")
     app["repo_provider"] = repo.provider_types[repo_provider["type"]](
         **repo_provider["params"]
     )
 
+    jobs = job_queue.JobQueue.from_configuration(c)
+
+    shutdown_callbacks.append(auth_client.token_manager.stop)
+    shutdown_callbacks.append(gitlab.close_clients)
+    shutdown_callbacks.append(gerrit.close_pools)
+
+    outbox = callback_outbox.CallbackOutbox.from_configuration(c)
+    outbox.start()
+    shutdown_callbacks.append(outbox.stop)
+
+    pool = process_pool.ProcessPool.from_configuration(
+        c, repo_provider, initializer=job_process_initializer
+    )
+    if pool is not None:
+        logger.info("Running the jobs in {} processes".format(pool.size))
+        pool.start()
+        shutdown_callbacks.append(pool.stop)
+
     external_to_internal_source = endpoint.validated_json_endpoint(
         shutdown_callbacks,
         validation.external_to_internal,
         external_to_internal.translate,
         repour_url,
+        jobs=jobs.endpoint("external_to_internal"),
+        outbox=outbox,
+    )
+
+    external_to_internal_batch_source = endpoint.validated_json_endpoint(
+        shutdown_callbacks,
+        validation.external_to_internal_batch,
+        external_to_internal.translate_batch,
+        repour_url,
+        jobs=jobs.endpoint("external_to_internal"),
+        outbox=outbox,
     )
 
     clone_source = endpoint.validated_json_endpoint(
@@ -58,10 +102,30 @@ async def init(loop, bind, repo_provider, repour_url, adjust_provider):
         clone.clone,
         repour_url,
         send_logs_to_bifrost=False,
+        jobs=jobs.endpoint("clone"),
+        outbox=outbox,
+        pool=pool,
     )
 
     adjust_source = endpoint.validated_json_endpoint(
-        shutdown_callbacks, validation.adjust_modeb, adjust.adjust, repour_url
+        shutdown_callbacks,
+        validation.adjust_modeb,
+        adjust.adjust,
+        repour_url,
+        jobs=jobs.endpoint("adjust"),
+        outbox=outbox,
+        pool=pool,
+    )
+
+    # the adjusts of a batch share their clones, they run on the event loop
+    adjust_batch_source = endpoint.validated_json_batch_endpoint(
+        shutdown_callbacks,
+        validation.adjust_modeb_batch,
+        "adjusts",
+        batch.prepare,
+        repour_url,
+        jobs=jobs.endpoint("adjust"),
+        outbox=outbox,
     )
 
     internal_scm_source = endpoint.validated_json_endpoint(
@@ -70,6 +134,9 @@ async def init(loop, bind, repo_provider, repour_url, adjust_provider):
         internal_scm.internal_scm,
         repour_url,
         send_logs_to_bifrost=False,
+        jobs=jobs.endpoint("internal_scm"),
+        outbox=outbox,
+        pool=pool,
     )
 
     logger.debug("Setting up handlers")
@@ -77,26 +144,69 @@ async def init(loop, bind, repo_provider, repour_url, adjust_provider):
     app.router.add_route(
         "POST", "/git-external-to-internal", external_to_internal_source
     )
+    app.router.add_route(
+        "POST", "/git-external-to-internal/batch", external_to_internal_batch_source
+    )
     app.router.add_route("POST", "/clone", clone_source)
     app.router.add_route("POST", "/adjust", adjust_source)
+    app.router.add_route("POST", "/adjust/batch", adjust_batch_source)
     app.router.add_route("POST", "/internal-scm", internal_scm_source)
     app.router.add_route("POST", "/cancel/{task_id}", cancel.handle_cancel)
-    app.router.add_route("GET", "/metrics", aio.web.server_stats)
+    app.router.add_route("POST", "/cancel/{task_id}/local", cancel.handle_cancel_local)
+    app.router.add_route(
+        "POST", "/cancel/{task_id}/worker", cancel.handle_cancel_worker
+    )
+    app.router.add_route("GET", "/tasks", tasks.handle_tasks)
+    app.router.add_route("GET", "/tasks/worker", tasks.handle_tasks_worker)
+    app.router.add_route("GET", "/metrics", metrics.handle_metrics)
+    app.router.add_route("GET", "/debug/slow-commands", debug.handle_slow_commands)
+    app.router.add_route(
+        "GET", "/debug/slow-commands/worker", debug.handle_slow_commands_worker
+    )
     app.router.add_route("GET", "/version", info.handle_version)
 
-    await setup_graphite_exporter()
+    if workers.is_first_worker():
+        await setup_graphite_exporter()
+        # Cleanup of old log files
+        asyncio.get_event_loop().create_task(
+            file_callback_log.setup_clean_old_logfiles()
+        )
+        asyncio.get_event_loop().create_task(
+            connection_reuse.setup_clean_stale_sockets()
+        )
     # used for distributed cancel operation
     asyncio.get_event_loop().create_task(cancel.start_cancel_loop())
 
     logger.debug("Creating asyncio server")
+    handler = app.make_handler(access_log=None)
+    # with several workers, each one binds the port and the kernel balances the
+    # connections between them
     srv = await loop.create_server(
-        app.make_handler(access_log=None), bind["address"], bind["port"]
+        handler,
+        bind["address"],
+        bind["port"],
+        reuse_port=bind.get("reuse_port", None),
     )
     for socket in srv.sockets:
         logger.info("Server started on socket: {}".format(socket.getsockname()))
 
+    if workers.is_worker():
+        # for the requests of the other workers
+        socket_path = workers.get_socket_path(workers.worker_index)
+        workers.remove_file(socket_path)
+        await loop.create_unix_server(handler, socket_path)
+        logger.info(
+            "Worker {} listening on {}".format(workers.worker_index, socket_path)
+        )
+
 
-def start_server(bind, repo_provider, repour_url, adjust_provider):
+def start_server(
+    bind, repo_provider, repour_url, adjust_provider, job_process_initializer=None
+):
+    """
+    job_process_initializer: picklable function called when a process of the job
+                             process pool starts, if the jobs run in processes
+    """
     logger.debug("Starting server")
     loop = asyncio.get_event_loop()
 
@@ -107,6 +217,7 @@ def start_server(bind, repo_provider, repour_url, adjust_provider):
             repo_provider=repo_provider,
             repour_url=repour_url,
             adjust_provider=adjust_provider,
+            job_process_initializer=job_process_initializer,
         )
     )
 
@@ -123,7 +234,9 @@ def start_server(bind, repo_provider, repour_url, adjust_provider):
             asyncio.gather(*tasks, loop=loop, return_exceptions=True)
         )
         for shutdown_callback in shutdown_callbacks:
-            shutdown_callback()
+            result = shutdown_callback()
+            if asyncio.iscoroutine(result):
+                loop.run_until_complete(result)
         exception_results = [
             r
             for r in results
@@ -160,5 +273,7 @@ async def setup_graphite_exporter():
         + str(graphite_key)
     )
 
-    gb = GraphiteBridge((graphite_server, graphite_port))
+    gb = GraphiteBridge(
+        (graphite_server, graphite_port), registry=metrics.get_registry()
+    )
     gb.start(60.0, prefix=graphite_key)
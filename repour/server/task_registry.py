@@ -0,0 +1,108 @@
+# Task registry
+#
+# Every request accepted by the endpoints is registered here until its job is done,
+# with the asyncio task running it. The cancel endpoint finds the tasks to cancel by
+# task id without scanning all the tasks of the event loop, and GET /tasks lists what
+# the server is working on.
+
+import contextvars
+import time
+
+# TaskInfo of the request the current context works for, inherited by the tasks it
+# creates
+current_task_info = contextvars.ContextVar("task_info", default=None)
+
+
+class TaskInfo(object):
+    def __init__(self, callback_id, endpoint, task_id=None, repo=None):
+        self.callback_id = callback_id
+        self.endpoint = endpoint
+        self.task_id = task_id
+        self.repo = repo
+        self.task = None
+        self.phase = None
+        self.pids = set()
+        self.admitted_time = time.monotonic()
+        self.started_time = None
+
+    def start(self):
+        """
+        Called once the job got a slot of its endpoint
+        """
+        self.started_time = time.monotonic()
+
+    def to_json(self):
+        now = time.monotonic()
+        return {
+            "callbackId": self.callback_id,
+            "taskId": self.task_id,
+            "endpoint": self.endpoint,
+            "repo": self.repo,
+            "state": "queued" if self.started_time is None else "running",
+            "phase": self.phase,
+            "elapsedSeconds": round(now - self.admitted_time, 3),
+            "runningSeconds": None
+            if self.started_time is None
+            else round(now - self.started_time, 3),
+            "pids": sorted(self.pids),
+        }
+
+
+class TaskRegistry(object):
+    def __init__(self):
+        # callback id -> TaskInfo
+        self.tasks = {}
+        # task id -> {callback id: TaskInfo}
+        self.by_task_id = {}
+
+    def add(self, info):
+        self.tasks[info.callback_id] = info
+        if info.task_id:
+            self.by_task_id.setdefault(info.task_id, {})[info.callback_id] = info
+
+    def remove(self, info):
+        """
+        Does nothing if the task is not registered anymore
+        """
+        self.tasks.pop(info.callback_id, None)
+        infos = self.by_task_id.get(info.task_id, None)
+        if infos is not None:
+            infos.pop(info.callback_id, None)
+            if not infos:
+                del self.by_task_id[info.task_id]
+
+    def get_by_task_id(self, task_id):
+        """
+        Returns: list of the TaskInfo registered with the task id
+        """
+        return list(self.by_task_id.get(task_id, {}).values())
+
+    def list(self):
+        return list(self.tasks.values())
+
+
+registry = TaskRegistry()
+
+
+def set_phase(phase):
+    info = current_task_info.get()
+    if info is not None:
+        info.phase = phase
+
+
+def end_phase(phase):
+    info = current_task_info.get()
+    if info is not None and info.phase == phase:
+        info.phase = None
+
+
+def add_pid(pid):
+    info = current_task_info.get()
+    if info is not None:
+        info.pids.add(pid)
+
+
+def remove_pid(pid):
+    info = current_task_info.get()
+    if info is not None:
+        info.pids.discard(pid)
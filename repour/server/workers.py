@@ -0,0 +1,260 @@
+# Workers
+#
+# With REPOUR_WORKERS set above 1, the server process becomes a supervisor forking that
+# many workers. Each worker runs its own event loop and binds the server port with
+# SO_REUSEPORT, so that the kernel spreads the connections over the workers and a pod
+# uses several cores.
+#
+# The workers of a pod reach each other through a Unix socket per worker, in a folder
+# created by the supervisor. The cancel and the tasks endpoints use them to find the
+# tasks of the other workers. The metrics of the workers are aggregated with the
+# multiprocess mode of the Prometheus client, in PROMETHEUS_MULTIPROC_DIR.
+#
+# This module must not import prometheus_client: the multiprocess mode is chosen when
+# it is imported, which has to happen after the supervisor set up the environment.
+
+import asyncio
+import glob
+import logging
+import os
+import shutil
+import signal
+import tempfile
+import time
+import traceback
+
+import aiohttp
+
+logger = logging.getLogger(__name__)
+
+WORKERS_ENV = "REPOUR_WORKERS"
+SOCKET_DIRECTORY_ENV = "REPOUR_WORKER_SOCKETS"
+PROMETHEUS_MULTIPROC_DIR_ENV = "PROMETHEUS_MULTIPROC_DIR"
+
+SOCKET_SUFFIX = ".sock"
+SIBLING_TIMEOUT = aiohttp.ClientTimeout(total=2)
+# a worker exiting sooner after its start is restarted only after this delay, to not
+# fork in a loop when it cannot start
+MIN_WORKER_UPTIME_SECONDS = 10
+RESTART_DELAY_SECONDS = 5
+
+# index of this worker, None when the server runs in a single process
+worker_index = None
+
+
+def get_worker_count():
+    count = int(os.environ.get(WORKERS_ENV, "1"))
+    if count < 1:
+        raise ValueError("{} must be at least 1, got {}".format(WORKERS_ENV, count))
+    return count
+
+
+def is_worker():
+    return worker_index is not None
+
+
+def is_first_worker():
+    """
+    True in the process which runs the tasks needed once per pod: the single process,
+    or the worker with index 0
+    """
+    return worker_index is None or worker_index == 0
+
+
+def get_socket_path(index, directory=None):
+    if directory is None:
+        directory = os.environ[SOCKET_DIRECTORY_ENV]
+    return os.path.join(directory, "worker-{}{}".format(index, SOCKET_SUFFIX))
+
+
+def get_sibling_socket_paths(directory=None):
+    """
+    Returns: the socket paths of the other workers of this pod
+    """
+    if not is_worker():
+        return []
+
+    if directory is None:
+        directory = os.environ[SOCKET_DIRECTORY_ENV]
+    own_path = get_socket_path(worker_index, directory)
+
+    return sorted(
+        path
+        for path in glob.glob(os.path.join(directory, "*" + SOCKET_SUFFIX))
+        if path != own_path
+    )
+
+
+async def request_siblings(method, path, headers=None, socket_paths=None):
+    """
+    Send the request to the other workers of this pod
+
+    Returns: list of (status, parsed json body) of the workers which answered
+    """
+    if socket_paths is None:
+        socket_paths = get_sibling_socket_paths()
+
+    responses = await asyncio.gather(
+        *[
+            request_sibling(socket_path, method, path, headers)
+            for socket_path in socket_paths
+        ]
+    )
+    return [response for response in responses if response is not None]
+
+
+async def request_sibling(socket_path, method, path, headers):
+    connector = aiohttp.UnixConnector(path=socket_path)
+    try:
+        async with aiohttp.ClientSession(
+            connector=connector, timeout=SIBLING_TIMEOUT
+        ) as session:
+            # the host is ignored, the connection goes through the socket
+            async with session.request(
+                method, "http://localhost" + path, headers=headers
+            ) as response:
+                try:
+                    body = await response.json(content_type=None)
+                except ValueError:
+                    body = None
+                return response.status, body
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        logger.warning("Could not reach worker {}: {}".format(socket_path, e))
+        return None
+
+
+#
+# Supervisor
+#
+
+
+def prepare_prometheus_multiproc_dir():
+    """
+    Use the folder given by PROMETHEUS_MULTIPROC_DIR, or create one. The metrics of a
+    previous run are removed
+
+    Returns: the folder, if it was created and has to be removed at exit
+    """
+    directory = os.environ.get(PROMETHEUS_MULTIPROC_DIR_ENV, None)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+        for path in glob.glob(os.path.join(directory, "*.db")):
+            os.remove(path)
+        return None
+
+    directory = tempfile.mkdtemp(prefix="repour-metrics-")
+    os.environ[PROMETHEUS_MULTIPROC_DIR_ENV] = directory
+    return directory
+
+
+def mark_worker_dead(pid):
+    from prometheus_client import multiprocess
+
+    multiprocess.mark_process_dead(pid)
+
+
+def supervise(count, start_worker):
+    """
+    Fork 'count' workers running start_worker(index), and restart the ones which exit
+    until the supervisor gets SIGTERM or SIGINT. The signal is forwarded to the workers
+
+    Returns: exit code
+    """
+    created_metrics_directory = prepare_prometheus_multiproc_dir()
+    socket_directory = tempfile.mkdtemp(prefix="repour-workers-")
+    os.environ[SOCKET_DIRECTORY_ENV] = socket_directory
+
+    # pid -> (index, start time)
+    workers = {}
+    stopping = []
+
+    def spawn(index):
+        pid = os.fork()
+        if pid == 0:
+            run_worker(index, start_worker)
+        logger.info("Started worker {} with pid {}".format(index, pid))
+        workers[pid] = (index, time.monotonic())
+
+    def stop(signum, frame):
+        stopping.append(signum)
+        for pid in list(workers):
+            try:
+                os.kill(pid, signum)
+            except ProcessLookupError:
+                pass
+
+    previous_handlers = {
+        signum: signal.signal(signum, stop)
+        for signum in (signal.SIGTERM, signal.SIGINT)
+    }
+
+    try:
+        for index in range(count):
+            spawn(index)
+
+        while workers:
+            try:
+                pid, status = os.wait()
+            except ChildProcessError:
+                break
+
+            if pid not in workers:
+                continue
+            index, start_time = workers.pop(pid)
+            mark_worker_dead(pid)
+            remove_file(get_socket_path(index, socket_directory))
+
+            if stopping:
+                continue
+
+            logger.error(
+                "Worker {} (pid {}) exited with status {}, restarting it".format(
+                    index, pid, os.waitstatus_to_exitcode(status)
+                )
+            )
+            if time.monotonic() - start_time < MIN_WORKER_UPTIME_SECONDS:
+                time.sleep(RESTART_DELAY_SECONDS)
+            if not stopping:
+                spawn(index)
+    finally:
+        for signum, handler in previous_handlers.items():
+            signal.signal(signum, handler)
+        shutil.rmtree(socket_directory, ignore_errors=True)
+        if created_metrics_directory is not None:
+            shutil.rmtree(created_metrics_directory, ignore_errors=True)
+
+    return 0
+
+
+def run_worker(index, start_worker):
+    """
+    Run in the forked process, never returns
+    """
+    global worker_index
+
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.default_int_handler)
+    worker_index = index
+
+    # the worker sets up its own logging handlers
+    root_logger = logging.getLogger()
+    for handler in list(root_logger.handlers):
+        root_logger.removeHandler(handler)
+
+    code = 1
+    try:
+        code = start_worker(index) or 0
+    except SystemExit as e:
+        code = e.code if isinstance(e.code, int) else 1
+    except BaseException:
+        traceback.print_exc()
+    finally:
+        logging.shutdown()
+        os._exit(code)
+
+
+def remove_file(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
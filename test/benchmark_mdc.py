@@ -0,0 +1,76 @@
+# flake8: noqa
+#
+# Per record overhead of capturing the mdc, with the mdc kept in the current context
+# compared to the former shallow copy of the task mdc attribute.
+#
+# python -m test.benchmark_mdc
+import asyncio
+import copy
+import logging
+import timeit
+
+from repour import main
+from repour.lib.logs import log_util
+
+RECORDS = 100000
+
+MDC = {
+    "userId": "user",
+    "requestContext": "request-context",
+    "processContext": "process-context",
+    "expires": "2026-01-01T00:00:00Z",
+    "tmp": "false",
+    "trace_id": "0af7651916cd43dd8448eb211c80319c",
+    "span_id": "b7ad6b7169203331",
+    "traceparent": "00-0af7651916cd43dd8448eb211c80319c-b7ad6b7169203331-01",
+}
+
+
+class TaskAttributeLogRecord(logging.LogRecord):
+    """
+    Former ContextLogRecord, copying the mdc task attribute for every record
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+
+        task = asyncio.current_task()
+        if task is not None:
+            self.mdc = copy.copy(getattr(task, "mdc", {}))
+            self.log_context = getattr(task, "log_context", "NoContext")
+            self.loggerName = getattr(task, "loggerName", "NoContext")
+
+
+def measure(record_class):
+    args = ("benchmark", logging.INFO, __file__, 1, "message", (), None)
+    seconds = min(timeit.repeat(lambda: record_class(*args), number=RECORDS, repeat=5))
+    return seconds / RECORDS * 1e9
+
+
+async def run():
+    task = asyncio.current_task()
+    task.mdc = dict(MDC)
+    task.log_context = "log-context"
+    task.loggerName = "org.jboss.pnc._userlog_.alignment"
+    for key, value in MDC.items():
+        log_util.add_update_mdc_key_value_in_task(key, value)
+
+    baseline = measure(logging.LogRecord)
+    before = measure(TaskAttributeLogRecord)
+    after = measure(main.ContextLogRecord)
+
+    print("LogRecord:                   {:8.1f} ns/record".format(baseline))
+    print(
+        "mdc copied from the task:    {:8.1f} ns/record (+{:.1f})".format(
+            before, before - baseline
+        )
+    )
+    print(
+        "mdc referenced from context: {:8.1f} ns/record (+{:.1f})".format(
+            after, after - baseline
+        )
+    )
+
+
+if __name__ == "__main__":
+    asyncio.new_event_loop().run_until_complete(run())
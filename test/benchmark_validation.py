@@ -0,0 +1,133 @@
+# flake8: noqa
+#
+# Per request cost of decoding and validating the body of the adjust and clone
+# requests, and of encoding a result, with the former request.json(), uncached url
+# validation and callback validation passes compared to the current ones.
+#
+# python -m test.benchmark_validation
+import json
+import timeit
+
+import voluptuous
+
+from repour.lib.io import fast_json
+from repour.server.endpoint import endpoint, validation
+
+REQUESTS = 20000
+
+CALLBACK = {
+    "url": "http://pnc.example.com/pnc-rest/v2/bpm/tasks/1234/notify",
+    "method": "POST",
+    "headers": [{"name": "Authorization", "value": "Bearer token"}],
+}
+
+ADJUST = {
+    "internal_url": {
+        "readwrite": "git+ssh://git@gitlab.example.com/pnc-workspace/project/repo.git",
+        "readonly": "https://gitlab.example.com/pnc-workspace/project/repo.git",
+    },
+    "ref": "1.2.3",
+    "adjustParameters": {"ALIGNMENT_PARAMETERS": "-DdependencyOverride=true"},
+    "originRepoUrl": "https://github.com/project/repo.git",
+    "sync": True,
+    "tempBuild": False,
+    "taskId": "1234",
+    "buildType": "MVN",
+    "positiveCallback": CALLBACK,
+    "negativeCallback": CALLBACK,
+}
+
+CLONE = {
+    "type": "git",
+    "ref": "main",
+    "originRepoUrl": "https://github.com/project/repo.git",
+    "targetRepoUrl": "git+ssh://git@gitlab.example.com/pnc-workspace/project/repo.git",
+    "callback": CALLBACK,
+    "taskId": "1234",
+}
+
+RESULT = {
+    "tag": "repour-0123456789abcdef0123456789abcdef01234567",
+    "commit": "0123456789abcdef0123456789abcdef01234567",
+    "url": ADJUST["internal_url"],
+    "adjustResultData": {
+        "VersioningState": {
+            "executionRootModified": {"groupId": "org.example", "artifactId": "é"},
+            "executionRootVersion": "1.2.3.redhat-00001",
+        },
+        "RemovedRepositories": [],
+    },
+    "callback": {"status": 200, "id": "Iq3bDGLDz2qNh7wDZpcLxQ"},
+}
+
+
+def former_is_callback_mode(spec):
+    try:
+        callback_mode = False
+
+        if ("positiveCallback" in spec) and ("negativeCallback" in spec):
+            validation.positive_callback(spec)
+            validation.negative_callback(spec)
+            callback_mode = True
+
+        if "callback" in spec:
+            validation.callback(spec)
+            callback_mode = True
+
+    except voluptuous.MultipleInvalid:
+        callback_mode = False
+
+    return callback_mode
+
+
+def former_decode_and_validate(body, validator):
+    # the urls were parsed again for each request
+    validation.is_url.cache_clear()
+    validation.is_git_url.cache_clear()
+    spec = json.loads(body.decode("utf-8"))
+    validator(spec)
+    former_is_callback_mode(spec)
+
+
+def decode_and_validate(body, validator):
+    spec = fast_json.loads(body)
+    validator(spec)
+    endpoint.is_callback_mode(spec)
+
+
+def measure(function, *args):
+    seconds = min(timeit.repeat(lambda: function(*args), number=REQUESTS, repeat=5))
+    return seconds / REQUESTS * 1e6
+
+
+def report(name, before, after):
+    print(
+        "{:<28} {:8.1f} us -> {:8.1f} us ({:.1f}x)".format(
+            name, before, after, before / after
+        )
+    )
+
+
+def main():
+    print("json: " + ("orjson" if fast_json.orjson is not None else "stdlib"))
+
+    for name, spec, validator in (
+        ("adjust", ADJUST, validation.adjust_modeb),
+        ("clone", CLONE, validation.clone),
+    ):
+        body = json.dumps(spec).encode("utf-8")
+        report(
+            "decode + validate " + name,
+            measure(former_decode_and_validate, body, validator),
+            measure(decode_and_validate, body, validator),
+        )
+
+    report(
+        "encode result",
+        measure(lambda: json.dumps(obj=RESULT, ensure_ascii=False).encode("utf-8")),
+        measure(fast_json.dumps, RESULT),
+    )
+
+
+if __name__ == "__main__":
+    main()
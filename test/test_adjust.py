@@ -8,6 +8,7 @@ import unittest
 from test import util
 
 import repour.adjust.adjust
+from repour.lib.logs import log_util
 
 loop = asyncio.new_event_loop()
 asyncio.set_event_loop(loop)
@@ -59,3 +60,35 @@ class TestAdjust(unittest.TestCase):
             )
         )
         self.assertRegex(d["tag"], r"^[0-9a-zA-Z-]+$")
+
+    def test_background_tasks(self):
+        async def run():
+            log_util.add_update_mdc_key_value_in_task("userId", "user")
+            asyncio.current_task().callback_id = "callback"
+
+            async def log_context():
+                task = asyncio.current_task()
+                return log_util.get_mdc(), task.callback_id
+
+            async def fail():
+                raise Exception("failed")
+
+            background_tasks = []
+            context = repour.adjust.adjust.start_background_task(
+                background_tasks, log_context()
+            )
+            failed = repour.adjust.adjust.start_background_task(
+                background_tasks, fail()
+            )
+            pending = repour.adjust.adjust.start_background_task(
+                background_tasks, asyncio.sleep(60)
+            )
+
+            self.assertEqual(await context, ({"userId": "user"}, "callback"))
+
+            await repour.adjust.adjust.cancel_background_tasks(background_tasks)
+
+            self.assertIsNotNone(failed.exception())
+            self.assertTrue(pending.cancelled())
+
+        loop.run_until_complete(run())
@@ -1,8 +1,13 @@
 # flake8: noqa
+import asyncio
+import os
 import unittest
+from test import util as test_util
 
 import repour.adjust.util as util
 
+loop = asyncio.get_event_loop()
+
 
 class TestAdjustUtil(unittest.TestCase):
     def test_util_file_option(self):
@@ -26,3 +31,33 @@ class TestAdjustUtil(unittest.TestCase):
         remaining_args, filepath = util.get_extra_parameters(param_file_equal)
         self.assertEqual(remaining_args, ["-Dtest2=test2", "-Dtest=test"])
         self.assertEqual(filepath, "hihi")
+
+    def test_get_modified_files(self):
+        with test_util.TemporaryGitDirectory() as repo:
+            os.makedirs(os.path.join(repo, "sub"))
+            for name in ("pom.xml", "sub/pom.xml", "sub/build.gradle", "A.java"):
+                with open(os.path.join(repo, name), "w") as f:
+                    f.write("Hello")
+            with open(os.path.join(repo, ".gitignore"), "w") as f:
+                f.write("target/\n")
+            test_util.quiet_check_call(["git", "add", "-A"], cwd=repo)
+            test_util.quiet_check_call(["git", "commit", "-m", "Test"], cwd=repo)
+
+            # simulate a manipulator run
+            with open(os.path.join(repo, "sub/pom.xml"), "w") as f:
+                f.write("Hello aligned")
+            os.remove(os.path.join(repo, "sub/build.gradle"))
+            with open(os.path.join(repo, "A.java"), "w") as f:
+                f.write("Edited by a groovy script")
+            with open(os.path.join(repo, "sub/gme-repos.gradle"), "w") as f:
+                f.write("repositories {}")
+            os.makedirs(os.path.join(repo, "target"))
+            with open(os.path.join(repo, "target/manipulation.json"), "w") as f:
+                f.write("{}")
+
+            modified = loop.run_until_complete(util.get_modified_files(repo))
+
+        self.assertEqual(
+            modified,
+            ["A.java", "sub/build.gradle", "sub/gme-repos.gradle", "sub/pom.xml"],
+        )
@@ -0,0 +1,189 @@
+# flake8: noqa
+import asyncio
+import os
+import tempfile
+import time
+import unittest
+from test import util
+from unittest import mock
+
+from repour.adjust import alignment_cache
+
+loop = asyncio.new_event_loop()
+asyncio.set_event_loop(loop)
+
+POM = """<project>
+  <groupId>org.foo</groupId>
+  <artifactId>bar</artifactId>
+  <version>1.0</version>
+</project>
+"""
+
+ALIGNED_POM = POM.replace("1.0", "1.0.0.redhat-00001")
+
+ADJUSTSPEC = {"buildType": "MVN", "adjustParameters": {}, "tempBuild": False}
+
+CONFIGURATION = {"alignment_cache": {"enabled": True, "ttl_seconds": 60}}
+
+
+def write_file(repo, path, content):
+    full_path = os.path.join(repo, path)
+    os.makedirs(os.path.dirname(full_path), exist_ok=True)
+    with open(full_path, "w") as f:
+        f.write(content)
+
+
+def commit_files(repo, files):
+    for path, content in files.items():
+        write_file(repo, path, content)
+    util.quiet_check_call(["git", "add", "-A"], cwd=repo)
+    util.quiet_check_call(["git", "commit", "-m", "Files"], cwd=repo)
+
+
+def read_file(repo, path):
+    with open(os.path.join(repo, path), "r") as f:
+        return f.read()
+
+
+class TestAlignmentCache(unittest.TestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.TemporaryDirectory()
+        patcher = mock.patch.object(
+            alignment_cache, "ALIGNMENT_CACHE_PATH", self.cache_dir.name
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(self.cache_dir.cleanup)
+
+    def align(self, repo):
+        """
+        Simulate a manipulator run
+        """
+        write_file(repo, "pom.xml", ALIGNED_POM)
+        write_file(repo, "sub/pom.xml", ALIGNED_POM)
+        write_file(repo, "sub/gme-repos.gradle", "repositories {}\n")
+        os.remove(os.path.join(repo, "removed.gradle"))
+
+        return {"adjustType": ["pme"], "resultData": {"version": "1.0.0.redhat-00001"}}
+
+    def test_fingerprint(self):
+        with util.TemporaryGitDirectory() as repo1, util.TemporaryGitDirectory() as repo2:
+            commit_files(repo1, {"pom.xml": POM, "src/A.java": "class A {}"})
+            commit_files(repo2, {"pom.xml": POM, "src/A.java": "class B {}"})
+
+            key1 = loop.run_until_complete(
+                alignment_cache.fingerprint(repo1, ADJUSTSPEC, CONFIGURATION)
+            )
+            key2 = loop.run_until_complete(
+                alignment_cache.fingerprint(repo2, ADJUSTSPEC, CONFIGURATION)
+            )
+            # only the sources differ
+            self.assertEqual(key1, key2)
+
+            key3 = loop.run_until_complete(
+                alignment_cache.fingerprint(
+                    repo2, dict(ADJUSTSPEC, tempBuild=True), CONFIGURATION
+                )
+            )
+            self.assertNotEqual(key1, key3)
+
+            commit_files(repo2, {"sub/pom.xml": POM})
+            key4 = loop.run_until_complete(
+                alignment_cache.fingerprint(repo2, ADJUSTSPEC, CONFIGURATION)
+            )
+            self.assertNotEqual(key1, key4)
+
+            # the NPM lock files are read by the project manipulator
+            commit_files(repo2, {"package-lock.json": "{}"})
+            key5 = loop.run_until_complete(
+                alignment_cache.fingerprint(repo2, ADJUSTSPEC, CONFIGURATION)
+            )
+            self.assertNotEqual(key4, key5)
+
+    def test_save_and_replay(self):
+        files = {
+            "pom.xml": POM,
+            "sub/pom.xml": POM,
+            "removed.gradle": "apply plugin: 'java'\n",
+        }
+
+        with util.TemporaryGitDirectory() as repo1, util.TemporaryGitDirectory() as repo2:
+            commit_files(repo1, dict(files, **{"src/A.java": "class A {}"}))
+            commit_files(repo2, dict(files, **{"src/A.java": "class B {}"}))
+
+            key = loop.run_until_complete(
+                alignment_cache.fingerprint(repo1, ADJUSTSPEC, CONFIGURATION)
+            )
+
+            adjust_result = {"adjustType": [], "resultData": {}}
+            self.assertIsNone(
+                loop.run_until_complete(
+                    alignment_cache.replay(repo1, key, CONFIGURATION, adjust_result)
+                )
+            )
+
+            manipulator_result = self.align(repo1)
+            loop.run_until_complete(
+                alignment_cache.save(
+                    repo1, key, CONFIGURATION, manipulator_result, "1.0.0.redhat-00001"
+                )
+            )
+
+            adjust_result = {"adjustType": [], "resultData": {}}
+            record = loop.run_until_complete(
+                alignment_cache.replay(repo2, key, CONFIGURATION, adjust_result)
+            )
+
+            self.assertEqual(record["specificTagName"], "1.0.0.redhat-00001")
+            self.assertEqual(adjust_result["adjustType"], ["pme"])
+            self.assertEqual(
+                adjust_result["resultData"], manipulator_result["resultData"]
+            )
+            self.assertEqual(
+                adjust_result["modifiedFiles"],
+                ["pom.xml", "removed.gradle", "sub/gme-repos.gradle", "sub/pom.xml"],
+            )
+            self.assertEqual(read_file(repo2, "pom.xml"), ALIGNED_POM)
+            self.assertEqual(read_file(repo2, "sub/pom.xml"), ALIGNED_POM)
+            self.assertEqual(
+                read_file(repo2, "sub/gme-repos.gradle"), "repositories {}\n"
+            )
+            self.assertFalse(os.path.exists(os.path.join(repo2, "removed.gradle")))
+            self.assertEqual(read_file(repo2, "src/A.java"), "class B {}")
+
+    def test_replay_mismatch(self):
+        with util.TemporaryGitDirectory() as repo1, util.TemporaryGitDirectory() as repo2:
+            commit_files(repo1, {"pom.xml": POM, "removed.gradle": "a"})
+            commit_files(repo2, {"pom.xml": POM, "removed.gradle": "a"})
+
+            key = loop.run_until_complete(
+                alignment_cache.fingerprint(repo1, ADJUSTSPEC, CONFIGURATION)
+            )
+            manipulator_result = self.align(repo1)
+            loop.run_until_complete(
+                alignment_cache.save(
+                    repo1, key, CONFIGURATION, manipulator_result, None
+                )
+            )
+
+            # the recorded result does not match what the edits produce anymore
+            record = alignment_cache.load_record(key, 60)
+            record["files"]["pom.xml"][1] = "0" * 40
+            alignment_cache.store_record(key, record)
+
+            adjust_result = {"adjustType": [], "resultData": {}}
+            self.assertIsNone(
+                loop.run_until_complete(
+                    alignment_cache.replay(repo2, key, CONFIGURATION, adjust_result)
+                )
+            )
+            self.assertEqual(adjust_result, {"adjustType": [], "resultData": {}})
+            self.assertEqual(read_file(repo2, "pom.xml"), POM)
+            self.assertFalse(os.path.exists(os.path.join(repo2, "sub")))
+
+    def test_ttl(self):
+        alignment_cache.store_record("key", {"created": time.time() - 120})
+
+        self.assertIsNotNone(alignment_cache.load_record("key", 180))
+        self.assertIsNone(alignment_cache.load_record("key", 60))
+        self.assertFalse(os.path.exists(alignment_cache.get_record_path("key")))
@@ -54,6 +54,35 @@ class TestCommon(unittest.TestCase):
             )
             util.quiet_check_call(["git", "commit", "-m", "Test"], cwd=repo)
 
+    def test_prepare_new_branch_paths(self):
+        with util.TemporaryGitDirectory() as repo:
+            for name in ("pom.xml", "deleted.xml", "other.txt"):
+                with open(os.path.join(repo, name), "w") as f:
+                    f.write("Hello")
+            util.quiet_check_call(["git", "add", "-A"], cwd=repo)
+            util.quiet_check_call(["git", "commit", "-m", "Test"], cwd=repo)
+
+            for name in ("pom.xml", "other.txt", "new [file].xml"):
+                with open(os.path.join(repo, name), "w") as f:
+                    f.write("Hello Hello")
+            os.remove(os.path.join(repo, "deleted.xml"))
+
+            loop.run_until_complete(
+                asgit.prepare_new_branch(
+                    expect_ok,
+                    repo,
+                    "adjust-1234567890",
+                    paths=["deleted.xml", "new [file].xml", "pom.xml"],
+                )
+            )
+            staged = subprocess.check_output(
+                ["git", "diff", "--cached", "--name-status"], cwd=repo
+            )
+            unstaged = subprocess.check_output(["git", "diff", "--name-only"], cwd=repo)
+
+        self.assertEqual(staged, b"D\tdeleted.xml\nA\tnew [file].xml\nM\tpom.xml\n")
+        self.assertEqual(unstaged, b"other.txt\n")
+
     def test_annotated_tag(self):
         with util.TemporaryGitDirectory() as repo:
             with open(os.path.join(repo, "asd.txt"), "w") as f:
@@ -0,0 +1,134 @@
+# flake8: noqa
+import asyncio
+import datetime
+import unittest
+from test import util
+from unittest import mock
+
+import aiohttp.web
+
+from repour.auth import auth_client
+from repour.config import config
+
+loop = asyncio.get_event_loop()
+
+
+def create_token(name, expires_in=300):
+    return {
+        "token": name,
+        "expiry_date": datetime.datetime.now() + datetime.timedelta(seconds=expires_in),
+        "expires_in": expires_in,
+    }
+
+
+class TestTokenManager(unittest.TestCase):
+    def setUp(self):
+        self.fetches = []
+        self.failures = []
+
+    def create_manager(self, expires_in=300, delay=0.05):
+        async def fetch(session):
+            self.assertIsNotNone(session)
+            self.fetches.append(session)
+            await asyncio.sleep(delay)
+            if self.failures:
+                raise self.failures.pop(0)
+            return create_token("token-" + str(len(self.fetches)), expires_in)
+
+        manager = auth_client.TokenManager(fetch=fetch)
+        self.addCleanup(lambda: loop.run_until_complete(manager.stop()))
+        return manager
+
+    def test_concurrent_callers_share_refresh(self):
+        manager = self.create_manager()
+
+        async def run():
+            tokens = await asyncio.gather(*[manager.access_token() for _ in range(10)])
+            tokens.append(await manager.access_token())
+            return tokens
+
+        tokens = loop.run_until_complete(run())
+
+        self.assertEqual(tokens, ["token-1"] * 11)
+        self.assertEqual(len(self.fetches), 1)
+
+    def test_refreshed_in_background(self):
+        # refreshed after a fifth of its lifetime at the latest
+        manager = self.create_manager(expires_in=0.5, delay=0)
+
+        async def run():
+            await manager.refresh()
+            await asyncio.sleep(0.25)
+
+        loop.run_until_complete(run())
+
+        self.assertGreaterEqual(len(self.fetches), 2)
+        # the same session is used for all the requests
+        self.assertEqual(len(set(map(id, self.fetches))), 1)
+
+    def test_failure_retried(self):
+        manager = self.create_manager(delay=0)
+        self.failures.append(Exception("issuer unavailable"))
+        failures = auth_client.TOKEN_REFRESH_FAILURES._value.get()
+
+        async def run():
+            with self.assertRaises(Exception):
+                await manager.access_token()
+            await asyncio.sleep(0.1)
+            return manager.current_token
+
+        with mock.patch.object(auth_client, "get_retry_delay", lambda failures: 0.01):
+            current_token = loop.run_until_complete(run())
+
+        self.assertEqual(current_token["token"], "token-2")
+        self.assertEqual(manager.failures, 0)
+        self.assertEqual(auth_client.TOKEN_REFRESH_FAILURES._value.get() - failures, 1)
+
+    def test_refresh_delay(self):
+        self.assertEqual(auth_client.get_refresh_delay(300), 180)
+        self.assertEqual(auth_client.get_refresh_delay(3600), 2880)
+        self.assertAlmostEqual(auth_client.get_refresh_delay(60), 12)
+
+
+class TestGetNewAccessToken(unittest.TestCase):
+    requests = []
+
+    @classmethod
+    def setUpClass(cls):
+        async def handler(request):
+            cls.requests.append(dict(await request.post()))
+            return aiohttp.web.json_response(
+                {"access_token": "service-token", "expires_in": 300}
+            )
+
+        util.setup_http(
+            cls=cls,
+            loop=loop,
+            routes=[("POST", "/realm/protocol/openid-connect/token", handler)],
+        )
+
+    @classmethod
+    def tearDownClass(cls):
+        util.teardown_http(cls, loop)
+
+    def test_get_new_access_token(self):
+        async def get_configuration():
+            return {
+                "auth": {
+                    "oauth2_jwt": {"token_issuer": self.url + "/realm"},
+                    "service_account": {"client_id": "repour"},
+                }
+            }
+
+        async def run():
+            async with aiohttp.ClientSession() as session:
+                return await auth_client.get_new_access_token(session=session)
+
+        with mock.patch.object(config, "get_configuration", get_configuration):
+            token = loop.run_until_complete(run())
+
+        self.assertEqual(token["token"], "service-token")
+        self.assertEqual(token["expires_in"], 300)
+        self.assertFalse(auth_client.is_expired(token))
+        self.assertEqual(self.requests[0]["grant_type"], "client_credentials")
+        self.assertEqual(self.requests[0]["client_id"], "repour")
@@ -0,0 +1,161 @@
+# flake8: noqa
+import asyncio
+import os
+import tempfile
+import unittest
+from test import util
+
+from repour.adjust import batch
+
+loop = asyncio.new_event_loop()
+asyncio.set_event_loop(loop)
+
+
+def commit_file(repo, name, content):
+    with open(os.path.join(repo, name), "w") as f:
+        f.write(content)
+    util.quiet_check_call(["git", "add", "-A"], cwd=repo)
+    util.quiet_check_call(["git", "commit", "-m", content], cwd=repo)
+
+
+def read_file(repo, name):
+    with open(os.path.join(repo, name), "r") as f:
+        return f.read()
+
+
+class TestBatch(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.origin_cls = util.TemporaryGitDirectory()
+        cls.origin = cls.origin_cls.__enter__()
+
+        commit_file(cls.origin, "pom.xml", "main 1")
+        util.quiet_check_call(["git", "tag", "1.0"], cwd=cls.origin)
+        commit_file(cls.origin, "pom.xml", "main 2")
+        util.quiet_check_call(["git", "checkout", "-b", "other"], cwd=cls.origin)
+        commit_file(cls.origin, "pom.xml", "other")
+        util.quiet_check_call(["git", "checkout", "main"], cwd=cls.origin)
+
+        cls.url = "file://" + cls.origin
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.origin_cls.cleanup()
+
+    def test_shared_clone(self):
+        shared_clone = batch.SharedClone(self.url, ["main", "other", "1.0", "main"])
+        shared_clone.acquire()
+        shared_clone.acquire()
+
+        with tempfile.TemporaryDirectory() as workspaces:
+            for ref, content in (
+                ("main", "main 2"),
+                ("other", "other"),
+                ("1.0", "main 1"),
+            ):
+                work_dir = os.path.join(workspaces, ref)
+                self.assertTrue(
+                    loop.run_until_complete(shared_clone.checkout(work_dir, ref))
+                )
+                self.assertEqual(read_file(work_dir, "pom.xml"), content)
+
+                # the workspace borrows the objects of the store
+                with open(
+                    os.path.join(work_dir, ".git", "objects", "info", "alternates")
+                ) as f:
+                    self.assertEqual(
+                        f.read().strip(),
+                        os.path.join(shared_clone.store_dir, "objects"),
+                    )
+
+            self.assertFalse(
+                loop.run_until_complete(
+                    shared_clone.checkout(os.path.join(workspaces, "x"), "unknown")
+                )
+            )
+            self.assertFalse(os.path.exists(os.path.join(workspaces, "x")))
+
+        store_dir = shared_clone.store_dir
+        loop.run_until_complete(shared_clone.release())
+        self.assertTrue(os.path.exists(store_dir))
+        loop.run_until_complete(shared_clone.release())
+        self.assertFalse(os.path.exists(store_dir))
+
+    def test_shared_clone_bad_ref(self):
+        shared_clone = batch.SharedClone(self.url, ["main", "does-not-exist"])
+        shared_clone.acquire()
+
+        with tempfile.TemporaryDirectory() as workspaces:
+            work_dir = os.path.join(workspaces, "main")
+            self.assertTrue(
+                loop.run_until_complete(shared_clone.checkout(work_dir, "main"))
+            )
+            self.assertEqual(read_file(work_dir, "pom.xml"), "main 2")
+            self.assertFalse(
+                loop.run_until_complete(
+                    shared_clone.checkout(
+                        os.path.join(workspaces, "bad"), "does-not-exist"
+                    )
+                )
+            )
+
+        loop.run_until_complete(shared_clone.release())
+
+    def test_create_shared_clones(self):
+        class RepoUrls:
+            def __init__(self, url):
+                self.readwrite = url
+                self.readonly = url
+
+        async def repo_provider(spec, create=True):
+            return RepoUrls(spec["internal_url"]["readwrite"])
+
+        specs = [
+            {"ref": "main", "internal_url": {"readwrite": self.url}},
+            {
+                "ref": "main",
+                "internal_url": {"readwrite": self.url},
+                "originRepoUrl": "https://example.com/repo.git",
+                "sync": True,
+            },
+            {"ref": "other", "internal_url": {"readwrite": self.url}},
+            {"ref": "main", "internal_url": {"readwrite": "file:///elsewhere"}},
+        ]
+
+        shared_clones = loop.run_until_complete(
+            batch.create_shared_clones(specs, repo_provider)
+        )
+
+        self.assertIsNone(shared_clones[1])
+        self.assertIs(shared_clones[0], shared_clones[2])
+        self.assertEqual(shared_clones[0].refs, ["main", "other"])
+        self.assertEqual(shared_clones[0].users, 2)
+        self.assertEqual(shared_clones[3].refs, ["main"])
+        self.assertEqual(shared_clones[3].users, 1)
+
+    def test_create_shared_clones_bad_spec(self):
+        class RepoUrls:
+            def __init__(self, url):
+                self.readwrite = url
+                self.readonly = url
+
+        async def repo_provider(spec, create=True):
+            if spec["ref"] == "bad":
+                raise Exception("No internal repository")
+            return RepoUrls(self.url)
+
+        specs = [
+            {"ref": "main"},
+            {"ref": "bad"},
+            {"ref": "other"},
+        ]
+
+        shared_clones = loop.run_until_complete(
+            batch.create_shared_clones(specs, repo_provider)
+        )
+
+        # the bad spec clones on its own, the other specs still share their clone
+        self.assertIsNone(shared_clones[1])
+        self.assertIs(shared_clones[0], shared_clones[2])
+        self.assertEqual(shared_clones[0].refs, ["main", "other"])
+        self.assertEqual(shared_clones[0].users, 2)
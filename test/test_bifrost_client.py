@@ -0,0 +1,76 @@
+# flake8: noqa
+import asyncio
+import hashlib
+import os
+import tempfile
+import unittest
+from test import util
+
+import aiohttp
+import aiohttp.web
+
+from repour.lib.bifrost import client
+
+loop = asyncio.get_event_loop()
+
+
+class TestSend(unittest.TestCase):
+    uploads = []
+    statuses = []
+
+    @classmethod
+    def setUpClass(cls):
+        async def handler(request):
+            form = await request.post()
+            cls.uploads.append(
+                {
+                    "logfile": bytes(form["logfile"]),
+                    "md5sum": form["md5sum"],
+                    "tag": form["tag"],
+                    "authorization": request.headers["Authorization"],
+                }
+            )
+            return aiohttp.web.Response(status=cls.statuses.pop(0), text="status")
+
+        util.setup_http(
+            cls=cls, loop=loop, routes=[("POST", "/final-log/upload", handler)]
+        )
+
+    @classmethod
+    def tearDownClass(cls):
+        util.teardown_http(cls, loop)
+
+    def setUp(self):
+        self.uploads.clear()
+
+    def test_send(self):
+        content = os.urandom(200000) + "é\n".encode("utf-8")
+        metadata = client.LogMetadata(tag="alignment-log")
+
+        with tempfile.NamedTemporaryFile() as f:
+            f.write(content)
+            f.flush()
+
+            self.statuses.extend([200, 503])
+
+            async def send():
+                async with aiohttp.ClientSession() as session:
+                    status = await client.send(
+                        self.url, f.name, metadata, "token", session=session
+                    )
+                    self.assertEqual(status, 200)
+
+                    with self.assertRaises(Exception) as cm:
+                        await client.send(
+                            self.url, f.name, metadata, "token", session=session
+                        )
+                    self.assertIn("503", str(cm.exception))
+
+            loop.run_until_complete(send())
+
+        self.assertEqual(len(self.uploads), 2)
+        upload = self.uploads[0]
+        self.assertEqual(upload["logfile"], content)
+        self.assertEqual(upload["md5sum"], hashlib.md5(content).hexdigest())
+        self.assertEqual(upload["tag"], "alignment-log")
+        self.assertEqual(upload["authorization"], "Bearer token")
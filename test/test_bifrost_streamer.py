@@ -0,0 +1,146 @@
+# flake8: noqa
+import asyncio
+import hashlib
+import os
+import tempfile
+import unittest
+from test import util
+from unittest import mock
+
+import aiohttp
+import aiohttp.web
+
+from repour.auth import auth_client
+from repour.lib.bifrost import client, streamer
+
+loop = asyncio.get_event_loop()
+
+
+class TestLogStreamer(unittest.TestCase):
+    chunks = []
+    uploads = []
+    chunk_failures = []
+
+    @classmethod
+    def setUpClass(cls):
+        async def chunk_handler(request):
+            form = await request.post()
+            if cls.chunk_failures:
+                return aiohttp.web.Response(status=cls.chunk_failures.pop())
+            cls.chunks.append((int(form["offset"]), bytes(form["logfile"])))
+            return aiohttp.web.Response(text="ok")
+
+        async def upload_handler(request):
+            form = await request.post()
+            cls.uploads.append(
+                (int(form["offset"]), bytes(form["logfile"]), form["md5sum"])
+            )
+            return aiohttp.web.Response(text="ok")
+
+        util.setup_http(
+            cls=cls,
+            loop=loop,
+            routes=[
+                ("POST", streamer.DEFAULT_CHUNK_PATH, chunk_handler),
+                ("POST", "/final-log/upload", upload_handler),
+            ],
+        )
+
+    @classmethod
+    def tearDownClass(cls):
+        util.teardown_http(cls, loop)
+
+    def setUp(self):
+        async def access_token():
+            return "token"
+
+        for target, name, value in [
+            (streamer, "PERIOD_POLL_SLEEP", 0.01),
+            (auth_client, "access_token", access_token),
+        ]:
+            patcher = mock.patch.object(target, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_stream(self):
+        self.addCleanup(streamer.forget_streamed_state, "A")
+        metadata = client.LogMetadata(tag="alignment-log")
+        self.chunk_failures.append(503)
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            log_file = os.path.join(temp_dir, "A.log")
+            open(log_file, "w").close()
+
+            async def run():
+                async with aiohttp.ClientSession() as session:
+                    log_streamer = streamer.LogStreamer(
+                        self.url,
+                        "A",
+                        metadata,
+                        session,
+                        interval=0,
+                        filename=log_file,
+                    )
+                    log_streamer.start()
+
+                    with open(log_file, "a") as f:
+                        f.write("line 1\nline 2\n")
+                        f.flush()
+                        # sent again after the failure
+                        for _ in range(200):
+                            if self.chunks:
+                                break
+                            await asyncio.sleep(0.01)
+
+                        f.write("line 3\nincomplete")
+                        f.flush()
+                        for _ in range(200):
+                            if len(self.chunks) == 2:
+                                break
+                            await asyncio.sleep(0.01)
+
+                    await log_streamer.stop()
+                    self.assertEqual(log_streamer.offset, 21)
+
+                    with open(log_file, "a") as f:
+                        f.write(" line\nlast line\n")
+
+                    offset, md5 = streamer.get_streamed_state("A", log_file, 21)
+                    await client.send(
+                        self.url,
+                        log_file,
+                        metadata,
+                        "token",
+                        session=session,
+                        offset=offset,
+                        md5=md5,
+                    )
+
+            loop.run_until_complete(run())
+
+            with open(log_file, "rb") as f:
+                content = f.read()
+
+        self.assertEqual(self.chunks, [(0, b"line 1\nline 2\n"), (14, b"line 3\n")])
+        self.assertEqual(
+            self.uploads,
+            [
+                (
+                    21,
+                    b"incomplete line\nlast line\n",
+                    hashlib.md5(content).hexdigest(),
+                )
+            ],
+        )
+
+    def test_streamed_state_after_restart(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            log_file = os.path.join(temp_dir, "B.log")
+            with open(log_file, "wb") as f:
+                f.write(b"streamed\nremainder\n")
+
+            offset, md5 = streamer.get_streamed_state("B", log_file, 9)
+
+        self.assertEqual(offset, 9)
+        self.assertEqual(md5.hexdigest(), hashlib.md5(b"streamed\n").hexdigest())
+        self.assertEqual(streamer.get_streamed_state("B", log_file, 0), (0, None))
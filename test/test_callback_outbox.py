@@ -0,0 +1,198 @@
+# flake8: noqa
+import asyncio
+import os
+import tempfile
+import time
+import unittest
+from test import util
+from unittest import mock
+
+import aiohttp.web
+
+from repour.auth import auth_client
+from repour.config import config
+from repour.lib.logs import file_callback_log
+from repour.server import callback_outbox
+
+loop = asyncio.get_event_loop()
+
+MDC = {
+    "userId": "1",
+    "requestContext": "",
+    "processContext": "",
+    "expires": "",
+    "tmp": "",
+    "processContextVariant": "",
+    "trace_id": "",
+    "span_id": "",
+    "traceparent": "",
+}
+
+
+class TestCallbackOutbox(unittest.TestCase):
+    received = []
+    failures = []
+    uploads = []
+    upload_failures = []
+
+    @classmethod
+    def setUpClass(cls):
+        async def handler(request):
+            cls.received.append(await request.json())
+            if cls.failures:
+                return aiohttp.web.Response(status=cls.failures.pop())
+            return aiohttp.web.Response(text="ok")
+
+        async def upload_handler(request):
+            form = await request.post()
+            cls.uploads.append(bytes(form["logfile"]))
+            if cls.upload_failures:
+                return aiohttp.web.Response(status=cls.upload_failures.pop())
+            return aiohttp.web.Response(text="ok")
+
+        util.setup_http(
+            cls=cls,
+            loop=loop,
+            routes=[
+                ("POST", "/callback", handler),
+                ("POST", "/final-log/upload", upload_handler),
+            ],
+        )
+
+    @classmethod
+    def tearDownClass(cls):
+        util.teardown_http(cls, loop)
+
+    def setUp(self):
+        self.received.clear()
+        self.failures.clear()
+        self.uploads.clear()
+        self.upload_failures.clear()
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+        for name, value in [
+            ("PERIOD_SCAN_SLEEP", 0.01),
+            ("get_retry_delay", lambda *a: 0),
+        ]:
+            patcher = mock.patch.object(callback_outbox, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def create_entry(self, callback_id, send_logs_to_bifrost=False):
+        return callback_outbox.create_entry(
+            callback_id,
+            {"url": self.url + "/callback"},
+            {"result": callback_id, "callback": {"status": 200, "id": callback_id}},
+            MDC,
+            "logger",
+            send_logs_to_bifrost=send_logs_to_bifrost,
+            forward_auth=False,
+        )
+
+    def run_outbox(self, outbox, action, expected_count, expected_uploads=0):
+        async def run():
+            outbox.start()
+            try:
+                if action is not None:
+                    await action()
+                for _ in range(500):
+                    if (
+                        len(self.received) >= expected_count
+                        and len(self.uploads) >= expected_uploads
+                        and not os.listdir(outbox.claimed_dir)
+                    ):
+                        break
+                    await asyncio.sleep(0.01)
+            finally:
+                await outbox.stop()
+
+        loop.run_until_complete(run())
+
+    def test_retry(self):
+        outbox = callback_outbox.CallbackOutbox(self.directory.name, max_attempts=3)
+        self.failures.extend([503, 500])
+
+        self.run_outbox(outbox, lambda: outbox.put(self.create_entry("A")), 3)
+
+        self.assertEqual([r["result"] for r in self.received], ["A", "A", "A"])
+        self.assertEqual(os.listdir(outbox.pending_dir), [])
+        self.assertEqual(os.listdir(outbox.claimed_dir), [])
+
+    def test_give_up(self):
+        outbox = callback_outbox.CallbackOutbox(self.directory.name, max_attempts=2)
+        self.failures.extend([500, 500, 500])
+
+        self.run_outbox(outbox, lambda: outbox.put(self.create_entry("A")), 2)
+
+        self.assertEqual(len(self.received), 2)
+        self.assertEqual(os.listdir(outbox.pending_dir), [])
+
+    def test_restart(self):
+        outbox = callback_outbox.CallbackOutbox(self.directory.name)
+        os.makedirs(outbox.pending_dir)
+        os.makedirs(outbox.claimed_dir)
+
+        # left over by a previous run: one waiting for its retry, one claimed by a
+        # replica that died while sending it
+        pending = self.create_entry("A")
+        callback_outbox.write_entry(
+            pending,
+            os.path.join(
+                outbox.pending_dir, callback_outbox.get_entry_name(pending, 0)
+            ),
+        )
+        claimed = self.create_entry("B")
+        claimed_path = os.path.join(
+            outbox.claimed_dir, callback_outbox.get_entry_name(claimed, 0)
+        )
+        callback_outbox.write_entry(claimed, claimed_path)
+        claim_time = time.time() - callback_outbox.CLAIM_TIMEOUT_SECONDS - 1
+        os.utime(claimed_path, (claim_time, claim_time))
+
+        # not due yet
+        later = self.create_entry("C")
+        callback_outbox.write_entry(
+            later,
+            os.path.join(
+                outbox.pending_dir,
+                callback_outbox.get_entry_name(later, time.time() + 3600),
+            ),
+        )
+
+        self.run_outbox(outbox, None, 2)
+
+        self.assertEqual(sorted(r["result"] for r in self.received), ["A", "B"])
+        self.assertEqual(len(os.listdir(outbox.pending_dir)), 1)
+
+    def test_logs_retried_in_background(self):
+        outbox = callback_outbox.CallbackOutbox(self.directory.name)
+        self.upload_failures.append(503)
+
+        async def get_configuration():
+            return {"bifrost_url": self.url}
+
+        async def access_token():
+            return "token"
+
+        with tempfile.TemporaryDirectory() as logs_dir, mock.patch.object(
+            file_callback_log, "CALLBACK_LOGS_PATH", logs_dir
+        ), mock.patch.object(
+            config, "get_configuration", get_configuration
+        ), mock.patch.object(
+            auth_client, "access_token", access_token
+        ):
+            with open(file_callback_log.get_callback_log_path("A"), "w") as f:
+                f.write("some logs\n")
+
+            self.run_outbox(
+                outbox,
+                lambda: outbox.put(self.create_entry("A", send_logs_to_bifrost=True)),
+                1,
+                expected_uploads=2,
+            )
+
+        # the result was not held back by the failed upload
+        self.assertEqual([r["result"] for r in self.received], ["A"])
+        self.assertEqual(self.uploads, [b"some logs\n", b"some logs\n"])
+        self.assertEqual(os.listdir(outbox.pending_dir), [])
@@ -0,0 +1,201 @@
+# flake8: noqa
+import asyncio
+import os
+import struct
+import tempfile
+import time
+import unittest
+from test import util
+from unittest import mock
+
+from repour.lib.io import inotify
+from repour.lib.logs import file_callback_log
+from repour.server import task_registry
+from repour.server.endpoint import cancel
+
+loop = asyncio.get_event_loop()
+
+
+async def start_task(task_id):
+    task_info = task_registry.TaskInfo(
+        "callback-" + task_id, "/adjust", task_id=task_id
+    )
+    task_info.task = loop.create_task(asyncio.sleep(60))
+    task_registry.registry.add(task_info)
+    task_info.task.add_done_callback(
+        lambda task: task_registry.registry.remove(task_info)
+    )
+    # let the task start
+    await asyncio.sleep(0)
+    return task_info.task
+
+
+class TestCancelIndicators(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def run_indicators(self, indicators, coro):
+        async def run():
+            runner = loop.create_task(indicators.run())
+            try:
+                return await coro
+            finally:
+                runner.cancel()
+                await asyncio.gather(runner, return_exceptions=True)
+
+        return loop.run_until_complete(run())
+
+    def check_cancel(self, indicators):
+        async def run():
+            task = await start_task("indicator-task")
+            start = time.monotonic()
+            cancelled = await indicators.request_cancel("indicator-task")
+            elapsed = time.monotonic() - start
+            await asyncio.gather(task, return_exceptions=True)
+            return cancelled, elapsed, task.cancelled()
+
+        cancelled, elapsed, task_cancelled = self.run_indicators(indicators, run())
+
+        self.assertTrue(cancelled)
+        self.assertTrue(task_cancelled)
+        self.assertLess(elapsed, cancel.CANCEL_WAIT_SECONDS)
+        self.assertEqual(os.listdir(self.directory.name), [])
+        self.assertEqual(indicators.waiters, {})
+
+    def test_cancel_watched(self):
+        indicators = cancel.CancelIndicators(directory=self.directory.name)
+
+        async def watching():
+            await asyncio.sleep(0.1)
+            return indicators.watch is not None
+
+        if not self.run_indicators(indicators, watching()):
+            self.skipTest("inotify not available")
+
+        self.check_cancel(cancel.CancelIndicators(directory=self.directory.name))
+
+    def test_watch_only_local_filesystems(self):
+        async def watching(indicators):
+            await asyncio.sleep(0.1)
+            return indicators.watch is not None
+
+        with mock.patch.object(
+            file_callback_log, "get_filesystem_type", lambda path: "ceph"
+        ):
+            indicators = cancel.CancelIndicators(directory=self.directory.name)
+            self.assertFalse(self.run_indicators(indicators, watching(indicators)))
+
+            forced = cancel.CancelIndicators(directory=self.directory.name, watch=True)
+            if not self.run_indicators(forced, watching(forced)):
+                self.skipTest("inotify not available")
+
+    def test_cancel_polled(self):
+        indicators = cancel.CancelIndicators(
+            directory=self.directory.name, min_interval=0.05, watch=False
+        )
+        self.check_cancel(indicators)
+
+    def test_not_found(self):
+        indicators = cancel.CancelIndicators(
+            directory=self.directory.name, min_interval=0.05, watch=False
+        )
+
+        cancelled = self.run_indicators(
+            indicators, indicators.request_cancel("missing", timeout=0.3)
+        )
+
+        self.assertFalse(cancelled)
+        self.assertEqual(os.listdir(self.directory.name), [])
+        self.assertEqual(indicators.waiters, {})
+
+    def test_scan_cleans_up_old_indicators(self):
+        indicators = cancel.CancelIndicators(directory=self.directory.name)
+        cancel.create_indicator(indicators.get_path("other-task"))
+
+        with mock.patch.object(cancel, "remove_old_cancel_indicator_files") as cleanup:
+            task_ids = loop.run_until_complete(indicators.scan())
+
+        self.assertIn("other-task", task_ids)
+        cleanup.assert_called_once_with(self.directory.name)
+        self.assertIsNotNone(indicators.last_cleanup)
+
+    def test_polling_backs_off(self):
+        indicators = cancel.CancelIndicators(
+            directory=self.directory.name,
+            min_interval=0.01,
+            max_interval=0.04,
+            watch=False,
+        )
+        scans = []
+
+        async def scan():
+            scans.append(time.monotonic())
+            return set()
+
+        indicators.scan = scan
+        self.run_indicators(indicators, asyncio.sleep(0.5))
+
+        intervals = [b - a for a, b in zip(scans, scans[1:])]
+        self.assertLess(intervals[0], 0.035)
+        self.assertGreater(intervals[-1], 0.035)
+
+
+class TestPeers(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        util.setup_http(
+            cls=cls,
+            loop=loop,
+            routes=[("POST", "/cancel/{task_id}/local", cancel.handle_cancel_local)],
+        )
+
+    @classmethod
+    def tearDownClass(cls):
+        util.teardown_http(cls, loop)
+
+    def test_cancel_on_peers(self):
+        async def run():
+            task = await start_task("peer-task")
+            unreachable = "http://localhost:1"
+
+            missing = await cancel.cancel_on_peers("missing", [unreachable, self.url])
+            cancelled = await cancel.cancel_on_peers(
+                "peer-task", [unreachable, self.url]
+            )
+            await asyncio.gather(task, return_exceptions=True)
+            return missing, cancelled, task.cancelled()
+
+        missing, cancelled, task_cancelled = loop.run_until_complete(run())
+
+        self.assertFalse(missing)
+        self.assertTrue(cancelled)
+        self.assertTrue(task_cancelled)
+
+    def test_peer_urls(self):
+        configuration = {
+            "cancel": {
+                "peers": ["http://repour-0:7331/", "http://repour-1:7331"],
+                "peers_dns": "localhost",
+                "peers_port": 8080,
+            }
+        }
+
+        urls = loop.run_until_complete(cancel.get_peer_urls(configuration))
+
+        self.assertIn("http://repour-0:7331", urls)
+        self.assertIn("http://repour-1:7331", urls)
+        self.assertIn("http://127.0.0.1:8080", urls)
+
+
+class TestInotify(unittest.TestCase):
+    def test_parse_events(self):
+        data = struct.pack("iIII", 1, inotify.IN_CREATE, 0, 16) + b"a.cancel".ljust(
+            16, b"\0"
+        )
+        data += struct.pack("iIII", 1, inotify.IN_Q_OVERFLOW, 0, 0)
+
+        self.assertEqual(
+            inotify.parse_events(data),
+            [(inotify.IN_CREATE, "a.cancel"), (inotify.IN_Q_OVERFLOW, "")],
+        )
@@ -0,0 +1,82 @@
+# flake8: noqa
+import asyncio
+import os
+import socket
+import tempfile
+import unittest
+from unittest import mock
+
+from repour import asutil, exception
+from repour.config import config
+from repour.lib.scm import connection_reuse
+
+loop = asyncio.get_event_loop()
+
+expect_ok = asutil.expect_ok_closure(exception.CommandError)
+
+
+class TestConnectionReuse(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = os.path.join(directory.name, "connections")
+        self.configuration = {
+            "git_connection_reuse": {
+                "enabled": True,
+                "directory": self.directory,
+                "persist_seconds": 30,
+            }
+        }
+
+    def test_git_env(self):
+        self.assertEqual(connection_reuse.get_git_env({}), {})
+
+        env = connection_reuse.get_git_env(
+            self.configuration,
+            {"GIT_SSH_COMMAND": "ssh -i key", "GIT_CONFIG_COUNT": "1"},
+        )
+
+        self.assertEqual(
+            env["GIT_SSH_COMMAND"],
+            "ssh -i key -o ControlMaster=auto -o ControlPath={}/%C -o ControlPersist=30".format(
+                self.directory
+            ),
+        )
+        self.assertEqual(env["GIT_CONFIG_COUNT"], "2")
+        self.assertEqual(env["GIT_CONFIG_KEY_1"], "credential.helper")
+        self.assertEqual(
+            env["GIT_CONFIG_VALUE_1"],
+            "cache --timeout=30 --socket={}/credential-cache".format(self.directory),
+        )
+        self.assertTrue(os.path.isdir(self.directory))
+
+    def test_remove_stale_sockets(self):
+        os.makedirs(self.directory)
+        live = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.addCleanup(live.close)
+        live.bind(os.path.join(self.directory, "live"))
+        live.listen()
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as stale:
+            stale.bind(os.path.join(self.directory, "stale"))
+        with open(os.path.join(self.directory, "file"), "w") as f:
+            f.write("not a socket")
+
+        connection_reuse.remove_stale_sockets(self.directory)
+
+        self.assertEqual(sorted(os.listdir(self.directory)), ["file", "live"])
+
+    def test_git_commands(self):
+        with mock.patch.object(
+            config, "get_configuration_sync", lambda: self.configuration
+        ):
+            helpers = loop.run_until_complete(
+                expect_ok(
+                    cmd=["git", "config", "--get-all", "credential.helper"],
+                    stdout="lines",
+                )
+            )
+
+        self.assertIn(
+            "cache --timeout=30 --socket={}/credential-cache".format(self.directory),
+            helpers,
+        )
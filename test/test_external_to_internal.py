@@ -2,7 +2,10 @@
 import asyncio
 import unittest
 
+import voluptuous
+
 from repour.config import config
+from repour.server.endpoint import validation
 import repour.server.endpoint.external_to_internal as external_to_internal
 
 loop = asyncio.get_event_loop()
@@ -42,3 +45,40 @@ class TestExternalToInternal(unittest.TestCase):
                     loop.run_until_complete(
                         external_to_internal.translate_external_to_internal(external)
                     )
+
+    def test_translate_batch(self):
+        c = loop.run_until_complete(config.get_configuration())
+        git_server = c.get(c.get("git_backend")).get("git_url_internal_template")
+        urls = [
+            "https://github.com/myproject/myrepo.git",
+            "git@github.com:myproject/other.git",
+            "sh://github.com/myproject/myrepo.git",
+        ]
+
+        external_to_internal.translate_url.cache_clear()
+        result = loop.run_until_complete(
+            external_to_internal.translate_batch({"external_urls": urls}, None)
+        )
+        result_again = loop.run_until_complete(
+            external_to_internal.translate_batch({"external_urls": urls}, None)
+        )
+
+        self.assertEqual(
+            result["internal_urls"],
+            {
+                urls[0]: f"{git_server}/myproject/myrepo.git",
+                urls[1]: f"{git_server}/myproject/other.git",
+            },
+        )
+        self.assertEqual(list(result["errors"]), [urls[2]])
+        self.assertEqual(result_again, result)
+        # the translations of the second batch are cached, the errors are not
+        self.assertEqual(external_to_internal.translate_url.cache_info().hits, 2)
+
+    def test_batch_size_limited(self):
+        urls = ["https://github.com/project/repo{}.git".format(i) for i in range(2)]
+        validation.external_to_internal_batch({"external_urls": urls})
+
+        urls = urls * (validation.MAX_EXTERNAL_URLS_PER_BATCH // 2 + 1)
+        with self.assertRaises(voluptuous.MultipleInvalid):
+            validation.external_to_internal_batch({"external_urls": urls})
@@ -0,0 +1,31 @@
+# flake8: noqa
+import json
+import unittest
+
+from repour.lib.io import fast_json
+
+
+class TestFastJson(unittest.TestCase):
+    obj = {"name": "é", "list": [1, 2.5, None, True], 3: {"nested": "value"}}
+
+    def check(self):
+        data = fast_json.dumps(self.obj)
+
+        self.assertIsInstance(data, bytes)
+        self.assertIn("é".encode("utf-8"), data)
+        self.assertEqual(fast_json.loads(data), json.loads(json.dumps(self.obj)))
+        self.assertEqual(fast_json.loads(data.decode("utf-8"))["name"], "é")
+        self.assertEqual(fast_json.dumps(2**70), b"1180591620717411303424")
+
+        with self.assertRaises(ValueError):
+            fast_json.loads(b"{not json")
+
+    def test_default(self):
+        self.check()
+
+    def test_stdlib(self):
+        orjson = fast_json.orjson
+        fast_json.orjson = None
+        self.addCleanup(setattr, fast_json, "orjson", orjson)
+
+        self.check()
@@ -0,0 +1,117 @@
+# flake8: noqa
+import asyncio
+import logging
+import os
+import tempfile
+import unittest
+
+from repour.lib.logs import file_callback_log
+
+loop = asyncio.new_event_loop()
+asyncio.set_event_loop(loop)
+
+
+class TestFileCallbackHandler(unittest.TestCase):
+    def setUp(self):
+        self.shared_dir = tempfile.TemporaryDirectory()
+        self.local_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.shared_dir.cleanup)
+        self.addCleanup(self.local_dir.cleanup)
+
+        self.logger = logging.getLogger("test_file_callback_log")
+        self.logger.propagate = False
+        self.logger.setLevel(logging.INFO)
+
+    def create_handler(self, **kwargs):
+        handler = file_callback_log.FileCallbackHandler(
+            directory=self.shared_dir.name, **kwargs
+        )
+        handler.setFormatter(logging.Formatter("{message}", style="{"))
+        self.logger.addHandler(handler)
+        self.addCleanup(handler.close)
+        self.addCleanup(self.logger.removeHandler, handler)
+        return handler
+
+    def log(self, callback_id, lines):
+        async def run():
+            asyncio.current_task().callback_id = callback_id
+            for line in lines:
+                self.logger.info(line)
+
+        loop.run_until_complete(run())
+
+    def read(self, directory, callback_id):
+        with open(os.path.join(directory, callback_id + ".log"), "r") as f:
+            return f.read()
+
+    def test_buffered_writes(self):
+        # fewer handles than callbacks
+        handler = self.create_handler(max_open_files=2)
+
+        for i in range(3):
+            self.log("A", ["a{}".format(i)])
+            self.log("B", ["b{}".format(i)])
+            self.log("C", ["c{}".format(i)])
+
+        handler.writer.finalize("A").result()
+        self.assertEqual(self.read(self.shared_dir.name, "A"), "a0\na1\na2\n")
+
+        handler.writer.flush().result()
+        self.assertEqual(self.read(self.shared_dir.name, "B"), "b0\nb1\nb2\n")
+        self.assertEqual(self.read(self.shared_dir.name, "C"), "c0\nc1\nc2\n")
+
+    def test_no_callback(self):
+        handler = self.create_handler()
+        self.logger.info("outside of any task")
+        handler.writer.flush().result()
+        self.assertEqual(os.listdir(self.shared_dir.name), [])
+
+    def test_local_first(self):
+        handler = self.create_handler(local_directory=self.local_dir.name)
+
+        self.log("A", ["first", "second"])
+        handler.writer.flush().result()
+        self.assertEqual(self.read(self.local_dir.name, "A"), "first\nsecond\n")
+        self.assertFalse(os.path.exists(os.path.join(self.shared_dir.name, "A.log")))
+
+        handler.writer.finalize("A").result()
+        self.assertEqual(os.listdir(self.local_dir.name), [])
+        self.assertEqual(self.read(self.shared_dir.name, "A"), "first\nsecond\n")
+
+        # logged after the end of the request
+        self.log("A", ["late"])
+        handler.writer.finalize("A").result()
+        self.assertEqual(self.read(self.shared_dir.name, "A"), "first\nsecond\nlate\n")
+
+
+class TestFilesystemType(unittest.TestCase):
+    def test_filesystem_type(self):
+        mounts = """overlay / overlay rw 0 0
+server:/export /mnt/shared nfs4 rw 0 0
+//host/share /mnt/shared/cifs\\040dir cifs rw 0 0
+tmpfs /mnt/shared-tmp tmpfs rw 0 0
+"""
+        with tempfile.NamedTemporaryFile("w") as f:
+            f.write(mounts)
+            f.flush()
+
+            def fs_type(path):
+                return file_callback_log.get_filesystem_type(path, mounts_file=f.name)
+
+            self.assertEqual(fs_type("/mnt/shared/repour-logs-callback"), "nfs4")
+            self.assertEqual(fs_type("/mnt/shared"), "nfs4")
+            self.assertEqual(fs_type("/mnt/shared/cifs dir/logs"), "cifs")
+            self.assertEqual(fs_type("/mnt/shared-tmp/logs"), "tmpfs")
+            self.assertEqual(fs_type("/var/tmp"), "overlay")
+
+    def test_max_open_files(self):
+        self.assertEqual(file_callback_log.get_max_open_files({}), 20)
+        self.assertEqual(
+            file_callback_log.get_max_open_files({"job_queue": {"capacity": 50}}), 50
+        )
+        self.assertEqual(
+            file_callback_log.get_max_open_files(
+                {"job_queue": {"concurrency": {"adjust": 16, "clone": 8}}}
+            ),
+            24,
+        )
@@ -0,0 +1,149 @@
+# flake8: noqa
+import asyncio
+import unittest
+from unittest import mock
+
+import asyncssh
+
+from repour.config import config
+from repour.lib.scm import gerrit
+from repour.server.endpoint import internal_scm_gerrit
+
+loop = asyncio.get_event_loop()
+
+PORT = 51855
+
+
+class FakeGerrit(object):
+    """
+    SSH server running the 'gerrit create-project' commands without authentication
+    """
+
+    def __init__(self):
+        self.projects = set()
+        self.connections = []
+        # sessions to refuse, as Gerrit does past the session limit of the user
+        self.refused_sessions = 0
+        self.running = 0
+        self.max_running = 0
+        self.server = None
+
+    async def start(self):
+        fake = self
+
+        class Server(asyncssh.SSHServer):
+            def connection_made(self, connection):
+                fake.connections.append(connection)
+
+            def begin_auth(self, username):
+                return False
+
+            def session_requested(self):
+                if fake.refused_sessions > 0:
+                    fake.refused_sessions -= 1
+                    return False
+                return asyncssh.SSHServerProcess(fake.handle_process, None, 0, False)
+
+        self.server = await asyncssh.create_server(
+            Server,
+            "localhost",
+            PORT,
+            server_host_keys=[asyncssh.generate_private_key("ssh-ed25519")],
+        )
+
+    async def handle_process(self, process):
+        self.running += 1
+        self.max_running = max(self.max_running, self.running)
+        try:
+            await asyncio.sleep(0.05)
+            project = process.command.split("'")[1]
+            if project in self.projects:
+                process.stderr.write("fatal: Project already exists\n")
+                process.exit(1)
+            else:
+                self.projects.add(project)
+                process.exit(0)
+        finally:
+            self.running -= 1
+
+    async def stop(self):
+        self.server.close()
+        await self.server.wait_closed()
+
+
+class TestGerrit(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.fake = FakeGerrit()
+        loop.run_until_complete(cls.fake.start())
+
+    @classmethod
+    def tearDownClass(cls):
+        loop.run_until_complete(gerrit.close_pools())
+        loop.run_until_complete(cls.fake.stop())
+
+    def setUp(self):
+        loop.run_until_complete(gerrit.close_pools())
+        self.fake.connections.clear()
+        self.fake.refused_sessions = 0
+        self.fake.max_running = 0
+
+        self.gerrit_config = {
+            "hostname": "localhost",
+            "port": PORT,
+            "username": "repour",
+            "max_channels": 2,
+            "read_only_template": "https://gerrit/{REPO_NAME}.git",
+            "read_write_template": "git+ssh://gerrit/{REPO_NAME}.git",
+        }
+
+    def internal_scm(self, projects):
+        async def get_configuration():
+            return {"gerrit": self.gerrit_config}
+
+        async def run():
+            return await asyncio.gather(
+                *[
+                    internal_scm_gerrit.internal_scm_gerrit(
+                        {"project": project, "owner_groups": []}, None
+                    )
+                    for project in projects
+                ]
+            )
+
+        with mock.patch.object(config, "get_configuration", get_configuration):
+            return loop.run_until_complete(run())
+
+    def test_shared_connection(self):
+        results = self.internal_scm(["a/one", "a/two", "a/three", "a/one"])
+
+        self.assertEqual(
+            sorted(result["status"] for result in results),
+            ["SUCCESS_ALREADY_EXISTS"] + ["SUCCESS_CREATED"] * 3,
+        )
+        self.assertEqual(results[1]["readwrite_url"], "git+ssh://gerrit/a/two.git")
+        self.assertEqual(len(self.fake.connections), 1)
+        self.assertEqual(self.fake.max_running, 2)
+
+    def test_reconnect(self):
+        self.internal_scm(["b/one"])
+        # closed by the server, or lost
+        self.fake.connections[0].close()
+        loop.run_until_complete(asyncio.sleep(0.1))
+
+        results = self.internal_scm(["b/two"])
+
+        self.assertEqual(results[0]["status"], "SUCCESS_CREATED")
+        self.assertEqual(len(self.fake.connections), 2)
+
+    def test_channel_refused(self):
+        self.fake.refused_sessions = 1
+
+        with mock.patch.object(gerrit, "CHANNEL_RETRY_DELAY_SECONDS", 0):
+            results = self.internal_scm(["c/one", "c/two"])
+
+        # the connection shared with the other command is kept
+        self.assertEqual(
+            [result["status"] for result in results], ["SUCCESS_CREATED"] * 2
+        )
+        self.assertEqual(len(self.fake.connections), 1)
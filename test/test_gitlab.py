@@ -0,0 +1,313 @@
+# flake8: noqa
+import asyncio
+import os
+import tempfile
+import unittest
+from test import util
+from unittest import mock
+
+import aiohttp.web
+
+from repour.config import config
+from repour.lib.scm import gitlab
+from repour.server.endpoint import internal_scm_gitlab
+
+loop = asyncio.get_event_loop()
+
+
+class FakeGitLab(object):
+    """
+    The few endpoints of the GitLab API used by Repour
+    """
+
+    def __init__(self):
+        self.groups = {1: {"id": 1, "name": "workspace", "path": "workspace"}}
+        # id -> parent id
+        self.parents = {}
+        # casefolded full path -> project, the paths are case insensitive
+        self.projects = {}
+        self.protected_tags = {}
+        self.tokens = []
+        self.running = 0
+        self.max_running = 0
+        self.delay = 0
+
+    def routes(self):
+        return [
+            ("GET", "/api/v4/groups/{id}", self.get_group),
+            ("GET", "/api/v4/groups/{id}/subgroups", self.get_subgroups),
+            ("POST", "/api/v4/groups", self.create_group),
+            (
+                "GET",
+                r"/api/v4/projects/{id:\d+}/protected_tags",
+                self.get_protected_tags,
+            ),
+            (
+                "POST",
+                r"/api/v4/projects/{id:\d+}/protected_tags",
+                self.create_protected_tag,
+            ),
+            ("GET", "/api/v4/projects/{path:.+}", self.get_project),
+            ("POST", "/api/v4/projects", self.create_project),
+        ]
+
+    async def enter(self, request):
+        self.tokens.append(request.headers.get("PRIVATE-TOKEN"))
+        self.running += 1
+        self.max_running = max(self.max_running, self.running)
+        try:
+            await asyncio.sleep(self.delay)
+        finally:
+            self.running -= 1
+
+    def page(self, request, items):
+        page = int(request.query.get("page", "1"))
+        per_page = int(request.query.get("per_page", "20"))
+        response = aiohttp.web.json_response(
+            items[(page - 1) * per_page : page * per_page]
+        )
+        response.headers["X-Next-Page"] = (
+            str(page + 1) if page * per_page < len(items) else ""
+        )
+        return response
+
+    def get_path(self, group_id):
+        path = self.groups[group_id]["path"]
+        if group_id in self.parents:
+            path = self.get_path(self.parents[group_id]) + "/" + path
+        return path
+
+    async def get_group(self, request):
+        await self.enter(request)
+        group = self.groups.get(int(request.match_info["id"]))
+        if group is None:
+            return aiohttp.web.json_response({"message": "404 Not found"}, status=404)
+        return aiohttp.web.json_response(group)
+
+    async def get_subgroups(self, request):
+        await self.enter(request)
+        parent_id = int(request.match_info["id"])
+        search = request.query.get("search", "").casefold()
+        subgroups = [
+            self.groups[i]
+            for i, parent in self.parents.items()
+            if parent == parent_id and search in self.groups[i]["name"].casefold()
+        ]
+        return self.page(request, subgroups)
+
+    async def create_group(self, request):
+        await self.enter(request)
+        data = await request.json()
+        group_id = len(self.groups) + 1
+        self.groups[group_id] = {
+            "id": group_id,
+            "name": data["name"],
+            "path": data["path"],
+        }
+        self.parents[group_id] = data["parent_id"]
+        return aiohttp.web.json_response(self.groups[group_id], status=201)
+
+    async def get_project(self, request):
+        await self.enter(request)
+        project = self.projects.get(request.match_info["path"].casefold())
+        if project is None:
+            return aiohttp.web.json_response(
+                {"message": "404 Project Not Found"}, status=404
+            )
+        return aiohttp.web.json_response(project)
+
+    async def create_project(self, request):
+        await self.enter(request)
+        data = await request.json()
+        path = self.get_path(data["namespace_id"]) + "/" + data["name"]
+        if path.casefold() in self.projects:
+            return aiohttp.web.json_response(
+                {"message": {"name": ["has already been taken"]}}, status=400
+            )
+        project = {"id": len(self.projects) + 1, "path_with_namespace": path}
+        self.projects[path.casefold()] = project
+        self.protected_tags[project["id"]] = []
+        return aiohttp.web.json_response(project, status=201)
+
+    async def get_protected_tags(self, request):
+        await self.enter(request)
+        return self.page(request, self.protected_tags[int(request.match_info["id"])])
+
+    async def create_protected_tag(self, request):
+        await self.enter(request)
+        data = await request.json()
+        tag = {
+            "name": data["name"],
+            "create_access_levels": [{"access_level": data["create_access_level"]}],
+        }
+        self.protected_tags[int(request.match_info["id"])].append(tag)
+        return aiohttp.web.json_response(tag, status=201)
+
+
+class TestGitLab(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.fake = FakeGitLab()
+        util.setup_http(cls=cls, loop=loop, routes=cls.fake.routes())
+
+    @classmethod
+    def tearDownClass(cls):
+        loop.run_until_complete(gitlab.close_clients())
+        util.teardown_http(cls, loop)
+
+    def setUp(self):
+        self.fake.__init__()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.token_path = os.path.join(directory.name, "token")
+        self.write_token("token-1")
+
+        self.gitlab_config = {
+            "url": self.url,
+            "token_path": self.token_path,
+            "namespace_id": 1,
+            "read_only_template": "https://gitlab/{REPO_NAME}.git",
+            "read_write_template": "git@gitlab:{REPO_NAME}.git",
+            "protected_tags_pattern": "*-build-*",
+        }
+
+    def write_token(self, token):
+        with open(self.token_path, "w") as f:
+            f.write(token + "\n")
+
+    def internal_scm(self, project):
+        async def get_configuration():
+            return {"gitlab": self.gitlab_config}
+
+        with mock.patch.object(config, "get_configuration", get_configuration):
+            return loop.run_until_complete(
+                internal_scm_gitlab.internal_scm_gitlab({"project": project}, None)
+            )
+
+    def test_internal_scm(self):
+        result = self.internal_scm("Project/Repo")
+
+        self.assertEqual(
+            result,
+            {
+                "status": "SUCCESS_CREATED",
+                "readonly_url": "https://gitlab/Project/Repo.git",
+                "readwrite_url": "git@gitlab:Project/Repo.git",
+            },
+        )
+        project = self.fake.projects["workspace/project/repo"]
+        self.assertEqual(
+            [tag["name"] for tag in self.fake.protected_tags[project["id"]]],
+            ["*-build-*"],
+        )
+
+        # the existing subgroup and project are found
+        result = self.internal_scm("project/Repo")
+
+        self.assertEqual(result["status"], "SUCCESS_ALREADY_EXISTS")
+        self.assertEqual(len(self.fake.groups), 2)
+        self.assertEqual(len(self.fake.protected_tags[project["id"]]), 1)
+
+    def test_subgroup_exact_match(self):
+        gl = gitlab.client(self.gitlab_config)
+
+        async def run():
+            workspace = await gitlab.get_group(gl, 1)
+            first = await gitlab.get_or_create_subgroup(gl, workspace, "Project-A")
+            second = await gitlab.get_or_create_subgroup(gl, workspace, "Project")
+            again = await gitlab.get_or_create_subgroup(gl, workspace, "project")
+            return first, second, again
+
+        first, second, again = loop.run_until_complete(run())
+
+        self.assertNotEqual(first["id"], second["id"])
+        self.assertEqual(second["id"], again["id"])
+
+    def test_missing_group(self):
+        gl = gitlab.client(self.gitlab_config)
+
+        self.assertIsNone(loop.run_until_complete(gitlab.get_group(gl, 42)))
+        self.assertIsNone(
+            loop.run_until_complete(gitlab.get_project(gl, "workspace/missing"))
+        )
+
+    def test_check_protected_tags(self):
+        gl = gitlab.client(self.gitlab_config)
+        self.fake.projects["workspace/repo"] = {"id": 7}
+        self.fake.protected_tags[7] = [{"name": "tag-{}".format(i)} for i in range(150)]
+
+        async def check():
+            return await gitlab.check_protected_tags(
+                self.gitlab_config, gl=gl, project_path="workspace/repo"
+            )
+
+        self.assertFalse(loop.run_until_complete(check()))
+
+        # on the second page
+        self.fake.protected_tags[7].append({"name": "*-build-*"})
+        self.assertTrue(loop.run_until_complete(check()))
+
+    def test_token_reread_on_change(self):
+        gl = gitlab.client(self.gitlab_config)
+
+        loop.run_until_complete(gitlab.get_project(gl, "workspace/missing"))
+        loop.run_until_complete(gitlab.get_project(gl, "workspace/missing"))
+        self.write_token("token-2")
+        os.utime(self.token_path, (0, 0))
+        loop.run_until_complete(gitlab.get_project(gl, "workspace/missing"))
+
+        self.assertEqual(self.fake.tokens, ["token-1", "token-1", "token-2"])
+
+    def test_connection_limit(self):
+        self.gitlab_config["url"] = self.url + "/"
+        self.gitlab_config["max_connections"] = 2
+        gl = gitlab.client(self.gitlab_config)
+        self.fake.delay = 0.05
+
+        async def run():
+            return await asyncio.gather(*[gitlab.get_group(gl, 1) for _ in range(6)])
+
+        groups = loop.run_until_complete(run())
+
+        self.assertEqual([group["id"] for group in groups], [1] * 6)
+        self.assertEqual(self.fake.max_running, 2)
+
+    def test_metadata_cache(self):
+        self.internal_scm("Project/Repo")
+        requests = len(self.fake.tokens)
+
+        # the group, the subgroup, the project and its protected tags are cached
+        result = self.internal_scm("project/repo")
+        self.assertEqual(result["status"], "SUCCESS_ALREADY_EXISTS")
+        self.assertEqual(len(self.fake.tokens), requests)
+
+        gl = gitlab.client(self.gitlab_config)
+        self.assertTrue(
+            loop.run_until_complete(
+                gitlab.check_protected_tags(
+                    self.gitlab_config, gl=gl, project_path="workspace/Project/Repo"
+                )
+            )
+        )
+        self.assertEqual(len(self.fake.tokens), requests)
+
+        # a project found missing is not cached
+        self.assertIsNone(
+            loop.run_until_complete(gitlab.get_project(gl, "workspace/missing"))
+        )
+        self.assertIsNone(
+            loop.run_until_complete(gitlab.get_project(gl, "workspace/missing"))
+        )
+        self.assertEqual(len(self.fake.tokens), requests + 2)
+
+    def test_metadata_cache_expiry(self):
+        cache = gitlab.MetadataCache(ttl_seconds=60)
+        cache.set("group", "1", {"id": 1})
+        self.assertEqual(cache.get("group", "1"), {"id": 1})
+
+        with mock.patch.object(gitlab.time, "monotonic", return_value=1e12):
+            self.assertIsNone(cache.get("group", "1"))
+
+        disabled = gitlab.MetadataCache(ttl_seconds=0)
+        disabled.set("group", "1", {"id": 1})
+        self.assertIsNone(disabled.get("group", "1"))
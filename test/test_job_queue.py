@@ -0,0 +1,98 @@
+# flake8: noqa
+import asyncio
+import unittest
+from unittest import mock
+
+from repour.server import job_queue
+from repour.server.endpoint import endpoint
+
+loop = asyncio.new_event_loop()
+asyncio.set_event_loop(loop)
+
+
+class TestJobQueue(unittest.TestCase):
+    def test_capacity(self):
+        queue = job_queue.JobQueue(capacity=3, retry_after=12)
+        adjust_jobs = queue.endpoint("adjust")
+
+        jobs = adjust_jobs.admit(2)
+        self.assertEqual(queue.admitted, 2)
+
+        # a batch is admitted as a whole or not at all
+        with self.assertRaises(job_queue.QueueFull) as cm:
+            queue.endpoint("clone").admit(2)
+        self.assertEqual(cm.exception.retry_after, 12)
+        self.assertEqual(queue.admitted, 2)
+
+        jobs[0].release()
+        jobs[0].release()
+        self.assertEqual(queue.admitted, 1)
+        adjust_jobs.admit(2)
+        self.assertEqual(queue.admitted, 3)
+
+    def test_concurrency(self):
+        queue = job_queue.JobQueue(concurrency={"adjust": 2})
+        running = []
+        max_running = []
+
+        async def work():
+            running.append(1)
+            max_running.append(len(running))
+            await asyncio.sleep(0.01)
+            running.pop()
+
+        async def run_all():
+            jobs = queue.endpoint("adjust").admit(5) + queue.endpoint("clone").admit(2)
+            await asyncio.gather(*[job.run(work) for job in jobs])
+
+        loop.run_until_complete(run_all())
+
+        # the clone jobs are not limited by the adjust slots
+        self.assertEqual(max(max_running), 4)
+        self.assertEqual(queue.admitted, 0)
+
+    def test_cancel_waiting(self):
+        queue = job_queue.JobQueue(concurrency={"adjust": 1})
+
+        async def run_all():
+            first, second = queue.endpoint("adjust").admit(2)
+            event = asyncio.Event()
+            first_task = asyncio.ensure_future(first.run(event.wait))
+            second_task = asyncio.ensure_future(second.run(event.wait))
+            await asyncio.sleep(0)
+
+            second_task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await second_task
+            self.assertEqual(queue.admitted, 1)
+
+            event.set()
+            await first_task
+
+        loop.run_until_complete(run_all())
+        self.assertEqual(queue.admitted, 0)
+        self.assertFalse(queue.get_semaphore("adjust").locked())
+
+    def test_release_callback_cancelled_before_running(self):
+        queue = job_queue.JobQueue(capacity=2)
+
+        async def run():
+            (job,) = queue.endpoint("adjust").admit(1)
+            asyncio.current_task().loggerName = "test"
+            request = mock.Mock(app=mock.Mock(loop=loop), headers={})
+            callback_task = endpoint.start_callback_task(
+                request,
+                {"callback": {"url": "http://localhost"}},
+                "callback-id",
+                mock.AsyncMock(),
+                None,
+                False,
+                "log-context",
+                job=job,
+            )
+            # cancelled before running the job, such as by /cancel right after the 202
+            callback_task.cancel()
+            await asyncio.gather(callback_task, return_exceptions=True)
+
+        loop.run_until_complete(run())
+        self.assertEqual(queue.admitted, 0)
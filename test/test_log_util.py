@@ -0,0 +1,63 @@
+# flake8: noqa
+import asyncio
+import copy
+import json
+import logging
+import unittest
+
+from repour import main
+from repour.lib.logs import log_util
+
+loop = asyncio.new_event_loop()
+asyncio.set_event_loop(loop)
+
+
+def create_record():
+    return main.ContextLogRecord("test", logging.INFO, __file__, 1, "msg", (), None)
+
+
+class TestMdc(unittest.TestCase):
+    def test_record_keeps_mdc_at_log_time(self):
+        async def run():
+            log_util.add_update_mdc_key_value_in_task("userId", "user")
+            record = create_record()
+
+            log_util.add_update_mdc_key_value_in_task("userId", "other")
+            log_util.add_update_mdc_key_value_in_task("tmp", "true")
+
+            self.assertEqual(record.mdc, {"userId": "user"})
+            self.assertEqual(create_record().mdc, {"userId": "other", "tmp": "true"})
+
+            log_util.remove_mdc_key_in_task("tmp")
+            log_util.remove_mdc_key_in_task("missing")
+            self.assertEqual(log_util.get_mdc(), {"userId": "other"})
+
+        loop.run_until_complete(run())
+
+    def test_tasks_inherit_mdc(self):
+        async def run():
+            log_util.add_update_mdc_key_value_in_task("userId", "user")
+
+            async def child():
+                log_util.add_update_mdc_key_value_in_task("processContext", "child")
+                return log_util.get_mdc()
+
+            child_mdc = await log_util.create_task_with_log_context(child())
+
+            self.assertEqual(child_mdc, {"userId": "user", "processContext": "child"})
+            self.assertIsNone(log_util.get_mdc_value_in_task("processContext"))
+
+        loop.run_until_complete(run())
+
+    def test_mdc_immutable(self):
+        mdc = log_util.Mdc({"userId": "user"})
+
+        with self.assertRaises(TypeError):
+            mdc["userId"] = "other"
+        with self.assertRaises(TypeError):
+            mdc.update(userId="other")
+        with self.assertRaises(TypeError):
+            del mdc["userId"]
+
+        self.assertIs(copy.copy(mdc), mdc)
+        self.assertEqual(json.loads(json.dumps(mdc)), {"userId": "user"})
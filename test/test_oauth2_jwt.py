@@ -0,0 +1,133 @@
+# flake8: noqa
+import asyncio
+import time
+import unittest
+from unittest import mock
+
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from jose import jwt
+
+from repour.auth import oauth2_jwt
+from repour.config import config
+
+loop = asyncio.get_event_loop()
+
+ISSUER = "https://sso.example.com/auth/realms/pnc"
+
+
+class TestVerifyToken(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+        cls.private_key = key.private_bytes(
+            serialization.Encoding.PEM,
+            serialization.PrivateFormat.PKCS8,
+            serialization.NoEncryption(),
+        ).decode("ascii")
+        cls.public_key = (
+            key.public_key()
+            .public_bytes(
+                serialization.Encoding.PEM,
+                serialization.PublicFormat.SubjectPublicKeyInfo,
+            )
+            .decode("ascii")
+        )
+
+    def setUp(self):
+        self.configuration = {
+            "auth": {
+                "oauth2_jwt": {
+                    "public_key": self.public_key,
+                    "token_issuer": ISSUER,
+                },
+                "allowed_roles": ["pnc-users-admin"],
+            }
+        }
+
+        async def get_configuration():
+            return self.configuration
+
+        patcher = mock.patch.object(config, "get_configuration", get_configuration)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(oauth2_jwt.verified_tokens.clear)
+
+    def create_token(self, roles, expires_in=300):
+        now = int(time.time())
+        return jwt.encode(
+            {
+                "iss": ISSUER,
+                "iat": now,
+                "exp": now + expires_in,
+                "preferred_username": "pnc",
+                "realm_access": {"roles": roles},
+            },
+            self.private_key,
+            algorithm="RS256",
+        )
+
+    def verify(self, token):
+        return loop.run_until_complete(oauth2_jwt.verify_token(token))
+
+    def get_cache_count(self, result):
+        return oauth2_jwt.TOKEN_CACHE_REQUESTS.labels(result)._value.get()
+
+    def test_cached(self):
+        token = self.create_token(["pnc-users-admin"])
+        hits = self.get_cache_count("hit")
+
+        with mock.patch.object(
+            oauth2_jwt.jwt, "decode", wraps=oauth2_jwt.jwt.decode
+        ) as decode:
+            self.assertTrue(self.verify(token))
+            self.assertTrue(self.verify(token))
+            self.assertTrue(self.verify(token))
+
+        self.assertEqual(decode.call_count, 1)
+        self.assertEqual(self.get_cache_count("hit") - hits, 2)
+
+    def test_missing_role_cached(self):
+        token = self.create_token(["pnc-users"])
+
+        self.assertFalse(self.verify(token))
+        self.assertFalse(self.verify(token))
+        self.assertEqual(
+            oauth2_jwt.verified_tokens[oauth2_jwt.get_token_hash(token)]["roles"],
+            ["pnc-users"],
+        )
+
+    def test_invalid_not_cached(self):
+        token = self.create_token(["pnc-users-admin"])
+        tampered = token[:-4] + ("AAAA" if token[-4:] != "AAAA" else "BBBB")
+
+        self.assertFalse(self.verify(tampered))
+        self.assertEqual(len(oauth2_jwt.verified_tokens), 0)
+
+    def test_about_to_expire(self):
+        # within the skew, the signature and expiry are checked again
+        token = self.create_token(
+            ["pnc-users-admin"], expires_in=oauth2_jwt.TOKEN_TIME_SKEW_SECONDS - 10
+        )
+
+        with mock.patch.object(
+            oauth2_jwt.jwt, "decode", wraps=oauth2_jwt.jwt.decode
+        ) as decode:
+            self.assertTrue(self.verify(token))
+            self.assertTrue(self.verify(token))
+
+        self.assertEqual(decode.call_count, 2)
+
+    def test_cached_configuration_changes(self):
+        token = self.create_token(["pnc-users-admin"])
+        self.assertTrue(self.verify(token))
+
+        # the cached roles are checked against the allowed roles of now
+        self.configuration["auth"]["allowed_roles"] = ["pnc-app-repour"]
+        self.assertFalse(self.verify(token))
+        self.configuration["auth"]["allowed_roles"] = ["pnc-users-admin"]
+
+        # the token is verified again with a new issuer
+        self.configuration["auth"]["oauth2_jwt"]["token_issuer"] = ISSUER + "-new"
+        self.assertFalse(self.verify(token))
+        self.assertNotIn(oauth2_jwt.get_token_hash(token), oauth2_jwt.verified_tokens)
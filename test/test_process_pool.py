@@ -0,0 +1,125 @@
+# flake8: noqa
+import asyncio
+import os
+import tempfile
+import time
+import unittest
+
+from repour import exception
+from repour.server import process_pool, task_registry
+from repour.server.endpoint import endpoint
+
+loop = asyncio.get_event_loop()
+
+
+# run in the processes of the pool, which import them from this module
+
+
+async def echo(spec, repo_provider):
+    task_registry.set_phase("ECHO")
+    return {"spec": spec, "pid": os.getpid(), "callback_id": get_callback_id()}
+
+
+async def fail(spec, repo_provider):
+    raise exception.DescribedError("Bad spec")
+
+
+async def sleep(spec, repo_provider):
+    task_registry.set_phase("SLEEP")
+    try:
+        await asyncio.sleep(60)
+    finally:
+        with open(spec["path"], "w") as f:
+            f.write("cancelled")
+
+
+async def exit_process(spec, repo_provider):
+    os._exit(3)
+
+
+def get_callback_id():
+    return getattr(asyncio.current_task(), "callback_id", None)
+
+
+class TestProcessPool(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.pool = process_pool.ProcessPool(
+            1, repo_provider={"type": "modeb", "params": {}}
+        )
+
+    @classmethod
+    def tearDownClass(cls):
+        loop.run_until_complete(cls.pool.stop())
+
+    def call(self, coro, spec, task_info=None):
+        async def run():
+            asyncio.current_task().callback_id = "callback-pool"
+            if task_info is not None:
+                task_registry.current_task_info.set(task_info)
+            return await endpoint.call_in_pool(self.pool, coro, spec)
+
+        return loop.run_until_complete(run())
+
+    def test_result(self):
+        task_info = task_registry.TaskInfo("callback-pool", "/adjust")
+
+        status, obj = self.call(echo, {"ref": "main"}, task_info)
+
+        self.assertEqual(status, 200)
+        self.assertEqual(obj["spec"], {"ref": "main"})
+        self.assertNotEqual(obj["pid"], os.getpid())
+        self.assertEqual(obj["callback_id"], "callback-pool")
+        self.assertEqual(task_info.phase, "ECHO")
+
+    def test_error(self):
+        status, obj = self.call(fail, {})
+
+        self.assertEqual(status, 400)
+        self.assertEqual(obj["error_type"], "DescribedError")
+        self.assertEqual(obj["desc"], "Bad spec")
+
+    def test_cancel(self):
+        task_info = task_registry.TaskInfo("callback-pool", "/adjust")
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = os.path.join(directory.name, "cancelled.txt")
+
+        async def run():
+            task = loop.create_task(
+                endpoint.call_registered(
+                    task_info, None, sleep, {"path": path}, {}, pool=self.pool
+                )
+            )
+            deadline = time.monotonic() + 30
+            while task_info.phase != "SLEEP" and time.monotonic() < deadline:
+                await asyncio.sleep(0.05)
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+            return task.cancelled()
+
+        self.assertTrue(loop.run_until_complete(run()))
+        # the job was cancelled in the process before the task ended
+        with open(path) as f:
+            self.assertEqual(f.read(), "cancelled")
+
+    def test_process_exit(self):
+        status, obj = self.call(exit_process, {})
+
+        self.assertEqual(status, 500)
+        self.assertEqual(obj["error_type"], "ProcessExited")
+
+        # replaced by a new process
+        status, obj = self.call(echo, {})
+        self.assertEqual(status, 200)
+
+    def test_function_path(self):
+        self.assertEqual(
+            process_pool.get_function_path(echo), "test.test_process_pool:echo"
+        )
+
+        async def local(spec):
+            pass
+
+        with self.assertRaises(ValueError):
+            process_pool.get_function_path(local)
@@ -0,0 +1,164 @@
+# flake8: noqa
+import json
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import repour.adjust.result_parser as result_parser
+
+
+class TestExtractJsonFields(unittest.TestCase):
+    def write_json(self, directory, data):
+        path = os.path.join(directory, "result.json")
+        with open(path, "w") as f:
+            f.write(data)
+        return path
+
+    def test_extract_fields(self):
+        data = {
+            "modules": [{"name": 'a "quoted" {brace} [bracket] \\ value'}] * 50,
+            "executionRoot": {
+                "groupId": "org.foo",
+                "artifactId": "bar",
+                "version": "1.0.0.redhat-00001",
+            },
+            "nested": {"deep": [[{"x": 1.5e3}], "\\"]},
+            "number": 1234567890,
+        }
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path = self.write_json(temp_dir, json.dumps(data, indent=2))
+
+            # use a tiny chunk size so that every value crosses a chunk boundary
+            for chunk_size in (1, 3, 7, 65536):
+                with mock.patch.object(result_parser, "READ_CHUNK_SIZE", chunk_size):
+                    result = result_parser.extract_json_fields(
+                        path, ["executionRoot", "number", "missing"]
+                    )
+                self.assertEqual(
+                    result,
+                    {"executionRoot": data["executionRoot"], "number": 1234567890},
+                )
+
+    def test_stops_early(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            # everything after the wanted field is invalid JSON and must not be read
+            path = self.write_json(
+                temp_dir, '{"group": "org.foo", "name": "bar", "version": "1" ,,,'
+            )
+            result = result_parser.extract_json_fields(
+                path, ["group", "name", "version"]
+            )
+            self.assertEqual(
+                result, {"group": "org.foo", "name": "bar", "version": "1"}
+            )
+
+    def test_empty_object(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path = self.write_json(temp_dir, " { } ")
+            self.assertEqual(result_parser.extract_json_fields(path, ["a"]), {})
+
+
+class TestPomParsing(unittest.TestCase):
+    def write_pom(self, directory, content):
+        path = os.path.join(directory, "pom.xml")
+        with open(path, "w") as f:
+            f.write(content)
+        return path
+
+    def test_gav(self):
+        pom = """<?xml version="1.0"?>
+<project xmlns="http://maven.apache.org/POM/4.0.0">
+  <modelVersion>4.0.0</modelVersion>
+  <groupId>org.foo</groupId>
+  <artifactId>bar</artifactId>
+  <version>1.0</version>
+  <dependencies>
+    <dependency>
+      <groupId>org.other</groupId>
+      <artifactId>other</artifactId>
+      <version>2.0</version>
+    </dependency>
+  </dependencies>
+</project>
+"""
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path = self.write_pom(temp_dir, pom)
+            self.assertEqual(
+                result_parser.get_gav_from_pom(path), ("org.foo", "bar", "1.0")
+            )
+
+    def test_gav_from_parent(self):
+        pom = """<project>
+  <parent>
+    <groupId>org.parent</groupId>
+    <artifactId>parent</artifactId>
+    <version>3.0</version>
+  </parent>
+  <artifactId>child</artifactId>
+  <dependencies>
+    <dependency>
+      <groupId>org.other</groupId>
+      <artifactId>other</artifactId>
+      <version>2.0</version>
+    </dependency>
+  </dependencies>
+</project>
+"""
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path = self.write_pom(temp_dir, pom)
+            self.assertEqual(
+                result_parser.get_gav_from_pom(path), ("org.parent", "child", "3.0")
+            )
+
+    def test_gav_missing_artifact_id(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path = self.write_pom(temp_dir, "<project><groupId>a</groupId></project>")
+            with self.assertRaises(Exception):
+                result_parser.get_gav_from_pom(path)
+
+    def test_removed_repos(self):
+        backup = """<?xml version="1.0"?>
+<settings xmlns="http://maven.apache.org/SETTINGS/1.0.0">
+  <profiles>
+    <profile>
+      <repositories>
+        <repository>
+          <id>central</id>
+          <name>Central</name>
+          <url>https://repo.example.com</url>
+          <snapshots>
+            <enabled>false</enabled>
+          </snapshots>
+        </repository>
+        <repository>
+          <id>other</id>
+          <url>https://other.example.com</url>
+        </repository>
+      </repositories>
+    </profile>
+  </profiles>
+</settings>
+"""
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path = self.write_pom(temp_dir, backup)
+            self.assertEqual(
+                result_parser.parse_removed_repos(path),
+                [
+                    {
+                        "releases": True,
+                        "snapshots": False,
+                        "name": "Central",
+                        "id": "central",
+                        "url": "https://repo.example.com",
+                    },
+                    {
+                        "releases": True,
+                        "snapshots": True,
+                        "name": "",
+                        "id": "other",
+                        "url": "https://other.example.com",
+                    },
+                ],
+            )
@@ -0,0 +1,139 @@
+# flake8: noqa
+import asyncio
+import unittest
+from test import util
+
+import aiohttp
+import voluptuous
+
+from repour import asutil
+from repour.server import task_registry
+from repour.server.endpoint import cancel, endpoint, tasks
+
+loop = asyncio.get_event_loop()
+
+
+class TestTaskRegistry(unittest.TestCase):
+    def test_registry(self):
+        registry = task_registry.TaskRegistry()
+        first = task_registry.TaskInfo("a", "/adjust", task_id="1")
+        second = task_registry.TaskInfo("b", "/adjust", task_id="1")
+        other = task_registry.TaskInfo("c", "/clone")
+
+        for info in (first, second, other):
+            registry.add(info)
+
+        self.assertEqual(set(registry.get_by_task_id("1")), {first, second})
+        self.assertEqual(len(registry.list()), 3)
+
+        registry.remove(first)
+        registry.remove(first)
+        self.assertEqual(registry.get_by_task_id("1"), [second])
+
+        registry.remove(second)
+        self.assertEqual(registry.get_by_task_id("1"), [])
+        self.assertEqual(registry.by_task_id, {})
+        self.assertEqual(registry.list(), [other])
+
+    def test_phase_and_pids(self):
+        info = task_registry.TaskInfo("a", "/adjust")
+        expect_ok = asutil.expect_ok_closure()
+
+        async def run():
+            task_registry.current_task_info.set(info)
+            task_registry.set_phase("SCM_CLONE")
+
+            command = loop.create_task(expect_ok(["sleep", "0.2"]))
+            while not info.pids:
+                await asyncio.sleep(0.01)
+            pids = set(info.pids)
+            await command
+
+            task_registry.end_phase("OTHER")
+            phase = info.phase
+            task_registry.end_phase("SCM_CLONE")
+            return pids, phase
+
+        pids, phase = loop.run_until_complete(run())
+
+        self.assertEqual(len(pids), 1)
+        self.assertEqual(phase, "SCM_CLONE")
+        self.assertIsNone(info.phase)
+        self.assertEqual(info.pids, set())
+
+
+class TestTasksEndpoint(unittest.TestCase):
+    started = None
+
+    @classmethod
+    def setUpClass(cls):
+        async def work(spec, **kwargs):
+            task_registry.set_phase("WORK")
+            cls.started.set()
+            await asyncio.sleep(60)
+
+        async def create_handler():
+            return endpoint.validated_json_endpoint(
+                cls.shutdown_callbacks,
+                voluptuous.Schema({"taskId": str, "name": str}),
+                work,
+                "http://localhost",
+            )
+
+        cls.shutdown_callbacks = []
+        util.setup_http(
+            cls=cls,
+            loop=loop,
+            routes=[
+                ("POST", "/work", loop.run_until_complete(create_handler())),
+                ("GET", "/tasks", tasks.handle_tasks),
+                ("POST", "/cancel/{task_id}", cancel.handle_cancel),
+            ],
+        )
+
+    @classmethod
+    def tearDownClass(cls):
+        util.teardown_http(cls, loop)
+        for shutdown_callback in cls.shutdown_callbacks:
+            loop.run_until_complete(shutdown_callback())
+
+    def test_list_and_cancel(self):
+        async def run():
+            TestTasksEndpoint.started = asyncio.Event()
+
+            async with aiohttp.ClientSession() as session:
+
+                async def post_work():
+                    try:
+                        async with session.post(
+                            self.url + "/work", json={"taskId": "t1", "name": "repo"}
+                        ) as resp:
+                            return resp.status
+                    except aiohttp.ClientError:
+                        return None
+
+                work_request = loop.create_task(post_work())
+                await asyncio.wait_for(self.started.wait(), 5)
+
+                async with session.get(self.url + "/tasks") as resp:
+                    listed = await resp.json()
+
+                async with session.post(self.url + "/cancel/t1") as resp:
+                    cancel_status = resp.status
+
+                await work_request
+
+                async with session.get(self.url + "/tasks") as resp:
+                    listed_after = await resp.json()
+
+            return listed, cancel_status, listed_after
+
+        listed, cancel_status, listed_after = loop.run_until_complete(run())
+
+        self.assertEqual(len(listed), 1)
+        self.assertEqual(listed[0]["taskId"], "t1")
+        self.assertEqual(listed[0]["endpoint"], "/work")
+        self.assertEqual(listed[0]["state"], "running")
+        self.assertEqual(listed[0]["phase"], "WORK")
+        self.assertEqual(cancel_status, 200)
+        self.assertEqual(listed_after, [])
@@ -0,0 +1,152 @@
+# flake8: noqa
+import asyncio
+import unittest
+from test import util
+
+import aiohttp
+import voluptuous
+from opentelemetry import trace
+from opentelemetry.sdk.trace import TracerProvider
+from opentelemetry.sdk.trace.export import SimpleSpanProcessor
+from opentelemetry.sdk.trace.export.in_memory_span_exporter import InMemorySpanExporter
+from opentelemetry.trace import SpanKind, StatusCode
+
+from repour import asutil, exception
+from repour.adjust import adjust
+from repour.lib.telemetry import tracing
+from repour.server.endpoint import endpoint
+
+loop = asyncio.get_event_loop()
+
+expect_ok = asutil.expect_ok_closure(exception.CommandError)
+
+exporter = InMemorySpanExporter()
+provider = TracerProvider()
+provider.add_span_processor(SimpleSpanProcessor(exporter))
+trace.set_tracer_provider(provider)
+
+TRACE_ID = "0af7651916cd43dd8448eb211c80319c"
+PARENT_ID = "b7ad6b7169203331"
+
+
+class TestTracing(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        async def work(spec, **kwargs):
+            adjust.process_mdc("BEGIN", "SCM_CLONE")
+            traceparent = await expect_ok(
+                cmd=["sh", "-c", "echo $TRACEPARENT"], stdout="text"
+            )
+            adjust.process_mdc("END", "SCM_CLONE")
+            # left open
+            adjust.process_mdc("BEGIN", "ALIGNMENT_ADJUST")
+            try:
+                await expect_ok(cmd=["git", "no-such-command"])
+            except exception.CommandError:
+                pass
+            return {"traceparent": traceparent.strip()}
+
+        async def create_handler():
+            return endpoint.validated_json_endpoint(
+                cls.shutdown_callbacks,
+                voluptuous.Schema({}),
+                work,
+                "http://localhost",
+            )
+
+        cls.shutdown_callbacks = []
+        util.setup_http(
+            cls=cls,
+            loop=loop,
+            routes=[("POST", "/work", loop.run_until_complete(create_handler()))],
+            middlewares=[tracing.middleware],
+        )
+
+    @classmethod
+    def tearDownClass(cls):
+        util.teardown_http(cls, loop)
+        for shutdown_callback in cls.shutdown_callbacks:
+            loop.run_until_complete(shutdown_callback())
+
+    def setUp(self):
+        exporter.clear()
+
+    def post_work(self, headers):
+        async def post():
+            async with aiohttp.ClientSession() as session:
+                async with session.post(
+                    self.url + "/work", json={}, headers=headers
+                ) as resp:
+                    return resp.status, await resp.json()
+
+        return loop.run_until_complete(post())
+
+    def test_spans(self):
+        status, obj = self.post_work(
+            {"traceparent": "00-{}-{}-01".format(TRACE_ID, PARENT_ID)}
+        )
+        self.assertEqual(status, 200)
+
+        spans = {span.name: span for span in exporter.get_finished_spans()}
+        self.assertEqual(
+            set(spans),
+            {
+                "POST /work",
+                "job /work",
+                "SCM_CLONE",
+                "ALIGNMENT_ADJUST",
+                "exec sh",
+                "exec git no-such-command",
+            },
+        )
+        for span in spans.values():
+            self.assertEqual(
+                trace.format_trace_id(span.context.trace_id), TRACE_ID, span.name
+            )
+
+        server = spans["POST /work"]
+        self.assertEqual(server.kind, SpanKind.SERVER)
+        self.assertEqual(trace.format_span_id(server.parent.span_id), PARENT_ID)
+        self.assertEqual(server.attributes["http.response.status_code"], 200)
+
+        def assert_parent(name, parent_name):
+            self.assertEqual(
+                spans[name].parent.span_id, spans[parent_name].context.span_id, name
+            )
+
+        assert_parent("job /work", "POST /work")
+        assert_parent("SCM_CLONE", "job /work")
+        assert_parent("exec sh", "SCM_CLONE")
+        assert_parent("ALIGNMENT_ADJUST", "job /work")
+        assert_parent("exec git no-such-command", "ALIGNMENT_ADJUST")
+
+        # the command continues the trace from its span
+        self.assertEqual(
+            obj["traceparent"],
+            "00-{}-{}-01".format(
+                TRACE_ID, trace.format_span_id(spans["exec sh"].context.span_id)
+            ),
+        )
+        self.assertEqual(
+            spans["exec sh"].attributes["process.command_args"],
+            ("sh", "-c", "echo $TRACEPARENT"),
+        )
+        self.assertEqual(spans["exec sh"].attributes["process.exit.code"], 0)
+
+        self.assertEqual(
+            spans["exec git no-such-command"].status.status_code, StatusCode.ERROR
+        )
+        self.assertEqual(spans["ALIGNMENT_ADJUST"].status.status_code, StatusCode.ERROR)
+        self.assertEqual(spans["SCM_CLONE"].status.status_code, StatusCode.UNSET)
+
+    def test_new_trace(self):
+        status, obj = self.post_work({})
+        self.assertEqual(status, 200)
+
+        server = next(
+            span for span in exporter.get_finished_spans() if span.name == "POST /work"
+        )
+        self.assertIsNone(server.parent)
+        self.assertIn(
+            trace.format_trace_id(server.context.trace_id), obj["traceparent"]
+        )
@@ -67,6 +67,28 @@ class TestPrimitives(unittest.TestCase):
         with self.assertRaises(voluptuous.MatchInvalid):
             validation.name_str(False)
 
+    def test_url(self):
+        url = validation.Schema(validation.Url())
+        git_url = validation.Schema(validation.GitUrl())
+
+        for _ in range(2):
+            self.assertEqual("http://w3.org", url("http://w3.org"))
+            self.assertEqual(
+                "git@github.com:project-ncl/repour.git",
+                git_url("git@github.com:project-ncl/repour.git"),
+            )
+
+            with self.assertRaises(voluptuous.MultipleInvalid):
+                url("w3.org")
+            with self.assertRaises(voluptuous.MultipleInvalid):
+                git_url("not a git url")
+
+        # not hashable, checked before the cached parsing
+        with self.assertRaises(voluptuous.MultipleInvalid):
+            url(["http://w3.org"])
+        with self.assertRaises(voluptuous.MultipleInvalid):
+            git_url({"url": "git@github.com:project-ncl/repour.git"})
+
 
 class TestAdjust(unittest.TestCase):
     def test_adjust(self):
@@ -116,6 +138,25 @@ class TestAdjust(unittest.TestCase):
                 }
             )
 
+    def test_adjust_batch(self):
+        spec = {
+            "ref": "2.2.11.Final",
+            "internal_url": {
+                "readwrite": "git@gitlab.com:someproject/someproject.git",
+                "readonly": "https://gitlab.com/someproject/someproject.git",
+            },
+            "callback": {"url": "http://localhost/asd"},
+        }
+        valid = {"adjusts": [spec, dict(spec, ref="2.2.12.Final")]}
+        self.assertEqual(valid, validation.adjust_modeb_batch(valid))
+
+        with self.assertRaises(voluptuous.MultipleInvalid):
+            validation.adjust_modeb_batch({"adjusts": []})
+        with self.assertRaises(voluptuous.MultipleInvalid):
+            validation.adjust_modeb_batch(spec)
+        with self.assertRaises(voluptuous.MultipleInvalid):
+            validation.adjust_modeb_batch({"adjusts": [dict(spec, ref="")]})
+
 
 class TestServerConfig(unittest.TestCase):
     def test_server_config(self):
@@ -0,0 +1,197 @@
+# flake8: noqa
+import asyncio
+import json
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+import textwrap
+import time
+import unittest
+from unittest import mock
+
+import aiohttp
+import aiohttp.web
+
+from repour.server import task_registry, workers
+from repour.server.endpoint import cancel, tasks
+
+loop = asyncio.get_event_loop()
+
+
+class TestSiblings(unittest.TestCase):
+    """
+    This process is the worker 0, the worker 1 is a fake listening on its Unix socket
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.TemporaryDirectory()
+        cls.requests = []
+
+        async def cancel_worker(request):
+            cls.requests.append(request.headers.get("Authorization", None))
+            if request.match_info["task_id"] == "sibling-task":
+                return aiohttp.web.json_response([{"message": "cancelled"}])
+            return aiohttp.web.json_response([], status=404)
+
+        async def tasks_worker(request):
+            return aiohttp.web.json_response(
+                [{"taskId": "sibling-task", "elapsedSeconds": 100, "worker": 1}]
+            )
+
+        app = aiohttp.web.Application()
+        app.router.add_route("POST", "/cancel/{task_id}/worker", cancel_worker)
+        app.router.add_route("GET", "/tasks/worker", tasks_worker)
+
+        cls.app_runner = aiohttp.web.AppRunner(app)
+        loop.run_until_complete(cls.app_runner.setup())
+        site = aiohttp.web.UnixSite(
+            cls.app_runner, workers.get_socket_path(1, cls.directory.name)
+        )
+        loop.run_until_complete(site.start())
+
+    @classmethod
+    def tearDownClass(cls):
+        loop.run_until_complete(cls.app_runner.cleanup())
+        cls.directory.cleanup()
+
+    def setUp(self):
+        for patcher in (
+            mock.patch.object(workers, "worker_index", 0),
+            mock.patch.dict(
+                os.environ, {workers.SOCKET_DIRECTORY_ENV: self.directory.name}
+            ),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_sibling_socket_paths(self):
+        # the worker 2 is not started yet
+        self.assertEqual(
+            workers.get_sibling_socket_paths(),
+            [workers.get_socket_path(1, self.directory.name)],
+        )
+
+    def test_cancel_on_siblings(self):
+        self.assertTrue(
+            loop.run_until_complete(
+                cancel.cancel_on_siblings("sibling-task", "Bearer token")
+            )
+        )
+        self.assertFalse(loop.run_until_complete(cancel.cancel_on_siblings("other")))
+        self.assertEqual(self.requests[-2:], ["Bearer token", None])
+
+    def test_tasks_of_all_workers(self):
+        task_info = task_registry.TaskInfo("callback-local", "/adjust", task_id="local")
+        task_registry.registry.add(task_info)
+        self.addCleanup(task_registry.registry.remove, task_info)
+
+        request = mock.Mock(headers={})
+        response = loop.run_until_complete(tasks.handle_tasks(request))
+
+        task_jsons = json.loads(response.text)
+        self.assertEqual(
+            [(t["taskId"], t["worker"]) for t in task_jsons],
+            [("sibling-task", 1), ("local", 0)],
+        )
+
+    def test_unreachable_sibling(self):
+        responses = loop.run_until_complete(
+            workers.request_siblings(
+                "GET",
+                "/tasks/worker",
+                socket_paths=[os.path.join(self.directory.name, "missing.sock")],
+            )
+        )
+        self.assertEqual(responses, [])
+
+
+SUPERVISOR_SCRIPT = textwrap.dedent(
+    """
+    import os
+    import sys
+    import time
+
+    from repour.server import workers
+
+    workers.MIN_WORKER_UPTIME_SECONDS = 0
+    directory = sys.argv[1]
+
+    def start_worker(index):
+        path = os.path.join(directory, "{}-{}".format(index, os.getpid()))
+        with open(path, "w") as f:
+            f.write(os.environ[workers.PROMETHEUS_MULTIPROC_DIR_ENV])
+        starts = [name for name in os.listdir(directory) if name.startswith("1-")]
+        if index == 1 and len(starts) == 1:
+            # the first start of the worker 1 fails
+            return 3
+        time.sleep(60)
+
+    sys.exit(workers.supervise(2, start_worker))
+    """
+)
+
+
+class TestSupervise(unittest.TestCase):
+    def test_supervise(self):
+        with tempfile.TemporaryDirectory() as directory:
+            env = dict(os.environ)
+            env.pop(workers.PROMETHEUS_MULTIPROC_DIR_ENV, None)
+            supervisor = subprocess.Popen(
+                [sys.executable, "-c", SUPERVISOR_SCRIPT, directory], env=env
+            )
+            try:
+                deadline = time.monotonic() + 20
+                while len(os.listdir(directory)) < 3 and time.monotonic() < deadline:
+                    time.sleep(0.05)
+            finally:
+                supervisor.send_signal(signal.SIGTERM)
+                self.assertEqual(supervisor.wait(timeout=20), 0)
+
+            starts = sorted(os.listdir(directory))
+            # the worker 1 was restarted
+            self.assertEqual([start.split("-")[0] for start in starts], ["0", "1", "1"])
+
+            metrics_directories = set()
+            for start in starts:
+                with open(os.path.join(directory, start)) as f:
+                    metrics_directories.add(f.read())
+            self.assertEqual(len(metrics_directories), 1)
+            # created by the supervisor, and removed at exit
+            self.assertFalse(os.path.exists(metrics_directories.pop()))
+
+
+MULTIPROCESS_METRICS_SCRIPT = textwrap.dedent(
+    """
+    import os
+    import sys
+
+    import repour.main
+    from repour.server import workers
+
+    os.environ[workers.PROMETHEUS_MULTIPROC_DIR_ENV] = sys.argv[1]
+
+    from prometheus_client import Counter
+
+    Counter("multiprocess_test", "Counter of the test").inc()
+    """
+)
+
+
+class TestMultiprocessMetrics(unittest.TestCase):
+    def test_multiprocess_after_main_import(self):
+        with tempfile.TemporaryDirectory() as directory:
+            env = dict(os.environ)
+            env.pop(workers.PROMETHEUS_MULTIPROC_DIR_ENV, None)
+            subprocess.run(
+                [sys.executable, "-c", MULTIPROCESS_METRICS_SCRIPT, directory],
+                env=env,
+                check=True,
+                timeout=60,
+            )
+            # the metrics are in the multiprocess files, not in the process memory
+            self.assertTrue(
+                [name for name in os.listdir(directory) if name.endswith(".db")]
+            )
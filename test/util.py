@@ -87,8 +87,8 @@ def quiet_check_call(cmd, cwd=None):
         )
 
 
-def setup_http(cls, loop, routes):
-    app = aiohttp.web.Application()
+def setup_http(cls, loop, routes, middlewares=()):
+    app = aiohttp.web.Application(middlewares=middlewares)
     for route in routes:
         app.router.add_route(*route)
 